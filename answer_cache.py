@@ -0,0 +1,114 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Hashable, Optional
+
+import numpy as np
+
+logger = logging.getLogger('answer_cache')
+
+
+@dataclass(frozen=True)
+class CachedAnswer:
+    content: str
+    entry: dict
+    # Сколько секунд занял исходный ответ (поиск + запрос к модели)
+    latency: float
+    created_at: float
+
+
+class AnswerCache:
+    """
+    Семантический кэш ответов модели по эмбеддингу вопроса.
+
+    Вопрос считается повтором, если косинусная близость его (нормированного)
+    эмбеддинга к сохранённому не ниже threshold. Записи живут ttl секунд,
+    при переполнении вытесняются давно не использованные. Все записи
+    привязаны к scope (версия каталога, промпт): при смене scope кэш очищается.
+    """
+
+    def __init__(self, threshold: float = 0.95, ttl: float = 24 * 60 * 60, max_entries: int = 1_000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+        self._lock = threading.Lock()
+        self._scope: Optional[Hashable] = None
+        self._vectors = np.empty((0, 0), dtype=np.float32)
+        self._answers: list[CachedAnswer] = []
+        self._last_used: list[float] = []
+
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_scope(self, scope: Hashable):
+        if scope != self._scope:
+            if self._answers:
+                logger.info(f"Кэш ответов сброшен: {len(self._answers)} записей")
+            self._scope = scope
+            self._vectors = np.empty((0, 0), dtype=np.float32)
+            self._answers = []
+            self._last_used = []
+
+    def _drop(self, keep: np.ndarray):
+        self._vectors = self._vectors[keep]
+        self._answers = [a for a, k in zip(self._answers, keep) if k]
+        self._last_used = [t for t, k in zip(self._last_used, keep) if k]
+
+    def get(self, scope: Hashable, vector: np.ndarray) -> Optional[CachedAnswer]:
+        now = time.time()
+        with self._lock:
+            self._check_scope(scope)
+            answer = None
+            if self._answers:
+                expired = np.array([now - a.created_at > self.ttl for a in self._answers])
+                if expired.any():
+                    self._drop(~expired)
+            if self._answers:
+                similarity = self._vectors @ self._normalize(vector)
+                best = int(np.argmax(similarity))
+                if similarity[best] >= self.threshold:
+                    answer = self._answers[best]
+                    self._last_used[best] = now
+
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.saved_seconds += answer.latency
+        return answer
+
+    def put(self, scope: Hashable, vector: np.ndarray, content: str, entry: dict, latency: float):
+        now = time.time()
+        vector = self._normalize(vector).reshape(1, -1)
+        with self._lock:
+            self._check_scope(scope)
+            if len(self._answers) >= self.max_entries:
+                keep = np.ones(len(self._answers), dtype=bool)
+                keep[np.argsort(self._last_used)[:len(self._answers) - self.max_entries + 1]] = False
+                self._drop(keep)
+            self._vectors = np.vstack([self._vectors, vector]) if len(self._answers) else vector
+            self._answers.append(CachedAnswer(content, dict(entry), latency, now))
+            self._last_used.append(now)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self._answers),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'saved_seconds': self.saved_seconds,
+        }
@@ -0,0 +1,95 @@
+"""
+Офлайн-бенчмарк типов FAISS-индекса из gpt_client.make_base_index:
+recall@5 относительно точного flat-поиска, p50/p99 задержка одиночного
+запроса и время построения на синтетических нормированных векторах.
+
+Размерность по умолчанию 256, чтобы 1M векторов помещался в память;
+--dim 1536 соответствует text-embedding-3-small.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_ann --sizes 1000 10000 100000 1000000
+    python -m benchmarks.bench_ann --sizes 100000 --ef-search 32 64 128 --nprobe 4 8 16
+"""
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+import gpt_client
+
+K = 5
+
+
+def synthetic_vectors(n: int, dim: int, clusters: int, rnd: np.random.Generator) -> np.ndarray:
+    # Кластеризованные данные ближе к эмбеддингам каталога, чем равномерный шум
+    centers = rnd.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rnd.integers(0, clusters, n)
+    vectors = centers[labels] + 0.6 * rnd.standard_normal((n, dim)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def search_latencies(index: faiss.Index, queries: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    latencies = np.empty(len(queries))
+    found = np.empty((len(queries), K), dtype=np.int64)
+    for i, q in enumerate(queries):
+        started = time.perf_counter()
+        _, ids = index.search(q.reshape(1, -1), K)
+        latencies[i] = time.perf_counter() - started
+        found[i] = ids[0]
+    return found, latencies
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(np.intersect1d(f, t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument('--dim', type=int, default=256)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--kinds', nargs='+', default=['flat_ip', 'hnsw', 'ivf'])
+    parser.add_argument('--ef-search', type=int, nargs='+', default=[gpt_client.HNSW_EF_SEARCH])
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[gpt_client.IVF_NPROBE])
+    parser.add_argument('--threads', type=int, default=1, help='потоков OpenMP у FAISS')
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.threads)
+    rnd = np.random.default_rng(0)
+
+    print(f"{'n':>8} {'index':<16} {'build, s':>9} {'recall@5':>9} {'p50, ms':>9} {'p99, ms':>9}")
+    for n in args.sizes:
+        clusters = max(8, n // 500)
+        vectors = synthetic_vectors(n, args.dim, clusters, rnd)
+        ids = np.arange(n, dtype=np.int64)
+        queries = synthetic_vectors(args.queries, args.dim, clusters, rnd)
+
+        baseline = gpt_client.build_index(ids, vectors, kind='flat_ip')
+        truth, _ = search_latencies(baseline, queries)
+
+        for kind in args.kinds:
+            started = time.perf_counter()
+            index = gpt_client.build_index(ids, vectors, kind=kind)
+            build_time = time.perf_counter() - started
+            base = faiss.downcast_index(index.index)
+
+            if kind == 'hnsw':
+                variants = [(f"hnsw ef={ef}", lambda ef=ef: setattr(base.hnsw, 'efSearch', ef)) for ef in args.ef_search]
+            elif kind == 'ivf':
+                variants = [(f"ivf nprobe={p}", lambda p=p: setattr(base, 'nprobe', p)) for p in args.nprobe]
+            else:
+                variants = [(kind, lambda: None)]
+
+            for label, configure in variants:
+                configure()
+                found, latencies = search_latencies(index, queries)
+                p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+                print(f"{n:>8} {label:<16} {build_time:>9.2f} {recall_at_k(found, truth):>9.3f} "
+                      f"{p50:>9.3f} {p99:>9.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Бенчмарк поиска изменений каталога: хэширование колонок + diff_catalog
+на синтетических каталогах разного размера. Для сравнения — прежний цикл
+по iterrows() с md5 на строку (только до --legacy-max строк, дальше он слишком долгий).
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_catalog_diff --sizes 1000 10000 100000 300000
+"""
+import argparse
+import hashlib
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.common import synthetic_catalog
+from gpt_client import prepare_products, diff_catalog
+
+
+def mutate(df: pd.DataFrame, fraction: float, seed: int = 1) -> pd.DataFrame:
+    rnd = np.random.default_rng(seed)
+    df = df.copy()
+    n = max(1, int(len(df) * fraction))
+    df.loc[rnd.choice(len(df), n, replace=False), 'price'] += 1
+    df.loc[rnd.choice(len(df), n, replace=False), 'name'] += ' new'
+    df.loc[rnd.choice(len(df), n, replace=False), 'description'] += ' upd'
+    return df.iloc[:len(df) - n]
+
+
+def legacy_diff(raw: pd.DataFrame, metadata: pd.DataFrame) -> list:
+    def hash_text(text: str) -> str:
+        return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+    df = raw.copy()
+    df['id'] = df.index.astype(str)
+    df['name_hash'] = df['name'].apply(hash_text)
+    df['price_hash'] = df['price'].astype(str).apply(hash_text)
+    df['description_hash'] = df['description'].astype(str).apply(hash_text)
+    df = df.set_index('id')
+    changes = []
+    for pid, row in df.iterrows():
+        if pid not in metadata.index:
+            changes.append((pid, 'new'))
+        else:
+            old = metadata.loc[pid]
+            if row['name_hash'] != old['name_hash']:
+                changes.append((pid, 'name_changed'))
+            if row['price_hash'] != old['price_hash']:
+                changes.append((pid, 'price_changed'))
+            if row['description_hash'] != old['description_hash']:
+                changes.append((pid, 'description_changed'))
+    return changes
+
+
+def legacy_metadata(raw: pd.DataFrame) -> pd.DataFrame:
+    md = raw.copy()
+    md['id'] = md.index.astype(str)
+    md['name_hash'] = [hashlib.md5(t.encode('utf-8')).hexdigest() for t in md['name']]
+    md['price_hash'] = [hashlib.md5(str(p).encode('utf-8')).hexdigest() for p in md['price']]
+    md['description_hash'] = [hashlib.md5(t.encode('utf-8')).hexdigest() for t in md['description']]
+    return md.set_index('id')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000, 300_000])
+    parser.add_argument('--fraction', type=float, default=0.01, help='доля изменённых строк каждого вида')
+    parser.add_argument('--legacy-max', type=int, default=20_000)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'hash, ms':>10} {'diff, ms':>10} {'legacy, ms':>12}  changes")
+    for size in args.sizes:
+        base = synthetic_catalog(size)
+        metadata = prepare_products(base.copy())
+        current_raw = mutate(base, args.fraction)
+
+        started = time.perf_counter()
+        current = prepare_products(current_raw.copy())
+        hashed = time.perf_counter()
+        changes = diff_catalog(current, metadata)
+        finished = time.perf_counter()
+
+        legacy = '-'
+        if size <= args.legacy_max:
+            old_md = legacy_metadata(base)
+            legacy_started = time.perf_counter()
+            legacy_diff(current_raw, old_md)
+            legacy = f"{(time.perf_counter() - legacy_started) * 1000:.0f}"
+
+        print(f"{size:>8} {(hashed - started) * 1000:>10.1f} {(finished - hashed) * 1000:>10.1f} "
+              f"{legacy:>12}  {changes.summary()}")
+
+
+if __name__ == '__main__':
+    main()
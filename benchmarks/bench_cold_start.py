@@ -0,0 +1,95 @@
+"""
+Время холодного старта каталога: прежний путь (pandas read_csv, пересчёт хэшей,
+полное чтение products.index) против бинарного снимка и mmap индекса
+(gpt_client.open_catalog). Каталог и векторы синтетические, во временной папке.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_cold_start --rows 1600 100000 --dim 1536
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+import gpt_client
+from benchmarks.common import current_rss_mb, synthetic_catalog
+from catalog_snapshot import write_snapshot, file_fingerprint
+from lexical_index import LexicalIndex
+from price_filter import PriceIndex
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def prepare(workdir: str, rows: int, dim: int):
+    os.makedirs(os.path.join(workdir, 'products'), exist_ok=True)
+    os.chdir(workdir)
+    synthetic_catalog(rows).to_csv(gpt_client.PRODUCT_CSV_PATH, index=False)
+    products = gpt_client.load_products()
+    vectors = np.random.default_rng(0).standard_normal((rows, dim)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    ids = products.index.to_numpy(dtype=np.int64)
+    gpt_client.write_index(gpt_client.build_index(ids, vectors))
+    gpt_client.save_vectors(ids, vectors)
+    LexicalIndex.build(products).save(gpt_client.CATALOG_SNAPSHOT_DIR)
+    PriceIndex.build(products).save(gpt_client.CATALOG_SNAPSHOT_DIR)
+    write_snapshot(gpt_client.CATALOG_SNAPSHOT_DIR, products, file_fingerprint(gpt_client.PRODUCT_CSV_PATH),
+                   gpt_client.embedding_provider.name)
+
+
+def legacy_start():
+    products = gpt_client.load_products()
+    idx = faiss.read_index(gpt_client.INDEX_PATH)
+    return products, idx
+
+
+def snapshot_start():
+    catalog = gpt_client.open_catalog()
+    assert catalog is not None, "снимок не подошёл"
+    return catalog
+
+
+def measure(path: str):
+    """Запускается в отдельном процессе, чтобы честно померить прирост RSS."""
+    rss_before = current_rss_mb()
+    started = time.perf_counter()
+    loaded = legacy_start() if path == 'legacy' else snapshot_start()
+    elapsed = time.perf_counter() - started
+    print(f"{elapsed * 1000:.1f} {current_rss_mb() - rss_before:.0f}")
+    del loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_600, 100_000])
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--measure', choices=['legacy', 'snapshot'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure)
+        return
+
+    print(f"{'rows':>8} {'path':<9} {'time, ms':>10} {'+RSS, MB':>9}")
+    for rows in args.rows:
+        workdir = tempfile.mkdtemp(prefix='bench_cold_start_')
+        try:
+            prepare(workdir, rows, args.dim)
+            for path in ('legacy', 'snapshot'):
+                out = subprocess.run(
+                    [sys.executable, '-m', 'benchmarks.bench_cold_start', '--measure', path],
+                    cwd=workdir, env={**os.environ, 'PYTHONPATH': ROOT}, capture_output=True, text=True, check=True
+                ).stdout.split()
+                print(f"{rows:>8} {path:<9} {float(out[-2]):>10.1f} {float(out[-1]):>9.0f}")
+        finally:
+            os.chdir(ROOT)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Нагрузочный тест конвейера сообщений: прежняя схема (поток Flask блокируется
+на запросе к модели, ответ уходит через threading.Timer) против MessageEngine
+(асинхронные клиенты, пул корутин-воркеров, отложенная отправка на loop.call_at).
+
+Одновременно приходят N сообщений. Для каждого идёт запрос к заглушке
+OpenAI, затем через --delay секунд — вызов imbot.message.add в заглушку
+Bitrix24. Каждая схема запускается в отдельном процессе; в нём раз в 50 мс
+снимаются число потоков и VmRSS, в таблицу попадают пиковые значения.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_engine --messages 50 200 800 --latency 0.5 --delay 5
+"""
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import httpx
+import requests
+
+from benchmarks.common import Sampler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+CHAT = dict(model="gpt-4o-mini", messages=[{"role": "user", "content": "Здравствуйте"}], max_tokens=5)
+
+
+def run_legacy(messages: int, delay: float, webhook_url: str) -> int:
+    import gpt_client
+    client = gpt_client.get_openai_client(None)
+    done = threading.Semaphore(0)
+
+    def send(dialog_id, content):
+        requests.post(f"{webhook_url}/imbot.message.add", data={'DIALOG_ID': dialog_id, 'MESSAGE': content})
+        done.release()
+
+    def handle(dialog_id):
+        content = client.chat.completions.create(**CHAT).choices[0].message.content
+        timer = threading.Timer(delay, send, args=(dialog_id, content))
+        timer.daemon = True
+        timer.start()
+
+    for i in range(messages):
+        # Flask с threaded=True держит по потоку на каждый входящий запрос
+        threading.Thread(target=handle, args=(f"chat{i}",), daemon=True).start()
+    for _ in range(messages):
+        done.acquire()
+    return messages
+
+
+def run_engine(messages: int, delay: float, webhook_url: str) -> int:
+    import gpt_client
+    from engine import MessageEngine
+
+    engine = MessageEngine().start()
+    done = threading.Semaphore(0)
+    bitrix = None
+
+    async def send(dialog_id, content):
+        nonlocal bitrix
+        if bitrix is None:
+            bitrix = httpx.AsyncClient()
+        await bitrix.post(f"{webhook_url}/imbot.message.add", data={'DIALOG_ID': dialog_id, 'MESSAGE': content})
+        done.release()
+
+    async def handle(dialog_id):
+        client = gpt_client.get_async_openai_client(None)
+        content = (await client.chat.completions.create(**CHAT)).choices[0].message.content
+        engine.call_later(delay, send, dialog_id, content)
+
+    for i in range(messages):
+        engine.submit(handle, f"chat{i}")
+    for _ in range(messages):
+        done.acquire()
+    return messages
+
+
+def measure(mode: str, messages: int, delay: float, webhook_url: str):
+    run = run_legacy if mode == 'legacy' else run_engine
+    sampler = Sampler()
+    sampler.start()
+    started = time.perf_counter()
+    run(messages, delay, webhook_url)
+    elapsed = time.perf_counter() - started
+    sampler.stop()
+    print(f"{elapsed:.2f} {sampler.peak_threads} {sampler.peak_rss:.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, nargs='+', default=[50, 200, 800])
+    parser.add_argument('--latency', type=float, default=0.5, help='время ответа заглушки OpenAI, с')
+    parser.add_argument('--delay', type=float, default=5.0, help='задержка перед отправкой ответа, с')
+    parser.add_argument('--measure', nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        mode, messages, delay, webhook_url = args.measure
+        measure(mode, int(messages), float(delay), webhook_url)
+        return
+
+    from benchmarks.stubs import FakeOpenAIServer, FakeBitrixServer
+    openai_stub = FakeOpenAIServer(latency=args.latency).start()
+    bitrix_stub = FakeBitrixServer().start()
+    env = {**os.environ, 'PYTHONPATH': ROOT, 'OPENAI_BASE_URL': openai_stub.base_url}
+
+    print(f"{'messages':>8} {'pipeline':<8} {'total, s':>9} {'threads':>8} {'RSS, MB':>8}")
+    try:
+        for messages in args.messages:
+            for mode in ('legacy', 'engine'):
+                out = subprocess.run(
+                    [sys.executable, '-m', 'benchmarks.bench_engine', '--measure',
+                     mode, str(messages), str(args.delay), bitrix_stub.webhook_url],
+                    cwd=ROOT, env=env, capture_output=True, text=True, check=True
+                ).stdout.split()
+                print(f"{messages:>8} {mode:<8} {float(out[-3]):>9.2f} {int(out[-2]):>8} {float(out[-1]):>8.0f}")
+    finally:
+        openai_stub.stop()
+        bitrix_stub.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Нагрузочный бенчмарк HistoryManager: сколько сообщений в секунду
+выдерживает история при 1, 8 и 32 одновременных диалогах.
+
+Одно «сообщение» повторяет путь webhook_handler: проверка ЧС,
+сброс этапа напоминаний, чтение истории и запись двух реплик.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_history --messages 2000
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from utils import HistoryManager
+
+def handle_message(hm: HistoryManager, peer_id: str, n: int) -> None:
+    if hm.in_blacklist(peer_id):
+        return
+    hm.set_stage(peer_id, 0)
+    hm.get_history(peer_id)
+    hm.add_message(peer_id, {"role": "user", "content": f"вопрос {n}"})
+    hm.add_message(peer_id, {"role": "assistant", "content": f"ответ {n}"})
+
+
+def run(db_path: str, dialogs: int, messages: int, pool_size: int) -> float:
+    hm = HistoryManager(db_path=db_path, max_history_length=10, pool_size=pool_size)
+    per_dialog = max(1, messages // dialogs)
+
+    def dialog(i: int):
+        peer_id = f"chat{i}"
+        for n in range(per_dialog):
+            handle_message(hm, peer_id, n)
+
+    threads = [threading.Thread(target=dialog, args=(i,)) for i in range(dialogs)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    hm.close()
+    return per_dialog * dialogs / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=2000, help='сообщений на один прогон')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--pool-sizes', type=int, nargs='+', default=[1, 4, 8])
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='bench_history_')
+    try:
+        print(f"{'dialogs':>8} {'pool':>6} {'msg/s':>10}")
+        for pool_size in args.pool_sizes:
+            for dialogs in args.concurrency:
+                db_path = os.path.join(tmp, f'bench_{pool_size}_{dialogs}.sqlt')
+                rate = run(db_path, dialogs, args.messages, pool_size)
+                print(f"{dialogs:>8} {pool_size:>6} {rate:>10.0f}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Бенчмарк индексов database.sqlt: время горячих запросов HistoryManager
+на таблице dialog_history из 1M строк до и после миграции с индексами.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_indexes --rows 1000000 --peers 20000
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from utils import HistoryManager, apply_migrations
+
+QUERIES = {
+    'get_history': ("""
+        SELECT role, content FROM dialog_history
+        WHERE peer_id = ? ORDER BY id ASC LIMIT 10
+    """, lambda peer: (peer,)),
+    'add_message COUNT(*)': ("""
+        SELECT COUNT(*) FROM dialog_history WHERE peer_id = ?
+    """, lambda peer: (peer,)),
+    'get_last_user_timestamp': ("""
+        SELECT timestamp FROM dialog_history
+        WHERE peer_id = ? AND role = 'user' ORDER BY id DESC LIMIT 1
+    """, lambda peer: (peer,)),
+    'in_blacklist': ("""
+        SELECT 1 FROM blacklist WHERE peer_id = ?
+    """, lambda peer: (peer,)),
+}
+
+
+def fill(conn: sqlite3.Connection, rows: int, peers: int) -> None:
+    roles = ('user', 'assistant')
+    batch = []
+    for i in range(rows):
+        batch.append((f"chat{i % peers}", roles[i % 2], f"сообщение {i}"))
+        if len(batch) == 50_000:
+            conn.executemany("INSERT INTO dialog_history(peer_id, role, content) VALUES (?, ?, ?)", batch)
+            batch.clear()
+    if batch:
+        conn.executemany("INSERT INTO dialog_history(peer_id, role, content) VALUES (?, ?, ?)", batch)
+    conn.executemany("INSERT INTO blacklist(peer_id, reason) VALUES (?, 'manager')",
+                     [(f"chat{i}",) for i in range(0, peers, 10)])
+    conn.commit()
+
+
+def measure(conn: sqlite3.Connection, peers: int, repeats: int) -> dict[str, float]:
+    rnd = random.Random(42)
+    sample = [f"chat{rnd.randrange(peers)}" for _ in range(repeats)]
+    result = {}
+    for name, (sql, params) in QUERIES.items():
+        started = time.perf_counter()
+        for peer in sample:
+            conn.execute(sql, params(peer)).fetchall()
+        result[name] = (time.perf_counter() - started) / repeats * 1000
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--peers', type=int, default=20_000)
+    parser.add_argument('--repeats', type=int, default=50)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='bench_indexes_')
+    try:
+        db_path = os.path.join(tmp, 'bench.sqlt')
+        conn = sqlite3.connect(db_path)
+        apply_migrations(conn, target=1)
+        fill(conn, args.rows, args.peers)
+        before = measure(conn, args.peers, args.repeats)
+
+        started = time.perf_counter()
+        conn.close()
+        HistoryManager(db_path=db_path).close()
+        migrate_time = time.perf_counter() - started
+
+        conn = sqlite3.connect(db_path)
+        after = measure(conn, args.peers, args.repeats)
+        conn.close()
+
+        print(f"rows={args.rows} peers={args.peers}, миграция заняла {migrate_time:.1f} s")
+        print(f"{'query':<26} {'no index, ms':>14} {'indexed, ms':>12}")
+        for name in QUERIES:
+            print(f"{name:<26} {before[name]:>14.3f} {after[name]:>12.3f}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Лексический индекс BM25 (lexical_index.LexicalIndex): время построения
+и задержка поиска и проверки точного совпадения на синтетическом каталоге.
+
+Каталог — benchmarks.common.synthetic_catalog, описания по 60 слов. Запросы — от одного до четырёх
+слов из названий случайных товаров, треть из них — с артикулом.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_lexical --sizes 1000 10000 100000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.common import synthetic_catalog
+from lexical_index import LexicalIndex
+
+def queries(products: pd.DataFrame, n: int, rnd: np.random.Generator) -> list[str]:
+    result = []
+    for i in rnd.integers(0, len(products), n):
+        tokens = products['name'].iat[i].split()
+        picked = list(rnd.choice(tokens[:-1], min(len(tokens) - 1, rnd.integers(1, 5)), replace=False))
+        if rnd.random() < 1 / 3:
+            picked.append(tokens[-1])
+        result.append(' '.join(picked))
+    return result
+
+
+def latencies(fn, items: list[str]) -> np.ndarray:
+    result = np.empty(len(items))
+    for i, item in enumerate(items):
+        started = time.perf_counter()
+        fn(item)
+        result[i] = time.perf_counter() - started
+    return result * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000])
+    parser.add_argument('--queries', type=int, default=2_000)
+    parser.add_argument('--k', type=int, default=20)
+    args = parser.parse_args()
+
+    rnd = np.random.default_rng(1)
+    print(f"{'n':>8} {'build, s':>9} {'terms':>8} {'search p50/p99, ms':>20} {'exact p50/p99, ms':>19} {'exact hits':>11}")
+    for n in args.sizes:
+        products = synthetic_catalog(n, description_words=(60, 60))
+        products.index = pd.Index(np.arange(n, dtype=np.int64), name='id')
+        started = time.perf_counter()
+        index = LexicalIndex.build(products)
+        build_time = time.perf_counter() - started
+
+        items = queries(products, args.queries, rnd)
+        # Прогрев кэша основ слов, как у работающего бота
+        for item in items:
+            index.search(item, args.k)
+        search = latencies(lambda q: index.search(q, args.k), items)
+        exact = latencies(lambda q: index.exact_match(q, 5), items)
+        hits = sum(index.exact_match(q, 5) is not None for q in items)
+        print(f"{n:>8} {build_time:>9.2f} {len(index.vocab):>8} "
+              f"{np.percentile(search, 50):>9.3f} / {np.percentile(search, 99):<8.3f} "
+              f"{np.percentile(exact, 50):>8.3f} / {np.percentile(exact, 99):<8.3f} {hits / len(items):>10.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+"""
+Нагрузочный тест бота целиком: сколько одновременных диалогов выдерживает
+bitrix_openline.webhook_handler вместе с движком сообщений, поиском по каталогу
+и клиентами OpenAI и Bitrix24.
+
+Бот запускается в отдельном процессе, как в продакшене (Flask threaded=True,
+MessageEngine, reminder_worker, каталог из products/products.csv), но OpenAI
+и входящий вебхук Bitrix24 подменены локальными заглушками с настраиваемыми
+задержками и долей ошибок. Настройки бота — фиксированный BotSettings вместо
+строки Bot в базе Django, история — свежая база во временной папке.
+
+На бота с заданной частотой (открытая модель: отправка не ждёт ответа)
+идут формы ONIMBOTMESSAGEADD — синтетические по названиям и ценам товаров
+или записанные: строки ImmutableMultiDict(...), которые webhook_handler пишет
+в logs/bot.log. Задержка сообщения — от отправки формы до момента, когда
+ответ в этот диалог пришёл в заглушку Bitrix24 (imbot.message.add).
+Раз в 50 мс у процесса бота снимаются число потоков и VmRSS.
+
+Окно ответа REPLY_DELAY по умолчанию выключено (--reply-delay 0), чтобы
+задержка показывала только обработку; с ним она включает и ожидание окна.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_load --rate 5 20 50 --duration 30 --chat-latency 1.5
+    python -m benchmarks.bench_load --replay logs/bot.log --rate 10
+"""
+import argparse
+import ast
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import requests
+
+from benchmarks.common import Sampler, proc_status
+from benchmarks.stubs import FakeOpenAIServer, FakeBitrixServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PRODUCTS_CSV = os.path.join(ROOT, 'products', 'products.csv')
+
+RECORDED_FORM_RE = re.compile(r'ImmutableMultiDict\((\[.*\])\)\s*$')
+QUESTIONS = [
+    'Здравствуйте! Сколько стоит {name}?',
+    '{name}',
+    'Подскажите аппарат для лица до {price} рублей',
+    'Есть ли в наличии {name}? Какая гарантия?',
+    'Нужен аппарат для массажа тела, бюджет {price}',
+    'Чем {name} отличается от аналогов?',
+]
+
+
+# ---------- Процесс бота ----------
+
+def serve(port: int, reply_delay: float, bitrix_url: str, bitrix_rate: float):
+    """
+    Запускается в отдельном процессе в рабочей папке с products/products.csv.
+    Подменяет внешние зависимости bitrix_openline и запускает его main().
+    """
+    import logging
+    # Лог бота — в рабочую папку, а не в logs/bot.log репозитория; basicConfig модулей бота уже ничего не меняет
+    logging.basicConfig(level=logging.INFO, handlers=[logging.FileHandler('bot.log', encoding='utf-8')])
+
+    import bitrix_openline as bot
+    from bitrix_client import BitrixClient, TokenBucket, BITRIX_BURST
+    from settings_cache import BotSettings, SettingsCache
+
+    settings = BotSettings(
+        version=1, last_change=None, interval_first=24, interval_second=72,
+        text_one_remember='Подскажите, остались ли у вас вопросы?',
+        text_two_remember='Будем рады помочь с выбором оборудования.',
+        system_prompt='Ты консультант магазина косметологического оборудования. Отвечай кратко.',
+        ban_words=(), ban_pattern=None, proxy_host='', proxy_port='', proxy_user='', proxy_password='',
+    )
+    bot.settings_cache = SettingsCache(loader=lambda: settings, version_loader=lambda: settings.version)
+    bot.bitrix = BitrixClient(bitrix_url, limiter=TokenBucket(bitrix_rate, BITRIX_BURST))
+    bot.REPLY_DELAY = reply_delay
+    bot.main(host='127.0.0.1', port=port)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port: int, process: subprocess.Popen, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"бот завершился с кодом {process.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(f"бот не открыл порт {port} за {timeout:.0f} с")
+
+
+# ---------- Нагрузка ----------
+
+def message_form(dialog_id: str, text: str, message_id: int) -> list[tuple[str, str]]:
+    # Поля, которые Bitrix24 присылает боту открытой линии; бот читает только часть из них
+    return [
+        ('event', 'ONIMBOTMESSAGEADD'),
+        ('data[PARAMS][DIALOG_ID]', dialog_id),
+        ('data[PARAMS][CHAT_ID]', dialog_id.replace('chat', '')),
+        ('data[PARAMS][MESSAGE_ID]', str(message_id)),
+        ('data[PARAMS][MESSAGE]', text),
+        ('data[PARAMS][FROM_USER_ID]', str(message_id % 997 + 1)),
+        ('data[PARAMS][CHAT_ENTITY_TYPE]', 'LINES'),
+        ('data[PARAMS][SYSTEM]', 'N'),
+        ('data[USER][NAME]', 'Нагрузочный тест'),
+        ('ts', str(int(time.time()))),
+    ]
+
+
+def synthetic_forms(count: int, dialogs: int, seed: int = 0) -> list[list[tuple[str, str]]]:
+    """
+    count сообщений в dialogs диалогах, вперемешку: соседние формы — из разных
+    диалогов, так что реплики одного диалога не склеиваются окном ответа.
+    """
+    rnd = np.random.default_rng(seed)
+    products = pd.read_csv(PRODUCTS_CSV)
+    names = products['name'].dropna().to_numpy()
+    forms = []
+    for i in range(count):
+        template = QUESTIONS[rnd.integers(len(QUESTIONS))]
+        text = template.format(name=rnd.choice(names), price=int(rnd.integers(5, 300)) * 1000)
+        forms.append(message_form(f"chat{i % dialogs}", text, i))
+    return forms
+
+
+def recorded_forms(path: str) -> list[list[tuple[str, str]]]:
+    forms = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            match = RECORDED_FORM_RE.search(line)
+            if match is None:
+                continue
+            try:
+                form = ast.literal_eval(match.group(1))
+            except (ValueError, SyntaxError):
+                continue
+            if ('event', 'ONIMBOTMESSAGEADD') in form:
+                forms.append(form)
+    return forms
+
+
+def relabel(forms: list[list[tuple[str, str]]], run: int) -> list[list[tuple[str, str]]]:
+    """
+    Переименовывает диалоги, чтобы прогоны не делили историю и чёрный список:
+    каждый исходный dialog_id получает свой новый в пределах прогона.
+    """
+    mapping = {}
+    result = []
+    for form in forms:
+        dialog_id = dict(form).get('data[PARAMS][DIALOG_ID]', '')
+        new_id = mapping.setdefault(dialog_id, f"chat{run}{len(mapping):06d}")
+        result.append([
+            (key, new_id if key == 'data[PARAMS][DIALOG_ID]' else
+             new_id.replace('chat', '') if key == 'data[PARAMS][CHAT_ID]' else value)
+            for key, value in form
+        ])
+    return result
+
+
+def send_all(url: str, forms: list, rate: float) -> list[tuple[str, float, int]]:
+    """
+    Отправляет формы с частотой rate в секунду, не дожидаясь ответов.
+    Возвращает (dialog_id, момент отправки, HTTP-статус) по каждой форме.
+    """
+    local = threading.local()
+    sent: list[tuple[str, float, int] | None] = [None] * len(forms)
+
+    def post(i: int):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        dialog_id = dict(forms[i]).get('data[PARAMS][DIALOG_ID]', '')
+        started = time.monotonic()
+        try:
+            status = session.post(url, data=forms[i], timeout=30).status_code
+        except requests.RequestException:
+            status = 0
+        sent[i] = (dialog_id, started, status)
+
+    with ThreadPoolExecutor(max_workers=64, thread_name_prefix='load') as pool:
+        start = time.monotonic()
+        for i in range(len(forms)):
+            pause = start + i / rate - time.monotonic()
+            if pause > 0:
+                time.sleep(pause)
+            pool.submit(post, i)
+    return sent
+
+
+def wait_for_replies(bitrix: FakeBitrixServer, expected: dict[str, int], timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        delivered = bitrix.delivered
+        if all(len(delivered.get(d, ())) >= n for d, n in expected.items()):
+            return
+        time.sleep(0.1)
+
+
+def latencies(sent: list[tuple[str, float, int]], delivered: dict[str, list[float]]) -> np.ndarray:
+    """
+    k-я доставленная реплика диалога считается ответом на его k-е сообщение.
+    Сообщения без ответа (отфильтрованные, потерянные) в выборку не входят.
+    """
+    by_dialog: dict[str, list[float]] = {}
+    for dialog_id, started, status in sent:
+        if status == 200:
+            by_dialog.setdefault(dialog_id, []).append(started)
+    result = []
+    for dialog_id, starts in by_dialog.items():
+        for started, replied in zip(sorted(starts), sorted(delivered.get(dialog_id, ()))):
+            result.append(replied - started)
+    return np.array(result) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rate', type=float, nargs='+', default=[5, 20, 50], help='сообщений в секунду')
+    parser.add_argument('--duration', type=float, default=20, help='длительность прогона, с')
+    parser.add_argument('--turns', type=int, default=3, help='сообщений на синтетический диалог')
+    parser.add_argument('--replay', help='лог бота с записанными формами вместо синтетических')
+    parser.add_argument('--reply-delay', type=float, default=0.0, help='окно ответа REPLY_DELAY, с')
+    parser.add_argument('--embedding-latency', type=float, default=0.15)
+    parser.add_argument('--chat-latency', type=float, default=1.0)
+    parser.add_argument('--openai-failure-rate', type=float, default=0.0)
+    parser.add_argument('--bitrix-latency', type=float, default=0.05)
+    parser.add_argument('--bitrix-failure-rate', type=float, default=0.0)
+    parser.add_argument('--bitrix-rate', type=float, default=1000.0,
+                        help='лимит клиента Bitrix24, запросов в секунду (в продакшене 2)')
+    parser.add_argument('--drain', type=float, default=60, help='сколько ждать ответов после отправки, с')
+    parser.add_argument('--serve', nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        port, reply_delay, bitrix_url, bitrix_rate = args.serve
+        serve(int(port), float(reply_delay), bitrix_url, float(bitrix_rate))
+        return
+
+    recorded = recorded_forms(args.replay) if args.replay else None
+    if recorded is not None and not recorded:
+        parser.error(f"в {args.replay} нет записанных форм ONIMBOTMESSAGEADD")
+
+    openai_stub = FakeOpenAIServer(latency=args.embedding_latency, chat_latency=args.chat_latency,
+                                   failure_rate=args.openai_failure_rate).start()
+    bitrix_stub = FakeBitrixServer(latency=args.bitrix_latency, failure_rate=args.bitrix_failure_rate).start()
+    workdir = tempfile.mkdtemp(prefix='bench_load_')
+    os.makedirs(os.path.join(workdir, 'products'))
+    shutil.copy(PRODUCTS_CSV, os.path.join(workdir, 'products', 'products.csv'))
+    port = free_port()
+    env = {**os.environ, 'PYTHONPATH': ROOT, 'OPENAI_BASE_URL': openai_stub.base_url}
+    bot = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.bench_load', '--serve',
+         str(port), str(args.reply_delay), bitrix_stub.webhook_url, str(args.bitrix_rate)],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(port, bot, timeout=300)
+        url = f"http://127.0.0.1:{port}/"
+        threads, rss = proc_status(bot.pid)
+        print(f"бот готов: потоков {threads}, RSS {rss:.0f} MB\n")
+        print(f"{'rate':>6} {'sent':>6} {'replied':>8} {'errors':>7} {'msg/s':>7} "
+              f"{'p50, ms':>8} {'p95, ms':>8} {'p99, ms':>8} {'threads':>8} {'RSS, MB':>8} "
+              f"{'openai':>7} {'429':>5}")
+        for run, rate in enumerate(args.rate, 1):
+            count = max(1, int(rate * args.duration))
+            if recorded is not None:
+                forms = relabel((recorded * (count // len(recorded) + 1))[:count], run)
+            else:
+                forms = relabel(synthetic_forms(count, max(1, count // args.turns), seed=run), run)
+            openai_before, failed_before = openai_stub.requests, openai_stub.failed
+
+            sampler = Sampler(bot.pid)
+            sampler.start()
+            sent = send_all(url, forms, rate)
+            expected: dict[str, int] = {}
+            for dialog_id, _, status in sent:
+                if status == 200:
+                    expected[dialog_id] = expected.get(dialog_id, 0) + 1
+            wait_for_replies(bitrix_stub, expected, args.drain)
+            sampler.stop()
+
+            delivered = {d: list(bitrix_stub.delivered.get(d, ())) for d in expected}
+            latency = latencies(sent, delivered)
+            replied = len(latency)
+            errors = sum(status != 200 for _, _, status in sent)
+            first_sent = min(started for _, started, _ in sent)
+            last_reply = max((t for times in delivered.values() for t in times), default=first_sent)
+            throughput = replied / (last_reply - first_sent) if last_reply > first_sent else 0.0
+            p50, p95, p99 = np.percentile(latency, [50, 95, 99]) if replied else (np.nan,) * 3
+            print(f"{rate:>6g} {len(sent):>6} {replied:>8} {errors:>7} {throughput:>7.1f} "
+                  f"{p50:>8.0f} {p95:>8.0f} {p99:>8.0f} {sampler.peak_threads:>8} {sampler.peak_rss:>8.0f} "
+                  f"{openai_stub.requests - openai_before:>7} {openai_stub.failed - failed_before:>5}")
+    finally:
+        bot.terminate()
+        bot.wait(timeout=10)
+        openai_stub.stop()
+        bitrix_stub.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
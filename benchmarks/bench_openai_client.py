@@ -0,0 +1,84 @@
+"""
+Сравнение задержки вызовов OpenAI: новый клиент на каждый запрос (холодное
+соединение, как было раньше) против общего keep-alive клиента gpt_client.
+
+По умолчанию запросы идут в локальную заглушку с искусственной стоимостью
+установки соединения. С --base-url можно померить настоящий эндпоинт
+(тогда нужен OPENAI_API_KEY в config.py и, при необходимости, --proxy).
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_openai_client --calls 50 --handshake-delay 0.15
+"""
+import argparse
+import statistics
+import time
+
+import httpx
+from openai import OpenAI
+
+import gpt_client
+from benchmarks.stubs import FakeOpenAIServer
+
+
+def call(client: OpenAI):
+    client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[{"role": "user", "content": "Здравствуйте"}],
+        max_tokens=5,
+    )
+
+
+def cold(base_url: str, proxy: str | None, api_key: str) -> float:
+    started = time.perf_counter()
+    with httpx.Client(proxy=proxy) as http_client:
+        call(OpenAI(api_key=api_key, base_url=base_url, http_client=http_client))
+    return time.perf_counter() - started
+
+
+def warm(client: OpenAI) -> float:
+    started = time.perf_counter()
+    call(client)
+    return time.perf_counter() - started
+
+
+def report(name: str, samples: list[float]):
+    samples = sorted(samples)
+    p50 = statistics.median(samples) * 1000
+    p95 = samples[int(len(samples) * 0.95) - 1] * 1000
+    print(f"{name:<6} p50={p50:8.1f} ms  p95={p95:8.1f} ms  mean={statistics.mean(samples) * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=50)
+    parser.add_argument('--base-url', default=None)
+    parser.add_argument('--proxy', default=None)
+    parser.add_argument('--latency', type=float, default=0.02, help='время ответа заглушки, с')
+    parser.add_argument('--handshake-delay', type=float, default=0.15,
+                        help='стоимость нового соединения в заглушке, с')
+    args = parser.parse_args()
+
+    server = None
+    base_url, api_key = args.base_url, gpt_client.OPENAI_API_KEY
+    if base_url is None:
+        server = FakeOpenAIServer(latency=args.latency, handshake_delay=args.handshake_delay).start()
+        base_url, api_key = server.base_url, 'sk-stub'
+
+    try:
+        cold_samples = [cold(base_url, args.proxy, api_key) for _ in range(args.calls)]
+
+        client = gpt_client.get_openai_client(args.proxy).with_options(base_url=base_url, api_key=api_key)
+        warm(client)  # первое соединение пула
+        warm_samples = [warm(client) for _ in range(args.calls)]
+
+        report('cold', cold_samples)
+        report('warm', warm_samples)
+        if server is not None:
+            print(f"соединений открыто заглушкой: {server.connections} на {server.requests} запросов")
+    finally:
+        if server is not None:
+            server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Эмбеддинги каталога при полной пересборке (gpt_client.embed_products):
+время в зависимости от EMBEDDING_CONCURRENCY, число запросов и повторов,
+и продолжение прерванной сборки с контрольной точки (кэша эмбеддингов).
+
+Заглушка OpenAI отвечает с задержкой latency + latency_per_input на каждый
+текст батча и на долю запросов failure_rate отвечает 429. Последовательная
+сборка (concurrency 1) соответствует прежнему циклу по батчам.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_rebuild --items 50000 --concurrency 1 4 8 16
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+
+import gpt_client
+from benchmarks.common import synthetic_catalog
+from benchmarks.stubs import FakeOpenAIServer
+from embedding_cache import EmbeddingCache
+
+
+def use_cache(directory: str):
+    # Каждый прогон начинается с пустого кэша эмбеддингов
+    os.makedirs(directory)
+    gpt_client.embedding_cache.close()
+    gpt_client.embedding_cache = EmbeddingCache(os.path.join(directory, 'embeddings_cache.sqlt'))
+
+
+def crash_after(batches: int):
+    """
+    Подменяет запрос батча так, что после batches успешных батчей сборка падает.
+    Возвращает функцию, восстанавливающую исходный запрос.
+    """
+    pipeline = gpt_client.embedding_pipeline
+    original, done = pipeline.embed, iter(range(batches))
+
+    def embed(texts):
+        if next(done, None) is None:
+            raise RuntimeError("сборка прервана")
+        return original(texts)
+
+    pipeline.embed = embed
+    return lambda: setattr(pipeline, 'embed', original)
+
+
+def run(products: pd.DataFrame, concurrency: int) -> tuple[float, int, int]:
+    pipeline = gpt_client.embedding_pipeline
+    pipeline.concurrency = concurrency
+    requests_before, retried_before = pipeline.requests, pipeline.retried
+    started = time.perf_counter()
+    vectors = gpt_client.embed_products(products)
+    elapsed = time.perf_counter() - started
+    assert vectors.shape[0] == len(products)
+    return elapsed, pipeline.requests - requests_before, pipeline.retried - retried_before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=50_000)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--latency-per-input', type=float, default=0.002)
+    parser.add_argument('--failure-rate', type=float, default=0.03)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(latency=args.latency, latency_per_input=args.latency_per_input,
+                              failure_rate=args.failure_rate, dim=64).start()
+    client = gpt_client.get_openai_client(None).with_options(base_url=server.base_url, api_key='bench',
+                                                             max_retries=0)
+    gpt_client.openai_client = client
+    gpt_client.embedding_pipeline.backoff = 0.05
+    products = synthetic_catalog(args.items)
+    directory = tempfile.mkdtemp(prefix='bench_rebuild_')
+    try:
+        print(f"{'concurrency':>11} {'time, s':>8} {'speedup':>8} {'requests':>9} {'retried':>8}")
+        baseline = None
+        for concurrency in args.concurrency:
+            use_cache(os.path.join(directory, str(concurrency)))
+            elapsed, requests, retried = run(products, concurrency)
+            baseline = baseline or elapsed
+            print(f"{concurrency:>11} {elapsed:>8.1f} {baseline / elapsed:>7.1f}x {requests:>9} {retried:>8}")
+
+        # Сборка падает после половины батчей полного прогона; повторная берёт готовое из кэша
+        concurrency = max(args.concurrency)
+        use_cache(os.path.join(directory, 'resume'))
+        restore = crash_after(requests // 2)
+        try:
+            run(products, concurrency)
+        except RuntimeError:
+            pass
+        finally:
+            restore()
+        cached = sum(v is not None for v in gpt_client.embedding_cache.get_many(
+            gpt_client.EMBEDDING_MODEL, gpt_client.product_texts(products)))
+        elapsed, resumed, _ = run(products, concurrency)
+        print(f"\nпосле падения на середине: в кэше {cached} из {len(products)}, "
+              f"повторная сборка — {resumed} запросов (полная — {requests}), {elapsed:.1f} с")
+    finally:
+        server.stop()
+        gpt_client.embedding_cache.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
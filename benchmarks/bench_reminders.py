@@ -0,0 +1,95 @@
+"""
+Рассылка напоминаний, когда срок наступил сразу у N диалогов: прежний цикл
+reminder_worker (вызов imbot.message.add и set_stage на каждый диалог) против
+reminders.dispatch_reminders (batch по 50 команд, токен-бакет под лимит
+Bitrix24, один коммит этапов на пачку, повтор отложенных).
+
+Заглушка Bitrix24 держит тот же лимит, что и REST API (по умолчанию 2 запроса
+в секунду, всплеск 50) и сверх него отвечает QUERY_LIMIT_EXCEEDED. «Потеряно» —
+диалоги, у которых этап сдвинулся, а сообщение заглушка не приняла.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_reminders --dialogs 10000
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+import requests
+
+from benchmarks.stubs import FakeBitrixServer
+from bitrix_client import BitrixClient, TokenBucket
+from reminders import dispatch_reminders
+from utils import HistoryManager
+
+TEXTS = {0: 'Вы ещё здесь? Могу помочь с выбором.', 1: 'Если появятся вопросы — пишите!'}
+
+
+def command(dialog_id, text):
+    return 'imbot.message.add', {'BOT_ID': 1, 'DIALOG_ID': dialog_id, 'MESSAGE': text, 'CLIENT_ID': 'bench'}
+
+
+def seed(history_manager: HistoryManager, dialogs: int):
+    with history_manager._connection() as conn, conn:
+        conn.executemany(
+            "INSERT INTO reminder_status (peer_id, stage, last_user_at) VALUES (?, 0, '2000-01-01 00:00:00')",
+            [(f"chat{i}",) for i in range(dialogs)]
+        )
+
+
+def run_legacy(history_manager: HistoryManager, webhook_url: str):
+    # Как было: ответ с ошибкой только логировался, этап сдвигался всё равно
+    for dialog_id, stage, _ in history_manager.get_due_reminders(60, 60):
+        method, params = command(dialog_id, TEXTS[stage])
+        requests.post(f"{webhook_url}/{method}", data=params)
+        history_manager.set_stage(dialog_id, stage + 1)
+
+
+async def run_dispatch(history_manager: HistoryManager, webhook_url: str, rate: float, burst: int):
+    bitrix = BitrixClient(webhook_url, limiter=TokenBucket(rate, burst), backoff=0.2)
+    try:
+        while True:
+            due = await asyncio.to_thread(history_manager.get_due_reminders, 60, 10 ** 9)
+            if not due:
+                return
+            result = await dispatch_reminders(bitrix, history_manager, due, TEXTS, command)
+            if result.deferred:
+                await asyncio.sleep(1)
+    finally:
+        await bitrix.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dialogs', type=int, default=10_000)
+    parser.add_argument('--rate', type=float, default=2.0, help='лимит заглушки, запросов в секунду')
+    parser.add_argument('--burst', type=int, default=50, help='всплеск лимита заглушки')
+    parser.add_argument('--latency', type=float, default=0.02, help='время ответа заглушки, с')
+    args = parser.parse_args()
+
+    print(f"{'path':<9} {'time, s':>8} {'sent':>7} {'lost':>7} {'HTTP':>6} {'rejected':>9} {'sent/s':>8}")
+    for path in ('legacy', 'dispatch'):
+        workdir = tempfile.mkdtemp(prefix='bench_reminders_')
+        stub = FakeBitrixServer(latency=args.latency, rate_limit=(args.rate, args.burst)).start()
+        history_manager = HistoryManager(os.path.join(workdir, 'database.sqlt'))
+        try:
+            seed(history_manager, args.dialogs)
+            started = time.perf_counter()
+            if path == 'legacy':
+                run_legacy(history_manager, stub.webhook_url)
+            else:
+                asyncio.run(run_dispatch(history_manager, stub.webhook_url, args.rate, args.burst))
+            elapsed = time.perf_counter() - started
+            print(f"{path:<9} {elapsed:>8.1f} {stub.calls:>7} {args.dialogs - stub.calls:>7} "
+                  f"{stub.requests:>6} {stub.rejected:>9} {stub.calls / elapsed:>8.1f}")
+        finally:
+            history_manager.close()
+            stub.stop()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Поиск товаров без сети: локальные эмбеддинги (embedding_providers.LocalEmbeddingProvider),
+полная сборка каталога и задержка gpt_client.retrieve_products_with_history —
+эмбеддинг реплики, FAISS, BM25, слияние RRF и фрагменты контекста.
+
+Каталог и запросы синтетические (benchmarks.common и bench_lexical), сборка идёт во временной
+папке. Пропускная способность эмбеддингов меряется для каждого размера пула
+процессов из --workers; каталог собирается с последним из них.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_retrieval --sizes 10000 100000 --workers 1 4
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import gpt_client
+from benchmarks.bench_lexical import queries
+from benchmarks.common import synthetic_catalog
+from embedding_providers import LocalEmbeddingProvider, LOCAL_CHUNK_SIZE, LOCAL_INLINE_TEXTS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def embed_throughput(texts: list[str], dim: int, workers: int) -> float:
+    provider = LocalEmbeddingProvider(dim, workers)
+    try:
+        # Пул процессов поднимается лениво — прогреваем его вне замера
+        provider.embed(texts[:max(LOCAL_INLINE_TEXTS, provider.workers * LOCAL_CHUNK_SIZE)])
+        started = time.perf_counter()
+        provider.embed(texts)
+        return len(texts) / (time.perf_counter() - started)
+    finally:
+        provider.close()
+
+
+async def retrieval_latencies(items: list[str], k: int) -> np.ndarray:
+    result = np.empty(len(items))
+    for i, item in enumerate(items):
+        started = time.perf_counter()
+        await gpt_client.retrieve_products_with_history([], item, k)
+        result[i] = time.perf_counter() - started
+    return result * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, os.cpu_count() or 1])
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--queries', type=int, default=1_000)
+    parser.add_argument('--k', type=int, default=gpt_client.TOP_K)
+    args = parser.parse_args()
+
+    rnd = np.random.default_rng(1)
+    print(f"{'n':>8} {'workers':>8} {'embed, texts/s':>15}")
+    results = []
+    for n in args.sizes:
+        workdir = tempfile.mkdtemp(prefix='bench_retrieval_')
+        try:
+            os.makedirs(os.path.join(workdir, 'products'))
+            os.chdir(workdir)
+            synthetic_catalog(n).to_csv(gpt_client.PRODUCT_CSV_PATH, index=False)
+            texts = gpt_client.product_texts(gpt_client.load_products())
+            for workers in args.workers:
+                print(f"{n:>8} {workers:>8} {embed_throughput(texts, args.dim, workers):>15.0f}")
+
+            gpt_client.embedding_provider = LocalEmbeddingProvider(args.dim, args.workers[-1])
+            started = time.perf_counter()
+            gpt_client._catalog = gpt_client.build_catalog()
+            build_time = time.perf_counter() - started
+
+            products = gpt_client.load_products()
+            items = queries(products, args.queries, rnd)
+            asyncio.run(retrieval_latencies(items[:100], args.k))
+            latency = asyncio.run(retrieval_latencies(items, args.k))
+            results.append((n, build_time, latency))
+        finally:
+            gpt_client.embedding_provider.close()
+            os.chdir(ROOT)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\n{'n':>8} {'build, s':>9} {'retrieve p50/p95/p99, ms':>26}")
+    for n, build_time, latency in results:
+        p50, p95, p99 = np.percentile(latency, [50, 95, 99])
+        print(f"{n:>8} {build_time:>9.1f} {p50:>8.2f} / {p95:.2f} / {p99:.2f}")
+
+
+if __name__ == '__main__':
+    main()
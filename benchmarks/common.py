@@ -0,0 +1,82 @@
+"""
+Общие части бенчмарков: замер потоков и RSS процесса и синтетический каталог.
+
+Каталог строится из псевдослов с распределением Ципфа, как у реальных описаний;
+в конце названия каждого товара — уникальный артикул, цены случайные.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+SYLLABLES = ['ка', 'ло', 'ре', 'ми', 'на', 'то', 'ви', 'са', 'ду', 'ен', 'ор', 'ал', 'ни', 'ку', 'пе', 'ст']
+ENDINGS = ['', 'а', 'ы', 'ой', 'ом', 'ами', 'ный', 'ная', 'ного', 'ые']
+
+
+def proc_status(pid: int | str = 'self') -> tuple[int, float]:
+    """Число потоков и VmRSS (МБ) процесса из /proc."""
+    threads, rss = 0, 0.0
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('Threads:'):
+                threads = int(line.split()[1])
+            elif line.startswith('VmRSS:'):
+                rss = int(line.split()[1]) / 1024
+    return threads, rss
+
+
+def current_rss_mb() -> float:
+    # ru_maxrss наследуется от родителя через fork/exec, поэтому берём текущий VmRSS
+    return proc_status()[1]
+
+
+class Sampler(threading.Thread):
+    """Пиковые число потоков и RSS процесса pid (по умолчанию — текущего), раз в 50 мс."""
+
+    def __init__(self, pid: int | str = 'self'):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.peak_threads = 0
+        self.peak_rss = 0.0
+        self._finished = threading.Event()
+
+    def run(self):
+        while not self._finished.wait(0.05):
+            try:
+                threads, rss = proc_status(self.pid)
+            except FileNotFoundError:
+                return
+            self.peak_threads = max(self.peak_threads, threads)
+            self.peak_rss = max(self.peak_rss, rss)
+
+    def stop(self):
+        self._finished.set()
+        self.join()
+
+
+def vocabulary(size: int, rnd: np.random.Generator) -> np.ndarray:
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rnd.choice(SYLLABLES, rnd.integers(2, 5))))
+    return np.array(sorted(words))
+
+
+def synthetic_catalog(size: int, vocab_size: int = 30_000, description_words: tuple[int, int] = (40, 120),
+                      seed: int = 0) -> pd.DataFrame:
+    """
+    Каталог из size товаров: название — 3–6 слов и артикул, описание —
+    от description_words[0] до description_words[1] слов.
+    """
+    rnd = np.random.default_rng(seed)
+    words = vocabulary(vocab_size, rnd)
+    p = 1 / np.arange(1, vocab_size + 1)
+    p /= p.sum()
+
+    def phrase(n):
+        return ' '.join(w + rnd.choice(ENDINGS) for w in rnd.choice(words, n, p=p))
+
+    low, high = description_words
+    names = [f"{phrase(rnd.integers(3, 7))} {rnd.choice(['AX', 'BT', 'KM', 'LP'])}-{i}" for i in range(size)]
+    descriptions = [phrase(rnd.integers(low, high + 1)) for _ in range(size)]
+    prices = rnd.integers(1_000, 500_000, size).astype(float)
+    return pd.DataFrame({'name': names, 'description': descriptions, 'price': prices})
@@ -0,0 +1,253 @@
+"""
+Локальные заглушки внешних сервисов для бенчмарков.
+
+FakeOpenAIServer отвечает на /v1/chat/completions и /v1/embeddings
+в формате OpenAI API. handshake_delay имитирует стоимость установки
+нового соединения (TLS + прокси): задержка добавляется один раз на
+каждое TCP-соединение, а keep-alive запросы её не платят.
+latency_per_input добавляет задержку на каждый текст в /v1/embeddings,
+chat_latency — на каждый /v1/chat/completions; failure_rate — доля запросов,
+на которые сервер отвечает 429.
+FakeBitrixServer принимает вызовы методов входящего вебхука Bitrix24
+и запоминает, когда в какой диалог ушло сообщение imbot.message.add.
+"""
+import base64
+import hashlib
+import json
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import numpy as np
+
+
+def fake_embedding(text: str, dim: int, encoding_format: str = 'float') -> list[float] | str:
+    seed = int.from_bytes(hashlib.md5(text.encode('utf-8')).digest()[:8], 'little')
+    vec = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    vec /= np.linalg.norm(vec)
+    # SDK OpenAI по умолчанию просит base64 — как и настоящий API, отдаём сырые float32
+    if encoding_format == 'base64':
+        return base64.b64encode(vec.tobytes()).decode('ascii')
+    return vec.tolist()
+
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler_cls, host: str = '127.0.0.1', port: int = 0,
+                 failure_rate: float = 0.0, seed: int = 0):
+        super().__init__((host, port), handler_cls)
+        self.connections = 0
+        self.requests = 0
+        self.failure_rate = failure_rate
+        self.failed = 0
+        self._random = random.Random(seed)
+        self._counter_lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, connection: bool = False):
+        with self._counter_lock:
+            if connection:
+                self.connections += 1
+            else:
+                self.requests += 1
+
+    def should_fail(self) -> bool:
+        if not self.failure_rate:
+            return False
+        with self._counter_lock:
+            if self._random.random() >= self.failure_rate:
+                return False
+            self.failed += 1
+            return True
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _JSONHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        # Заголовки и тело уходят отдельными write — без NODELAY ловим задержку ACK
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.count(connection=True)
+        if self.server.handshake_delay:
+            time.sleep(self.server.handshake_delay)
+
+    def read_json(self) -> dict:
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def send_json(self, payload: dict, status: int = 200, headers: dict | None = None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _OpenAIHandler(_JSONHandler):
+    def do_POST(self):
+        self.server.count()
+        payload = self.read_json()
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.should_fail():
+            self.send_json({'error': {'message': 'Rate limit reached', 'type': 'requests'}}, status=429,
+                           headers={'retry-after-ms': '50'})
+            return
+
+        if self.path.endswith('/embeddings'):
+            texts = payload['input']
+            if isinstance(texts, str):
+                texts = [texts]
+            if self.server.latency_per_input:
+                time.sleep(self.server.latency_per_input * len(texts))
+            self.send_json({
+                'object': 'list',
+                'model': payload.get('model'),
+                'data': [
+                    {'object': 'embedding', 'index': i,
+                     'embedding': fake_embedding(t, self.server.dim, payload.get('encoding_format', 'float'))}
+                    for i, t in enumerate(texts)
+                ],
+                'usage': {'prompt_tokens': 0, 'total_tokens': 0},
+            })
+        elif self.path.endswith('/chat/completions'):
+            if self.server.chat_latency:
+                time.sleep(self.server.chat_latency)
+            self.send_json({
+                'id': 'chatcmpl-stub',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': payload.get('model'),
+                'choices': [{
+                    'index': 0,
+                    'finish_reason': 'stop',
+                    'message': {'role': 'assistant', 'content': self.server.reply},
+                }],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+            })
+        else:
+            self.send_json({'error': {'message': 'not found'}}, status=404)
+
+
+class FakeOpenAIServer(_StubServer):
+    def __init__(self, latency: float = 0.0, handshake_delay: float = 0.0, dim: int = 1536,
+                 reply: str = 'Здравствуйте! Чем могу помочь?', latency_per_input: float = 0.0,
+                 failure_rate: float = 0.0, seed: int = 0, chat_latency: float = 0.0, **kwargs):
+        super().__init__(_OpenAIHandler, failure_rate=failure_rate, seed=seed, **kwargs)
+        self.latency = latency
+        self.handshake_delay = handshake_delay
+        self.dim = dim
+        self.reply = reply
+        self.latency_per_input = latency_per_input
+        self.chat_latency = chat_latency
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.url}/v1"
+
+
+class _BitrixHandler(_JSONHandler):
+    def do_POST(self):
+        self.server.count()
+        form = parse_qs(self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode('utf-8'))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if not self.server.take_token():
+            self.server.count_rejected()
+            self.send_json({'error': 'QUERY_LIMIT_EXCEEDED', 'error_description': 'Too many requests'}, status=503)
+            return
+        if self.server.should_fail():
+            self.send_json({'error': 'INTERNAL_SERVER_ERROR', 'error_description': 'Internal error'}, status=500)
+            return
+        method = self.path.rsplit('/', 1)[-1]
+        if method == 'batch':
+            commands = {key[4:-1]: value[0] for key, value in form.items() if key.startswith('cmd[')}
+            self.server.count_calls(len(commands))
+            for command in commands.values():
+                name, _, query = command.partition('?')
+                self.server.record(name, parse_qs(query))
+            result = {'result': {key: True for key in commands}, 'result_error': []}
+        else:
+            self.server.count_calls(1)
+            self.server.record(method, form)
+            result = True
+        self.send_json({'result': result, 'time': {'start': time.time()}})
+
+
+class FakeBitrixServer(_StubServer):
+    """
+    Входящий вебхук Bitrix24: на любой метод отвечает {"result": true}.
+    С rate_limit=(запросов в секунду, всплеск) ведёт себя как лимит REST API:
+    сверх него отвечает 503 QUERY_LIMIT_EXCEEDED; на долю failure_rate
+    запросов — 500 INTERNAL_SERVER_ERROR. delivered — dialog_id -> моменты
+    (time.monotonic) доставки imbot.message.add, в том числе внутри batch.
+    """
+
+    def __init__(self, latency: float = 0.0, rate_limit: tuple[float, int] | None = None,
+                 failure_rate: float = 0.0, **kwargs):
+        super().__init__(_BitrixHandler, failure_rate=failure_rate, **kwargs)
+        self.latency = latency
+        self.handshake_delay = 0.0
+        self.rate_limit = rate_limit
+        # Число выполненных методов, включая команды внутри batch
+        self.calls = 0
+        self.rejected = 0
+        self.delivered: dict[str, list[float]] = {}
+        self._tokens = float(rate_limit[1]) if rate_limit else 0.0
+        self._updated = time.monotonic()
+
+    def take_token(self) -> bool:
+        if self.rate_limit is None:
+            return True
+        rate, burst = self.rate_limit
+        with self._counter_lock:
+            now = time.monotonic()
+            self._tokens = min(burst, self._tokens + (now - self._updated) * rate)
+            self._updated = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def count_calls(self, n: int):
+        with self._counter_lock:
+            self.calls += n
+
+    def record(self, method: str, params: dict[str, list[str]]):
+        if method != 'imbot.message.add' or 'DIALOG_ID' not in params:
+            return
+        with self._counter_lock:
+            self.delivered.setdefault(params['DIALOG_ID'][0], []).append(time.monotonic())
+
+    def count_rejected(self):
+        with self._counter_lock:
+            self.rejected += 1
+
+    @property
+    def webhook_url(self) -> str:
+        return f"{self.url}/rest/1/stub"
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import time
+from urllib.parse import urlencode
+
+import httpx
+
+from metrics import stage_seconds
+from retry import RETRY_STATUSES, retry_delay
+
+logger = logging.getLogger('bitrix_client')
+
+# Bitrix24 принимает не больше 50 команд в одном вызове batch
+BATCH_MAX_COMMANDS = 50
+# Ошибки, после которых запрос имеет смысл повторить
+RETRY_ERRORS = {'QUERY_LIMIT_EXCEEDED', 'OPERATION_TIME_LIMIT', 'INTERNAL_SERVER_ERROR'}
+# Методы с побочным эффектом: повтор после обрыва ответа может отправить сообщение дважды
+NON_IDEMPOTENT_METHODS = {'imbot.message.add', 'imopenlines.bot.session.operator'}
+# Сбои, при которых запрос заведомо не ушёл на сервер
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+# Лимит REST API Bitrix24 для вебхука: 2 запроса в секунду, всплеск до 50
+BITRIX_RATE = 2.0
+BITRIX_BURST = 50
+
+
+class BitrixError(Exception):
+    def __init__(self, method: str, error: str, description: str = '', status: int = 200):
+        super().__init__(f"{method}: {error} {description}".strip())
+        self.method = method
+        self.error = error
+        self.description = description
+        self.status = status
+
+    @property
+    def retryable(self) -> bool:
+        return self.error in RETRY_ERRORS or self.status in RETRY_STATUSES
+
+
+class TokenBucket:
+    """
+    Асинхронный ограничитель частоты: rate токенов в секунду, не больше capacity подряд.
+    Ожидающие получают токены в порядке очереди.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+    def drain(self):
+        # Сервер сообщил о превышении лимита: считаем, что запас исчерпан
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+
+
+class BitrixClient:
+    """
+    Асинхронный клиент REST API Bitrix24 через входящий вебхук.
+
+    Держит пул keep-alive соединений, ограничивает время запроса и повторяет
+    его с экспоненциальной задержкой при сетевых сбоях, 5xx и превышении лимита
+    запросов. batch() упаковывает несколько методов в один вызов batch.
+    С limiter каждый HTTP-запрос (в том числе batch целиком) берёт один токен.
+    """
+
+    def __init__(self, webhook_url: str, timeout: httpx.Timeout = httpx.Timeout(30, connect=10),
+                 max_connections: int = 10, retries: int = 3, backoff: float = 0.5, max_backoff: float = 10.0,
+                 limiter: TokenBucket | None = None):
+        self.webhook_url = webhook_url.rstrip('/')
+        self.limiter = limiter
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._client: httpx.AsyncClient | None = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Создаётся при первом вызове, уже внутри цикла движка
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+            )
+        return self._client
+
+    async def _post(self, method: str, params: dict) -> dict:
+        if self.limiter is not None:
+            await self.limiter.acquire()
+        with stage_seconds.time('bitrix_call'):
+            resp = await self.client.post(f"{self.webhook_url}/{method}", data=params)
+        try:
+            payload = resp.json()
+        except ValueError:
+            payload = {}
+        if payload.get('error'):
+            raise BitrixError(method, payload['error'], payload.get('error_description', ''), resp.status_code)
+        if resp.status_code != 200:
+            raise BitrixError(method, f"HTTP_{resp.status_code}", resp.text[:200], resp.status_code)
+        return payload
+
+    async def call(self, method: str, params: dict | None = None, idempotent: bool | None = None) -> dict:
+        """
+        Вызывает метод и возвращает весь ответ Bitrix24 (result, time, ...).
+        После исчерпания повторов пробрасывает BitrixError или httpx.HTTPError.
+
+        idempotent=False (по умолчанию для NON_IDEMPOTENT_METHODS) разрешает
+        повтор, только если запрос точно не выполнился: не удалось соединиться
+        или Bitrix24 отклонил его по лимиту запросов.
+        """
+        params = params or {}
+        if idempotent is None:
+            idempotent = method not in NON_IDEMPOTENT_METHODS
+        logger.debug(f"Calling {method} with {params}")
+        attempt = 0
+        while True:
+            try:
+                return await self._post(method, params)
+            except BitrixError as e:
+                if e.error == 'QUERY_LIMIT_EXCEEDED' and self.limiter is not None:
+                    self.limiter.drain()
+                retryable = e.retryable if idempotent else e.error == 'QUERY_LIMIT_EXCEEDED'
+                if attempt >= self.retries or not retryable:
+                    raise
+                logger.warning(f"Bitrix24 {e}, повтор {attempt + 1}/{self.retries}")
+            except httpx.TransportError as e:
+                if attempt >= self.retries or not (idempotent or isinstance(e, NOT_SENT_ERRORS)):
+                    raise
+                logger.warning(f"Bitrix24 {method}: {e!r}, повтор {attempt + 1}/{self.retries}")
+            await asyncio.sleep(retry_delay(attempt, self.backoff, self.max_backoff))
+            attempt += 1
+
+    async def batch(self, commands: dict[str, tuple[str, dict]], halt: bool = False) -> tuple[dict, dict]:
+        """
+        Выполняет команды {ключ: (метод, параметры)} пачками по BATCH_MAX_COMMANDS
+        в порядке словаря. Возвращает (результаты, ошибки) по ключам команд.
+        """
+        results, errors = {}, {}
+        items = list(commands.items())
+        for start in range(0, len(items), BATCH_MAX_COMMANDS):
+            chunk = items[start:start + BATCH_MAX_COMMANDS]
+            params = {'halt': int(halt)}
+            for key, (method, method_params) in chunk:
+                params[f'cmd[{key}]'] = f"{method}?{urlencode(method_params)}"
+            idempotent = all(method not in NON_IDEMPOTENT_METHODS for _, (method, _) in chunk)
+            result = (await self.call('batch', params, idempotent)).get('result', {})
+            # Пустые результаты PHP сериализует как [] вместо {}
+            results.update(result.get('result') or {})
+            errors.update(result.get('result_error') or {})
+        return results, errors
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -1,17 +1,24 @@
+import asyncio
+import hmac
 import logging
 import os
 import sys
-import threading
 import time
 from datetime import datetime, timedelta
 from functools import wraps
 
 import django
-import requests
-from flask import Flask, request, jsonify, current_app
+from flask import Flask, Response, request, jsonify
 
+from bitrix_client import BitrixClient, TokenBucket, BITRIX_RATE, BITRIX_BURST
 from config import INCOMING_WEBHOOK_URL, CLIENT_ID, BOT_ID
-from gpt_client import initialize_vectorization, get_gpt_response
+from engine import MessageEngine
+from gpt_client import (initialize_vectorization, get_gpt_response, catalog_version, catalog_size, CatalogReindexer,
+                        embed_message, embedding_provider, answer_cache, prompt_meter,
+                        embedding_pipeline, build_proxy_url)
+from metrics import registry, stage_seconds, webhook_events, reminders, reminder_lag_seconds, CONTENT_TYPE
+from reminders import dispatch_reminders
+from settings_cache import BotSettings, SettingsCache
 from utils import HistoryManager
 
 app = Flask(__name__)
@@ -56,29 +63,71 @@ django.setup()
 
 from main.models import Bot  # импорт модели с настройками
 
+# Верхняя граница сна планировщика напоминаний: за это время подхватываются
+# изменённые в админке интервалы
+REMINDER_MAX_SLEEP = 300
+REMINDER_ERROR_SLEEP = 10
+# Окно ответа: сообщения диалога за REPLY_DELAY секунд с первого из них
+# уходят в модель одним ходом, и ответ отправляется один
+REPLY_DELAY = 30
+# События Bitrix24, которые различаются в метриках; прочие считаются как 'other',
+# чтобы присланное клиентом имя не порождало новые ряды
+KNOWN_EVENTS = {
+    'ONIMBOTMESSAGEADD', 'ONIMBOTMESSAGEUPDATE', 'ONIMBOTMESSAGEDELETE',
+    'ONIMBOTJOINCHAT', 'ONIMBOTDELETE', 'ONIMCOMMANDADD',
+}
+# /metrics отдаётся с заголовком Authorization: Bearer <METRICS_TOKEN>;
+# без токена — только запросам с этой же машины
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Все сообщения обрабатываются в цикле движка, а не в потоке Flask
+engine = MessageEngine()
+# Будит reminder_worker, когда у диалога появился срок раньше того, до которого он спит.
+# Живёт в цикле движка: трогать только из его корутин
+reminder_wakeup = asyncio.Event()
+# Когда (UTC) reminder_worker проснётся сам; None — ещё не заснул
+reminder_wake_at: datetime | None = None
+# dialog_id -> тексты, ждущие закрытия окна ответа. Тоже только из цикла движка
+pending_messages: dict[str, list[str]] = {}
+bitrix = BitrixClient(INCOMING_WEBHOOK_URL, limiter=TokenBucket(BITRIX_RATE, BITRIX_BURST))
+
+
+settings_cache = SettingsCache(
+    loader=lambda: BotSettings.from_model(Bot.objects.get(pk=1)),
+    version_loader=lambda: Bot.objects.values_list('version', flat=True).get(pk=1),
+)
 
-def get_bot_settings() -> Bot:
+# Состояние, которое уже ведут движок, кэши и каталог, снимается в момент запроса /metrics
+registry.gauge('bot_engine_queue_depth', 'Задачи в очереди движка', fn=lambda: engine.queue_depth)
+registry.gauge('bot_engine_in_flight', 'Задачи движка в работе', fn=lambda: engine.in_flight)
+registry.gauge('bot_engine_scheduled', 'Отложенные задачи движка (окна ответа)', fn=lambda: engine.scheduled)
+registry.gauge('bot_pending_dialogs', 'Диалоги с открытым окном ответа', fn=lambda: len(pending_messages))
+registry.gauge('bot_catalog_index_size', 'Векторов в FAISS-индексе каталога', fn=catalog_size)
+registry.gauge('bot_answer_cache_entries', 'Ответов в семантическом кэше', fn=lambda: answer_cache.stats()['entries'])
+registry.counter('bot_answer_cache_hits_total', 'Попадания в кэш ответов', fn=lambda: answer_cache.hits)
+registry.counter('bot_answer_cache_misses_total', 'Промахи кэша ответов', fn=lambda: answer_cache.misses)
+registry.counter('bot_answer_cache_saved_seconds_total', 'Время модели, сэкономленное кэшем ответов',
+                 fn=lambda: answer_cache.saved_seconds)
+registry.counter('bot_prompt_requests_total', 'Собранные промпты', fn=lambda: prompt_meter.requests)
+registry.counter('bot_prompt_tokens_total', 'Токены собранных промптов (по подсчёту бота)',
+                 fn=lambda: prompt_meter.total_tokens)
+registry.counter('bot_prompt_truncated_total', 'Промпты, не уместившиеся в бюджет целиком',
+                 fn=lambda: prompt_meter.truncated)
+registry.gauge('bot_prompt_max_tokens', 'Самый большой промпт', fn=lambda: prompt_meter.max_tokens)
+registry.counter('bot_embedding_pipeline_requests_total', 'Запросы эмбеддингов при пересборке каталога',
+                 fn=lambda: embedding_pipeline.requests)
+registry.counter('bot_embedding_pipeline_retried_total', 'Повторы запросов эмбеддингов при пересборке',
+                 fn=lambda: embedding_pipeline.retried)
+
+
+def get_bot_settings() -> BotSettings:
     """
-    Возвращает единственный объект Bot (pk=1) с текущими настройками.
+    Возвращает снимок настроек единственного объекта Bot (pk=1).
+    Строка перечитывается из базы только после её изменения.
     """
 
-    return Bot.objects.get(pk=1)
-
-
-# HTTP-вызов методов Bitrix24 через Webhook
-def bitrix_call(method, params):
-    url = f"{INCOMING_WEBHOOK_URL}/{method}"
-    logger.debug(f"Calling {url} with {params}")
-    resp = requests.post(url, data=params)
-    print(params)
-    print(url)
-    if resp.status_code != 200:
-        current_app.logger.error(f"HTTP {resp.status_code}: {resp.text}")
-    else:
-        result = resp.json()
-        if result.get('error'):
-            current_app.logger.error(f"Bitrix24 error: {result}")
-    return resp
+    with stage_seconds.time('settings'):
+        return settings_cache.get()
 
 
 def is_text_only(form):
@@ -99,20 +148,20 @@ def is_text_only(form):
     # 3) Проверка файлов (FILE_ID и FILES)
     if form.getlist('data[PARAMS][PARAMS][FILE_ID]') or \
             any(key.startswith('data[PARAMS][FILES]') for key in data):
-        send_manager(dialog_id)
+        engine.submit(send_manager, dialog_id)
         logger.info(f"{dialog_id} Загрузили файл")
         return False
 
     # 5) Проверка rich previews и URL-репортов (ATTACH и URL_ATTACH)
     if any(key.startswith('data[PARAMS][PARAMS][ATTACH]') for key in data) or \
             any(key.startswith('data[PARAMS][URL_ATTACH]') for key in data):
-        send_manager(dialog_id)
+        engine.submit(send_manager, dialog_id)
         logger.info(f"{dialog_id} Ссылка")
         return False
 
     lower_text = text.lower()
     if "url" in lower_text or "http" in lower_text:
-        send_manager(dialog_id)
+        engine.submit(send_manager, dialog_id)
         logger.info(f"{dialog_id} Ссылка прям ссылка")
         return False
 
@@ -135,8 +184,20 @@ def always_ok(f):
     return wrapper
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics_handler():
+    if METRICS_TOKEN:
+        allowed = hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {METRICS_TOKEN}")
+    else:
+        allowed = request.remote_addr in ('127.0.0.1', '::1')
+    if not allowed:
+        return Response(status=403)
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
+
 @app.route('/', methods=['POST'])
 @always_ok
+@stage_seconds.time('webhook')
 def webhook_handler():
     logger.info("Запрос от Bitrix24")
     data_from_form = request.form.to_dict()
@@ -144,6 +205,7 @@ def webhook_handler():
     logger.info('------------------')
     event = data_from_form.get('event')
     logger.info(f"Событие: {event}")
+    webhook_events.inc(1, event if event in KNOWN_EVENTS else 'other')
 
     # Общие переменные
     dialog_id = data_from_form.get('data[PARAMS][DIALOG_ID]')
@@ -163,147 +225,235 @@ def webhook_handler():
 
         logger.info(f"TEXT: {text}")
 
-        global last_excel_change
-        settings = get_bot_settings()
-
-        if settings.last_change != last_excel_change:
-            send_manager(dialog_id,
-                         "Прямо сейчас мы обновляем наш каталог товаров. Вам ответит первый освободившийся менеджер!")
-            initialize_vectorization(
-                proxy_host=settings.proxy_host,
-                proxy_port=settings.proxy_port,
-                proxy_user=settings.proxy_user,
-                proxy_password=settings.proxy_password
-            )
-            last_excel_change = settings.last_change
-            return
+        engine.submit(process_message, dialog_id, text)
 
-        history_manager.set_stage(dialog_id, 0)
+    return jsonify({'ERROR': 0, 'RESULT': 'ok'})
 
-        ban_list = [w.strip() for w in settings.ban_word.split(",") if w.strip()]
-        if any(bw in text for bw in ban_list):
-            history_manager.put_in_blacklist(dialog_id, "ban_word")
-            return
 
-        history = history_manager.get_history(dialog_id)
-        history_manager.add_message(dialog_id, {"role": "user", "content": text})
 
-        assistant_content, assistant_entry = get_gpt_response(
-            history,
-            text,
-            settings.agent_promt + settings.key_word,
+async def process_message(dialog_id: str, text: str):
+    """
+    Обработка одного текстового сообщения в цикле движка. Django ORM и SQLite
+    синхронные, поэтому уходят в пул потоков через asyncio.to_thread.
+    """
+    # Буферизуем до первого await: иначе сообщения, пришедшие почти
+    # одновременно, могли бы встать в окно не в том порядке
+    buffered = pending_messages.setdefault(dialog_id, [])
+    buffered.append(text)
+    if len(buffered) == 1:
+        engine.call_later(REPLY_DELAY, reply_to_dialog, dialog_id)
+
+    settings = await asyncio.to_thread(get_bot_settings)
+
+    if settings.last_change != catalog_version():
+        # Каталог пересобирается в фоне, а отвечаем пока по текущему снимку
+        catalog_reindexer.request(
+            settings.last_change,
             settings.proxy_host,
             settings.proxy_port,
             settings.proxy_user,
             settings.proxy_password
         )
 
-        if assistant_entry["role"] == "MANAGER":
-            logger.warning("нужно позвать менеджера")
-            send_manager(dialog_id)
-            return
-        else:
-            history_manager.add_message(dialog_id, assistant_entry)
+    if settings.has_ban_word(text):
+        pending_messages.pop(dialog_id, None)
+        await asyncio.to_thread(history_manager.put_in_blacklist, dialog_id, "ban_word")
+        return
 
-        thread = threading.Timer(
-            function=send_delayed_message,
-            interval=30,
-            args=(dialog_id, assistant_content),
-        )
-        thread.daemon = True
-        thread.start()
+    # Срок напоминаний сдвигается сразу, а не при закрытии окна ответа
+    await asyncio.to_thread(history_manager.mark_user_activity, dialog_id)
+    # Новый срок почти всегда позже пробуждения планировщика — будим, только если раньше
+    due_at = datetime.utcnow() + timedelta(hours=settings.interval_first)
+    if reminder_wake_at is not None and due_at < reminder_wake_at:
+        reminder_wakeup.set()
 
-    return jsonify({'ERROR': 0, 'RESULT': 'ok'})
 
+async def reply_to_dialog(dialog_id: str):
+    """
+    Закрывает окно ответа: склеивает накопленные сообщения в одну реплику
+    пользователя, делает один поиск по каталогу и один запрос к модели.
+    """
+    texts = pending_messages.pop(dialog_id, None)
+    if not texts:
+        return
+    with stage_seconds.time('reply'):
+        await answer_dialog(dialog_id, texts)
+
+
+async def answer_dialog(dialog_id: str, texts: list[str]):
+    if await asyncio.to_thread(history_manager.in_blacklist, dialog_id):
+        # Пока окно было открыто, диалог передали менеджеру
+        return
+    if len(texts) > 1:
+        logger.info(f"{dialog_id} Объединено сообщений: {len(texts)}")
+    text = "\n".join(texts)
+
+    settings = await asyncio.to_thread(get_bot_settings)
+    history = await asyncio.to_thread(history_manager.get_history, dialog_id)
+    history_embeddings = await asyncio.to_thread(history_manager.get_user_embeddings, dialog_id,
+                                                   embedding_provider.name)
+
+    message_id = await asyncio.to_thread(
+        history_manager.add_message, dialog_id, {"role": "user", "content": text}
+    )
+
+    assistant_content, assistant_entry, message_embedding = await get_gpt_response(
+        history,
+        text,
+        settings.system_prompt,
+        settings.proxy_host,
+        settings.proxy_port,
+        settings.proxy_user,
+        settings.proxy_password,
+        history_embeddings=history_embeddings,
+    )
+    # Вектор реплики нужен истории всегда, даже если ответ нашёлся без эмбеддинга:
+    # иначе эмбеддинг беседы на следующих ходах теряет именно реплики с названием товара
+    engine.submit(store_message_embedding, dialog_id, message_id, text, message_embedding,
+                  build_proxy_url(settings.proxy_host, settings.proxy_port, settings.proxy_user,
+                                  settings.proxy_password))
+
+    if assistant_entry["role"] == "MANAGER":
+        logger.warning("нужно позвать менеджера")
+        await send_manager(dialog_id)
+        return
+    else:
+        await asyncio.to_thread(history_manager.add_message, dialog_id, assistant_entry)
 
-def send_manager(dialog_id: str,
-                 message: str = "Отлично, я Вас поняла! Скоро подключится менеджер и продолжит консультацию."):
-    history_manager.put_in_blacklist(dialog_id, "manager")
-    send_delayed_message(dialog_id, message)
-    create_bitrix_request(dialog_id.replace("chat", ""))
+    await send_delayed_message(dialog_id, assistant_content)
 
 
-def send_delayed_message(dialog_id, message):
-    bitrix_call('imbot.message.add', {
+async def store_message_embedding(dialog_id: str, message_id: int, text: str,
+                                  embedding, proxy_url: str | None):
+    """
+    Сохраняет эмбеддинг реплики пользователя рядом с ней (фоновая задача движка).
+    Если поиск обошёлся без эмбеддинга, он считается здесь, уже после ответа.
+    """
+    if embedding is None:
+        try:
+            embedding = await embed_message(text, proxy_url)
+        except Exception as e:
+            logger.error(f"{dialog_id} Не удалось получить эмбеддинг реплики: {e!r}")
+            return
+    await asyncio.to_thread(history_manager.set_message_embedding, message_id, embedding, embedding_provider.name)
+
+
+async def send_manager(dialog_id: str,
+                       message: str = "Отлично, я Вас поняла! Скоро подключится менеджер и продолжит консультацию."):
+    await asyncio.to_thread(history_manager.put_in_blacklist, dialog_id, "manager")
+    # Сообщение и перевод на оператора уходят одним вызовом batch
+    _, errors = await bitrix.batch({
+        'message': message_command(dialog_id, message),
+        'operator': operator_command(dialog_id.replace("chat", "")),
+    })
+    if errors:
+        logger.error(f"{dialog_id} Bitrix24 batch errors: {errors}")
+
+
+def message_command(dialog_id, message) -> tuple[str, dict]:
+    return 'imbot.message.add', {
         'BOT_ID': BOT_ID,
         'DIALOG_ID': dialog_id,
         'MESSAGE': message,
         'CLIENT_ID': CLIENT_ID,
-    })
+    }
 
 
-def reminder_worker(history_manager: HistoryManager):
+def operator_command(chat_id) -> tuple[str, dict]:
+    return 'imopenlines.bot.session.operator', {
+        "CHAT_ID": chat_id,
+        "CLIENT_ID": CLIENT_ID,
+    }
+
+
+async def send_delayed_message(dialog_id, message):
+    await bitrix.call(*message_command(dialog_id, message))
+
+
+async def reminder_worker(history_manager: HistoryManager):
+    """
+    Планировщик напоминаний: за один тик забирает из индекса сроков только те диалоги,
+    которым уже пора напомнить, и спит до ближайшего следующего срока
+    (или пока reminder_wakeup не разбудит его сообщением с более ранним сроком).
+    """
+    global reminder_wake_at
     logger.info("Reminder worker started")
+    retry_attempt = 0
+    # Ближайший срок, до которого заснули: по нему считается опоздание рассылки
+    planned_at = None
     while True:
+        reminder_wakeup.clear()
+        timeout = REMINDER_MAX_SLEEP
+        tick_started = time.perf_counter()
         try:
-            history_manager.cursor.execute("""
-                SELECT DISTINCT peer_id FROM dialog_history
-            """)
-            peer_ids = [row[0] for row in history_manager.cursor.fetchall()]
-
-            now = datetime.utcnow()
-            settings = get_bot_settings()
+            settings = await asyncio.to_thread(get_bot_settings)
 
             REMINDER1_DELAY = settings.interval_first * 60 * 60
             REMINDER2_DELAY = settings.interval_second * 60 * 60
-            reminder_text = settings.text_one_remember  # используем поле promt для первого напоминания
-            final_text = settings.text_two_remember
-            for dialog_id in peer_ids:
-                try:
-                    stage = history_manager.get_stage(dialog_id)
-                    if stage >= 2:
-                        continue
-
-                    last_user_ts = history_manager.get_last_user_timestamp(dialog_id)
-                    if not last_user_ts:
-                        continue
-
-                    elapsed = now - last_user_ts
-
-                    if stage == 0 and elapsed >= timedelta(seconds=REMINDER1_DELAY):
-                        send_delayed_message(dialog_id, reminder_text)
-                        # vk.messages.send(peer_id=peer_id, message=reminder_text, random_id=0)
-                        history_manager.set_stage(dialog_id, 1)
-
-                    elif stage == 1 and elapsed >= timedelta(seconds=REMINDER2_DELAY):
-                        send_delayed_message(dialog_id, final_text)
-
-                        # vk.messages.send(peer_id=peer_id, message=final_text, random_id=0)
-                        history_manager.set_stage(dialog_id, 2)
-                except Exception as e:
-                    logger.error(f"Error in reminder_worker for {dialog_id}: {e}")
-                    history_manager.put_in_blacklist(dialog_id, "no_access")
+            texts = {
+                0: settings.text_one_remember,  # используем поле promt для первого напоминания
+                1: settings.text_two_remember,
+            }
+            due = await asyncio.to_thread(history_manager.get_due_reminders, REMINDER1_DELAY, REMINDER2_DELAY)
+            if due and planned_at is not None:
+                reminder_lag_seconds.observe(max((datetime.utcnow() - planned_at).total_seconds(), 0.0))
+                planned_at = None
+            result = await dispatch_reminders(bitrix, history_manager, due, texts, message_command)
+            if due:
+                logger.info(f"Напоминания: отправлено {result.sent}, отложено {result.deferred}, "
+                            f"недоступно {result.failed}")
+                reminders.inc(result.sent, 'sent')
+                reminders.inc(result.deferred, 'deferred')
+                reminders.inc(result.failed, 'failed')
+
+            if result.deferred:
+                # Bitrix24 ограничивает частоту: повторяем с растущей паузой, а не в чёрный список
+                timeout = min(REMINDER_ERROR_SLEEP * 2 ** retry_attempt, REMINDER_MAX_SLEEP)
+                retry_attempt += 1
+            else:
+                retry_attempt = 0
+                next_at = await asyncio.to_thread(history_manager.get_next_reminder_at, REMINDER1_DELAY, REMINDER2_DELAY)
+                if next_at is not None:
+                    timeout = min(max((next_at - datetime.utcnow()).total_seconds(), 1), REMINDER_MAX_SLEEP)
+                    planned_at = next_at
         except Exception as e:
             logger.error(f"Error in reminder_worker: {e}")
+            timeout = REMINDER_ERROR_SLEEP
+        stage_seconds.observe(time.perf_counter() - tick_started, 'reminder_tick')
 
-        time.sleep(10)
-
-
-def create_bitrix_request(chat_id):
-    bitrix_call("imopenlines.bot.session.operator", {
-        "CHAT_ID": chat_id,
-        "CLIENT_ID": CLIENT_ID,
-    })
+        reminder_wake_at = datetime.utcnow() + timedelta(seconds=timeout)
+        try:
+            await asyncio.wait_for(reminder_wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
 
 
-if __name__ == '__main__':
-    global history_manager
+def main(host: str = '0.0.0.0', port: int = 5000):
+    """
+    Запуск бота: история, движок сообщений, напоминания, каталог и Flask.
+    Внешние зависимости (bitrix, settings_cache, REPLY_DELAY) берутся из
+    глобалей модуля — нагрузочный тест подменяет их до вызова.
+    """
+    global history_manager, catalog_reindexer
     history_manager = HistoryManager(max_history_length=10)
     logger.info("Бот запущен... Ожидание сообщений.")
 
-    threading.Thread(target=reminder_worker,
-                     args=(history_manager,),
-                     daemon=True).start()
+    engine.start()
+    engine.run(reminder_worker(history_manager))
 
     settings = get_bot_settings()
     initialize_vectorization(
         proxy_host=settings.proxy_host,
         proxy_port=settings.proxy_port,
         proxy_user=settings.proxy_user,
-        proxy_password=settings.proxy_password
+        proxy_password=settings.proxy_password,
+        version=settings.last_change
     )
 
-    global last_excel_change
-    last_excel_change = settings.last_change
+    catalog_reindexer = CatalogReindexer()
 
-    app.run(host='0.0.0.0', port=5000, threaded=True)
+    app.run(host=host, port=port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
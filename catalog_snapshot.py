@@ -0,0 +1,172 @@
+import hashlib
+import json
+import logging
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger('catalog_snapshot')
+
+# 2 — добавлены готовые фрагменты контекста snippet.bin
+SNAPSHOT_FORMAT = 2
+STRING_COLUMNS = ['name', 'description']
+NUMERIC_COLUMNS = ['price']
+HASH_COLUMNS = ['name_hash', 'description_hash', 'price_hash']
+SNIPPET_COLUMN = 'snippet'
+# Длина описания товара во фрагменте контекста для модели, символов
+SNIPPET_DESCRIPTION_CHARS = 600
+MANIFEST = 'manifest.json'
+
+
+def format_price(price) -> str:
+    if price is None or isinstance(price, float) and math.isnan(price):
+        return "не указана"
+    if isinstance(price, float) and price.is_integer():
+        return str(int(price))
+    return str(price)
+
+
+def format_snippet(name, description, price) -> str:
+    """
+    Фрагмент контекста о товаре для промпта: описание без лишних пробелов
+    и обрезанное по границе слова до SNIPPET_DESCRIPTION_CHARS символов.
+    """
+    description = " ".join(str(description).split()) if isinstance(description, str) else ''
+    if len(description) > SNIPPET_DESCRIPTION_CHARS:
+        cut = description[:SNIPPET_DESCRIPTION_CHARS]
+        description = (cut.rsplit(' ', 1)[0] or cut).rstrip(' ,.;:-') + '…'
+    return (
+        f"Название: {name}\n"
+        f"Описание: {description}\n"
+        f"Цена: {format_price(price)}\n"
+    )
+
+
+def file_fingerprint(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def atomic_write(path: str, write) -> None:
+    """
+    Записывает файл через временный и os.replace: обрыв записи не оставит
+    половину файла, а уже открытые mmap старой версии остаются валидными.
+    write(f) получает открытый на запись двоичный файл.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def write_snapshot(directory: str, products: pd.DataFrame, source_fingerprint: str, embedding_model: str) -> None:
+    """
+    Сохраняет каталог в колоночном бинарном виде:
+      ids.npy, price.npy, *_hash.npy — массивы NumPy;
+      <text>.bin + <text>_offsets.npy — UTF-8 строки подряд и смещения их концов;
+      snippet.bin — готовый фрагмент контекста для каждого товара (format_snippet).
+    manifest.json пишется последним и связывает снимок с исходным products.csv
+    и моделью эмбеддингов, которой построен FAISS-индекс.
+    """
+    os.makedirs(directory, exist_ok=True)
+    arrays = {'ids': products.index.to_numpy(dtype=np.int64)}
+    for column in NUMERIC_COLUMNS:
+        arrays[column] = products[column].to_numpy(dtype=np.float64)
+    for column in HASH_COLUMNS:
+        arrays[column] = products[column].to_numpy(dtype=np.uint64)
+
+    texts = {column: products[column].fillna('').astype(str).tolist() for column in STRING_COLUMNS}
+    texts[SNIPPET_COLUMN] = [
+        format_snippet(name, description, price)
+        for name, description, price in zip(products['name'], products['description'], arrays['price'].tolist())
+    ]
+    for column, values in texts.items():
+        encoded = [s.encode('utf-8') for s in values]
+        arrays[f'{column}_offsets'] = np.cumsum([len(b) for b in encoded], dtype=np.int64)
+        atomic_write(os.path.join(directory, f'{column}.bin'), lambda f: f.write(b''.join(encoded)))
+
+    for name, array in arrays.items():
+        atomic_write(os.path.join(directory, f'{name}.npy'), lambda f: np.save(f, array))
+
+    manifest = {'format': SNAPSHOT_FORMAT, 'source': source_fingerprint, 'rows': len(products),
+                'embedding_model': embedding_model}
+    atomic_write(os.path.join(directory, MANIFEST), lambda f: f.write(json.dumps(manifest).encode('utf-8')))
+
+
+def read_manifest(directory: str, any_format: bool = False) -> dict | None:
+    """
+    Манифест снимка текущего формата (с any_format — любого), иначе None.
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if any_format or manifest.get('format') == SNAPSHOT_FORMAT else None
+
+
+def read_hashes(directory: str) -> pd.DataFrame:
+    """
+    Хэши колонок проиндексированного каталога. Их раскладка не менялась
+    с первого формата, поэтому годится и снимок прежней версии.
+    """
+    def load(name):
+        return np.load(os.path.join(directory, f'{name}.npy'))
+
+    return pd.DataFrame(
+        {column: load(column) for column in HASH_COLUMNS},
+        index=pd.Index(load('ids'), name='id')
+    )
+
+
+class ProductTable:
+    """
+    Каталог, открытый из снимка через mmap: строки не декодируются при загрузке,
+    а достаются по позиции только для найденных товаров.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+        def load(name):
+            return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+
+        self.ids = load('ids')
+        self._numeric = {column: load(column) for column in NUMERIC_COLUMNS}
+        self._texts = {}
+        for column in [*STRING_COLUMNS, SNIPPET_COLUMN]:
+            path = os.path.join(directory, f'{column}.bin')
+            blob = np.memmap(path, dtype=np.uint8, mode='r') if os.path.getsize(path) else np.empty(0, np.uint8)
+            self._texts[column] = (blob, load(f'{column}_offsets'))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def text(self, column: str, position: int) -> str:
+        blob, offsets = self._texts[column]
+        start = int(offsets[position - 1]) if position else 0
+        return bytes(blob[start:int(offsets[position])]).decode('utf-8')
+
+    def snippets(self, positions) -> list[str]:
+        """
+        Готовые фрагменты контекста по позициям товаров, без сборки DataFrame.
+        """
+        return [self.text(SNIPPET_COLUMN, int(p)) for p in positions if 0 <= p < len(self)]
+
+    def take(self, positions) -> pd.DataFrame:
+        """
+        Возвращает строки каталога по позициям (id товара совпадает с позицией).
+        """
+        positions = [int(p) for p in positions if 0 <= p < len(self)]
+        data = {column: [self.text(column, p) for p in positions] for column in STRING_COLUMNS}
+        for column, values in self._numeric.items():
+            data[column] = values[positions]
+        return pd.DataFrame(data, index=pd.Index(self.ids[positions], name='id'))
+
+    def hashes(self) -> pd.DataFrame:
+        return read_hashes(self.directory)
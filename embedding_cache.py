@@ -0,0 +1,162 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger('embedding_cache')
+
+# При переполнении кэш ужимается до этой доли max_entries, чтобы не вытеснять на каждой вставке
+EVICT_TO = 0.9
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Кэш эмбеддингов по (модель, sha1 текста): LRU в памяти процесса поверх таблицы SQLite.
+
+    В SQLite хранится не больше max_entries векторов. При переполнении удаляются те,
+    к которым дольше всего не обращались (last_used обновляется при чтении с диска),
+    пока не останется EVICT_TO от лимита. Число строк ведётся в памяти с запасом
+    (перезапись существующего вектора тоже считается), а COUNT(*) по таблице
+    выполняется, только когда эта оценка превысила лимит.
+    """
+
+    def __init__(self, db_path: str, max_entries: int = 200_000, memory_entries: int = 5_000):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[tuple[str, str], np.ndarray]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        # Оценка числа строк сверху; None — ещё не считали
+        self._count: Optional[int] = None
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # Файл открывается при первом обращении, а не при импорте gpt_client
+        if self._db is None:
+            self._db = self._connect()
+        return self._db
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings
+                (
+                    model     TEXT    not null,
+                    text_hash TEXT    not null,
+                    vector    BLOB    not null,
+                    last_used INTEGER not null,
+                    primary key (model, text_hash)
+                ) WITHOUT ROWID
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+        return conn
+
+    def _remember(self, key: tuple[str, str], vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model: str, texts: list[str]) -> list[Optional[np.ndarray]]:
+        """
+        Возвращает векторы для texts в том же порядке; None — для текстов, которых нет в кэше.
+        """
+        keys = [(model, text_key(t)) for t in texts]
+        result: list[Optional[np.ndarray]] = [None] * len(texts)
+        with self._lock:
+            to_load: dict[str, list[int]] = {}
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    result[i] = vector
+                else:
+                    to_load.setdefault(key[1], []).append(i)
+
+            if to_load:
+                hashes = list(to_load)
+                now = int(time.time())
+                # SQLite ограничивает число параметров в запросе
+                for start in range(0, len(hashes), 500):
+                    chunk = hashes[start:start + 500]
+                    marks = ",".join("?" * len(chunk))
+                    rows = self._conn.execute(
+                        f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({marks})",
+                        (model, *chunk)
+                    ).fetchall()
+                    for text_hash, blob in rows:
+                        vector = np.frombuffer(blob, dtype=np.float32)
+                        self._remember((model, text_hash), vector)
+                        for i in to_load[text_hash]:
+                            result[i] = vector
+                    if rows:
+                        with self._conn:
+                            self._conn.execute(
+                                f"UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash IN ({marks})",
+                                (now, model, *chunk)
+                            )
+
+        found = sum(v is not None for v in result)
+        self.hits += found
+        self.misses += len(result) - found
+        return result
+
+    def put_many(self, model: str, texts: list[str], vectors: np.ndarray):
+        now = int(time.time())
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                vector = np.ascontiguousarray(vector, dtype=np.float32).copy()
+                vector.flags.writeable = False
+                key = (model, text_key(text))
+                self._remember(key, vector)
+                rows.append((model, key[1], vector.tobytes(), now))
+
+            with self._conn:
+                self._conn.executemany("""
+                    INSERT INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(model, text_hash) DO UPDATE SET vector = excluded.vector, last_used = excluded.last_used
+                """, rows)
+                if self._count is None:
+                    self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                else:
+                    self._count += len(rows)
+                if self._count > self.max_entries:
+                    self._evict()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self._count = total
+        if total <= self.max_entries:
+            return
+        overflow = total - int(self.max_entries * EVICT_TO)
+        self._conn.execute("""
+            DELETE FROM embeddings WHERE (model, text_hash) IN (
+                SELECT model, text_hash FROM embeddings ORDER BY last_used ASC LIMIT ?
+            )
+        """, (overflow,))
+        self._count = total - overflow
+        logger.info(f"Из кэша эмбеддингов вытеснено {overflow} записей")
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+            self._count = None
@@ -0,0 +1,140 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable
+
+import numpy as np
+from openai import APIConnectionError, APIStatusError
+
+from retry import RETRY_STATUSES, retry_delay
+
+logger = logging.getLogger('embedding_pipeline')
+
+
+def is_retryable(error: Exception) -> bool:
+    # Таймауты и обрывы соединения, лимиты и ошибки на стороне OpenAI; 400/401 повторять бессмысленно
+    if isinstance(error, APIStatusError):
+        return error.status_code in RETRY_STATUSES
+    return isinstance(error, APIConnectionError)
+
+
+def retry_after(error: Exception) -> float | None:
+    """
+    Пауза из заголовка Retry-After ответа 429/503, если сервер её прислал.
+    """
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    for header, scale in (('retry-after-ms', 0.001), ('retry-after', 1.0)):
+        try:
+            return float(response.headers[header]) * scale
+        except (KeyError, ValueError, TypeError):
+            continue
+    return None
+
+
+def token_batches(counts: list[int], max_tokens: int, max_inputs: int) -> list[list[int]]:
+    """
+    Делит тексты (по их числу токенов) на батчи подряд идущих индексов: в батче
+    не больше max_inputs текстов и не больше max_tokens токенов. Текст длиннее
+    max_tokens идёт отдельным батчем.
+    """
+    batches, current, tokens = [], [], 0
+    for i, count in enumerate(counts):
+        if current and (tokens + count > max_tokens or len(current) >= max_inputs):
+            batches.append(current)
+            current, tokens = [], 0
+        current.append(i)
+        tokens += count
+    if current:
+        batches.append(current)
+    return batches
+
+
+class EmbeddingPipeline:
+    """
+    Параллельное получение эмбеддингов для пересборки каталога.
+
+    Тексты режутся на батчи по числу токенов (token_batches) и отправляются
+    в embed из пула в concurrency потоков. Ошибки 429/5xx и обрывы соединения
+    повторяются с экспоненциальной паузой (или паузой из Retry-After); после
+    429 паузу выдерживают все потоки, а не только получивший ошибку.
+    embed должна сама сохранять готовый батч (в кэш эмбеддингов) — это и есть
+    контрольная точка: после сбоя сборка запрашивает только недостающее.
+    """
+
+    def __init__(self, embed: Callable[[list[str]], np.ndarray], concurrency: int = 8,
+                 max_tokens: int = 20_000, max_inputs: int = 1_000,
+                 retries: int = 6, backoff: float = 1.0, max_backoff: float = 60.0):
+        self.embed = embed
+        self.concurrency = concurrency
+        self.max_tokens = max_tokens
+        self.max_inputs = max_inputs
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.requests = 0
+        self.retried = 0
+
+        self._lock = threading.Lock()
+        self._resume_at = 0.0
+
+    def retry_delay(self, attempt: int, error: Exception | None = None) -> float:
+        delay = retry_delay(attempt, self.backoff, self.max_backoff)
+        suggested = retry_after(error) if error is not None else None
+        return min(max(delay, suggested), self.max_backoff) if suggested is not None else delay
+
+    def _wait_for_resume(self):
+        with self._lock:
+            pause = self._resume_at - time.monotonic()
+        if pause > 0:
+            time.sleep(pause)
+
+    def _embed_batch(self, texts: list[str]) -> np.ndarray:
+        attempt = 0
+        while True:
+            self._wait_for_resume()
+            try:
+                with self._lock:
+                    self.requests += 1
+                return self.embed(texts)
+            except Exception as e:
+                if attempt >= self.retries or not is_retryable(e):
+                    raise
+                delay = self.retry_delay(attempt, e)
+                with self._lock:
+                    self.retried += 1
+                    if getattr(e, 'status_code', None) == 429:
+                        self._resume_at = max(self._resume_at, time.monotonic() + delay)
+                logger.warning(f"Батч эмбеддингов ({len(texts)} текстов) не получен: {e!r}; "
+                               f"повтор {attempt + 1}/{self.retries} через {delay:.1f} с")
+                time.sleep(delay)
+                attempt += 1
+
+    def run(self, texts: list[str], counts: list[int]) -> np.ndarray:
+        """
+        Эмбеддинги texts в том же порядке. counts — число токенов каждого текста.
+        Если батч не удалось получить и после повторов, исключение пробрасывается,
+        а батчи, ещё не отправленные к этому моменту, отменяются.
+        """
+        batches = token_batches(counts, self.max_tokens, self.max_inputs)
+        results: list[np.ndarray | None] = [None] * len(batches)
+        started = time.perf_counter()
+        logger.info(f"Эмбеддинги: {len(texts)} текстов, {sum(counts)} токенов, {len(batches)} батчей, "
+                    f"параллельно {self.concurrency}")
+
+        pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='embedding')
+        try:
+            futures = {pool.submit(self._embed_batch, [texts[i] for i in batch]): n
+                       for n, batch in enumerate(batches)}
+            step = max(1, len(batches) // 10)
+            for done, future in enumerate(as_completed(futures), 1):
+                results[futures[future]] = future.result()
+                if done % step == 0 or done == len(batches):
+                    logger.info(f"Эмбеддинги: {done}/{len(batches)} батчей за {time.perf_counter() - started:.1f} с")
+        finally:
+            # Уже отправленные батчи дожидаемся: они успеют попасть в кэш
+            pool.shutdown(wait=True, cancel_futures=True)
+        return np.vstack(results) if results else np.empty((0, 0), dtype=np.float32)
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import re
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+
+import numpy as np
+
+logger = logging.getLogger('embedding_providers')
+
+# Локальные эмбеддинги: символьные n-граммы, хэшированные в dim знаковых корзин
+LOCAL_NGRAM_RANGE = (3, 5)
+# Батч, который целиком считается в одном процессе пула
+LOCAL_CHUNK_SIZE = 1_000
+# Меньше этого числа текстов считаем в своём процессе: пересылка в пул дороже самой работы
+LOCAL_INLINE_TEXTS = 2 * LOCAL_CHUNK_SIZE
+# Версия алгоритма входит в имя модели: векторы разных версий несовместимы
+LOCAL_HASH_VERSION = 1
+
+_NON_WORD_RE = re.compile(r'[^0-9a-zа-я]+')
+_FNV_OFFSET = np.uint32(0x811c9dc5)
+_FNV_PRIME = np.uint32(0x01000193)
+
+
+class EmbeddingProvider(ABC):
+    """
+    Источник эмбеддингов для каталога и реплик пользователя.
+
+    name — идентификатор модели: по нему ключуются кэш эмбеддингов,
+    векторы реплик в истории и снимок каталога, так что смена провайдера
+    не смешивает несовместимые векторы. remote — провайдер ходит в сеть:
+    его ответы кэшируются, а пересборка идёт через EmbeddingPipeline
+    с повторами; локальный провайдер считает всё на месте.
+    """
+    name: str
+    remote: bool = True
+
+    @abstractmethod
+    def embed(self, texts: list[str]) -> np.ndarray:
+        ...
+
+    async def embed_async(self, texts: list[str]) -> np.ndarray:
+        return await asyncio.to_thread(self.embed, texts)
+
+    def close(self):
+        pass
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """
+    Эмбеддинги OpenAI. Клиенты передаются функциями: gpt_client пересоздаёт
+    их при смене прокси, и провайдер всегда берёт текущий.
+    """
+    remote = True
+
+    def __init__(self, model: str, client: Callable, async_client: Callable):
+        self.name = model
+        self._client = client
+        self._async_client = async_client
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        resp = self._client().embeddings.create(input=texts, model=self.name)
+        return np.array([datum.embedding for datum in resp.data], dtype=np.float32)
+
+    async def embed_async(self, texts: list[str]) -> np.ndarray:
+        resp = await self._async_client().embeddings.create(input=texts, model=self.name)
+        return np.array([datum.embedding for datum in resp.data], dtype=np.float32)
+
+
+def _normalize_text(text: str) -> str:
+    text = text.lower().replace('ё', 'е') if isinstance(text, str) else ''
+    return f" {_NON_WORD_RE.sub(' ', text).strip()} "
+
+
+def _mix(h: np.ndarray) -> np.ndarray:
+    # Финализатор murmur3: FNV плохо перемешивает младшие биты, а корзина берётся по модулю
+    h ^= h >> np.uint32(16)
+    h *= np.uint32(0x85ebca6b)
+    h ^= h >> np.uint32(13)
+    h *= np.uint32(0xc2b2ae35)
+    h ^= h >> np.uint32(16)
+    return h
+
+
+def hash_embeddings(texts: list[str], dim: int, ngram_range: tuple[int, int] = LOCAL_NGRAM_RANGE) -> np.ndarray:
+    """
+    Нормированные эмбеддинги texts хэшированием символьных n-грамм (feature hashing).
+
+    Все тексты батча склеиваются в один массив кодов символов через \\0, и хэш
+    FNV-1a n-грамм считается сразу для всех позиций: хэш n-граммы — это хэш
+    (n-1)-граммы, продолженный ещё одним символом. n-граммы через границу
+    текстов отбрасываются. Знак слагаемого — старший бит хэша, так что коллизии
+    в среднем гасят друг друга. Без обучения и без состояния: один и тот же
+    текст в любом процессе даёт один и тот же вектор.
+    """
+    result = np.zeros((len(texts), dim), dtype=np.float64)
+    if not texts:
+        return result.astype(np.float32)
+    codes = np.frombuffer('\0'.join(_normalize_text(t) for t in texts).encode('utf-32-le'), dtype=np.uint32)
+    separators = codes == 0
+    doc_ids = np.cumsum(separators, dtype=np.int64)
+    h = (np.full(len(codes), _FNV_OFFSET, dtype=np.uint32) ^ codes) * _FNV_PRIME
+    for n in range(2, ngram_range[1] + 1):
+        count = len(codes) - n + 1
+        if count <= 0:
+            break
+        h = h[:count]
+        h ^= codes[n - 1:]
+        h *= _FNV_PRIME
+        if n < ngram_range[0]:
+            continue
+        valid = (doc_ids[:count] == doc_ids[n - 1:]) & ~separators[:count]
+        mixed = _mix(h[valid])
+        buckets = doc_ids[:count][valid] * dim + (mixed % np.uint32(dim))
+        signs = np.where(mixed >> np.uint32(31), -1.0, 1.0)
+        result += np.bincount(buckets, weights=signs, minlength=len(texts) * dim).reshape(len(texts), dim)
+    norms = np.linalg.norm(result, axis=1, keepdims=True)
+    np.divide(result, norms, out=result, where=norms > 0)
+    return result.astype(np.float32)
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """
+    Эмбеддинги без сети: hash_embeddings на CPU. Большие наборы (пересборка
+    каталога) режутся на батчи по LOCAL_CHUNK_SIZE и считаются в пуле процессов,
+    короткие (реплика пользователя) — сразу в вызывающем потоке.
+
+    Качество ниже, чем у модели OpenAI: близость тут лексическая (общие
+    фрагменты слов), а не смысловая. Годится для работы без доступа к API,
+    офлайн-тестов и замеров поиска в изоляции.
+    """
+    remote = False
+
+    def __init__(self, dim: int = 512, workers: int | None = None):
+        self.dim = dim
+        self.workers = workers or os.cpu_count() or 1
+        self.name = f"local-hash-{dim}-v{LOCAL_HASH_VERSION}"
+        self._pool: ProcessPoolExecutor | None = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        # spawn, а не fork: процесс бота многопоточный, а форк с чужими блокировками ненадёжен
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, self.dim), dtype=np.float32)
+        # Батчами и в пуле: весь каталог одним массивом кодов символов не уместился бы в память
+        chunks = [texts[i:i + LOCAL_CHUNK_SIZE] for i in range(0, len(texts), LOCAL_CHUNK_SIZE)]
+        if len(texts) < LOCAL_INLINE_TEXTS or self.workers == 1:
+            return np.vstack([hash_embeddings(chunk, self.dim) for chunk in chunks])
+        return np.vstack(list(self.pool.map(hash_embeddings, chunks, [self.dim] * len(chunks))))
+
+    async def embed_async(self, texts: list[str]) -> np.ndarray:
+        # Реплика считается за десятки микросекунд — в поток не уводим
+        if len(texts) < LOCAL_CHUNK_SIZE:
+            return hash_embeddings(texts, self.dim)
+        return await asyncio.to_thread(self.embed, texts)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
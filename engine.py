@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable
+
+logger = logging.getLogger('engine')
+
+# Через сколько секунд отложенная задача повторит попытку встать в переполненную очередь
+REQUEUE_DELAY = 1.0
+
+
+class MessageEngine:
+    """
+    asyncio-движок обработки сообщений в отдельном потоке.
+
+    Задачи из Flask-потоков кладутся в общую очередь, которую разбирает
+    фиксированный пул корутин-воркеров. Отложенные задачи (ответ через 30 с,
+    напоминания) ставятся на loop.call_at и не держат по потоку на каждую.
+    """
+
+    def __init__(self, workers: int = 32, queue_size: int = 10_000):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.loop = asyncio.new_event_loop()
+        self.in_flight = 0
+        self.scheduled = 0
+
+        self._queue: asyncio.Queue | None = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='message-engine', daemon=True)
+
+    def start(self) -> "MessageEngine":
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        for i in range(self.workers):
+            self.loop.create_task(self._worker(), name=f'engine-worker-{i}')
+        self._ready.set()
+        logger.info(f"Message engine started with {self.workers} workers")
+        self.loop.run_forever()
+
+    async def _worker(self):
+        while True:
+            coro_fn, args = await self._queue.get()
+            self.in_flight += 1
+            try:
+                await coro_fn(*args)
+            except Exception:
+                logger.exception(f"Ошибка в задаче {getattr(coro_fn, '__name__', coro_fn)}")
+            finally:
+                self.in_flight -= 1
+                self._queue.task_done()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _enqueue(self, coro_fn: Callable[..., Awaitable[Any]], args: tuple, drop: bool = True) -> bool:
+        try:
+            self._queue.put_nowait((coro_fn, args))
+            return True
+        except asyncio.QueueFull:
+            if drop:
+                logger.error(f"Очередь движка переполнена, задача {coro_fn.__name__} отброшена")
+            return False
+
+    def submit(self, coro_fn: Callable[..., Awaitable[Any]], *args):
+        """
+        Ставит coro_fn(*args) в очередь воркеров. Можно звать из любого потока.
+        """
+        if threading.current_thread() is self._thread:
+            self._enqueue(coro_fn, args)
+        else:
+            self.loop.call_soon_threadsafe(self._enqueue, coro_fn, args)
+
+    def call_later(self, delay: float, coro_fn: Callable[..., Awaitable[Any]], *args):
+        """
+        Через delay секунд ставит coro_fn(*args) в очередь воркеров.
+        Таймер — запись в планировщике цикла (loop.call_at), а не отдельный поток.
+        """
+        when_wall = time.monotonic() + delay
+
+        def schedule():
+            self.scheduled += 1
+            when = self.loop.time() + max(0.0, when_wall - time.monotonic())
+            self.loop.call_at(when, fire)
+
+        def fire():
+            # Отложенную задачу не теряем: ответ на буфер сообщений больше никто не запланирует
+            if self._enqueue(coro_fn, args, drop=False):
+                self.scheduled -= 1
+            else:
+                logger.warning(f"Очередь движка переполнена, задача {coro_fn.__name__} "
+                               f"отложена ещё на {REQUEUE_DELAY} с")
+                self.loop.call_later(REQUEUE_DELAY, fire)
+
+        if threading.current_thread() is self._thread:
+            schedule()
+        else:
+            self.loop.call_soon_threadsafe(schedule)
+
+    def run(self, coro: Awaitable[Any]) -> Future:
+        """
+        Запускает корутину в цикле движка вне очереди воркеров (фоновые сервисы).
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
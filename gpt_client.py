@@ -1,21 +1,86 @@
-import hashlib
+import asyncio
 import logging
 import os
+import threading
+import time
+from dataclasses import dataclass
 
 import faiss
+import httpx
 import numpy as np
 import pandas as pd
-from openai import OpenAI, APIError, RateLimitError
+from openai import OpenAI, AsyncOpenAI, APIError, RateLimitError
 
+from answer_cache import AnswerCache
+from catalog_snapshot import (ProductTable, HASH_COLUMNS, atomic_write, write_snapshot, read_manifest, read_hashes,
+                              file_fingerprint)
 from config import OPENAI_API_KEY
+from embedding_cache import EmbeddingCache, text_key
+from embedding_pipeline import EmbeddingPipeline
+from embedding_providers import EmbeddingProvider, OpenAIEmbeddingProvider, LocalEmbeddingProvider
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+from metrics import stage_seconds, openai_in_flight, openai_tokens, openai_errors
+from price_filter import PriceIndex, PriceRange, split_price_constraint
+from prompt_builder import TokenCounter, PromptMeter, build_prompt
 
 # ---------- Configuration ----------
 PRODUCT_CSV_PATH = 'products/products.csv'
 METADATA_CSV_PATH = 'products/products_metadata.csv'
 INDEX_PATH = 'products/products.index'
+CATALOG_SNAPSHOT_DIR = 'products/catalog'
+VECTORS_PATH = 'products/products_vectors.npy'
+VECTOR_IDS_PATH = 'products/products_vector_ids.npy'
+EMBEDDING_CACHE_PATH = 'products/embeddings_cache.sqlt'
+EMBEDDING_CACHE_MAX_ENTRIES = 200_000
+EMBEDDING_CACHE_MEMORY_ENTRIES = 5_000
+# Провайдер эмбеддингов: openai (EMBEDDING_MODEL через API) | local (хэширование n-грамм на CPU, без сети)
+EMBEDDING_PROVIDER = 'openai'
 EMBEDDING_MODEL = 'text-embedding-3-small'
-EMBEDDING_BATCH_SIZE = 100
+LOCAL_EMBEDDING_DIM = 512
+LOCAL_EMBEDDING_WORKERS = None  # None — по числу ядер
+# Пересборка каталога: батчи по токенам (лимит API — 300k токенов и 2048 текстов на запрос),
+# EMBEDDING_CONCURRENCY запросов одновременно, повторы 429/5xx с экспоненциальной паузой
+EMBEDDING_BATCH_TOKENS = 20_000
+EMBEDDING_BATCH_MAX_INPUTS = 1_000
+EMBEDDING_MAX_INPUT_TOKENS = 8_000
+EMBEDDING_CONCURRENCY = 8
+EMBEDDING_RETRIES = 6
+EMBEDDING_BACKOFF = 1.0
+EMBEDDING_MAX_BACKOFF = 60.0
 TOP_K = 5
+# Гибридный поиск: сколько кандидатов берётся из FAISS и BM25 перед слиянием RRF
+HYBRID_CANDIDATES = 20
+RRF_K = 60
+# Вес реплики в эмбеддинге беседы падает в CONVERSATION_DECAY раз с каждой более новой репликой
+CONVERSATION_DECAY = 0.5
+REINDEX_RETRY_DELAY = 60
+# mmap для плоских индексов появился как отдельный флаг; в старых faiss — общий IO_FLAG_MMAP
+INDEX_MMAP_FLAG = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP)
+# Тип FAISS-индекса: flat_l2 | flat_ip (точный поиск), hnsw | ivf (приближённый)
+INDEX_TYPE = 'flat_l2'
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 64
+IVF_NLIST = None  # None — подобрать по размеру каталога
+IVF_NPROBE = 8
+TEXT_COLUMNS = ['name', 'description', 'price']
+OPENAI_MAX_CONNECTIONS = 20
+OPENAI_KEEPALIVE_EXPIRY = 120
+OPENAI_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+# Клиент, заменённый при смене прокси, закрывается через это время (с): запросы,
+# которые уже в полёте, успевают завершиться по OPENAI_TIMEOUT
+OPENAI_CLIENT_CLOSE_DELAY = 120
+CHAT_MODEL = 'gpt-4o-mini'
+CHAT_MAX_TOKENS = 400
+# Бюджет токенов на весь промпт: системный промпт + товары + история + сообщение
+PROMPT_TOKEN_BUDGET = 3_000
+# Доля бюджета (после промпта и сообщения), которую могут занять товары
+PRODUCT_CONTEXT_SHARE = 0.6
+# Семантический кэш ответов на первую реплику диалога (выключен по умолчанию)
+ANSWER_CACHE_ENABLED = False
+ANSWER_CACHE_THRESHOLD = 0.95
+ANSWER_CACHE_TTL = 24 * 60 * 60
+ANSWER_CACHE_MAX_ENTRIES = 1_000
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 LOG_DIR = os.path.join(BASE_DIR, 'logs')
@@ -44,223 +109,771 @@ logger = logging.getLogger('gpt')
 
 
 openai_client: OpenAI = None
-_products: pd.DataFrame = None
-_metadata: pd.DataFrame = None
-index = None
-# ---------- Proxy Helper ----------
-def configure_proxy(host: str, port: str, user: str, password: str) -> tuple[str | None, str | None]:
+_openai_proxy_url: str | None = None
+_openai_client_lock = threading.Lock()
+async_openai_client: AsyncOpenAI = None
+_async_openai_proxy_url: str | None = None
+embedding_cache = EmbeddingCache(
+    EMBEDDING_CACHE_PATH,
+    max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+    memory_entries=EMBEDDING_CACHE_MEMORY_ENTRIES,
+)
+answer_cache = AnswerCache(
+    threshold=ANSWER_CACHE_THRESHOLD,
+    ttl=ANSWER_CACHE_TTL,
+    max_entries=ANSWER_CACHE_MAX_ENTRIES,
+)
+token_counter = TokenCounter(CHAT_MODEL)
+embedding_counter = TokenCounter(EMBEDDING_MODEL)
+prompt_meter = PromptMeter()
+_catalog: "CatalogSnapshot | None" = None
+# ---------- OpenAI Client ----------
+def build_proxy_url(host: str, port: str, user: str, password: str) -> str | None:
+    """
+    Собирает URL прокси из настроек бота. Пустой host означает работу без прокси.
     """
-    Устанавливает HTTP_PROXY и HTTPS_PROXY и возвращает старые значения.
+    if not host:
+        return None
+    return f"http://{user}:{password}@{host}:{port}"
+
+
+def get_openai_client(proxy_url: str | None) -> OpenAI:
     """
-    proxy_url = f"http://{user}:{password}@{host}:{port}"
-    old_http = os.environ.get("HTTP_PROXY")
-    old_https = os.environ.get("HTTPS_PROXY")
-    os.environ["HTTP_PROXY"] = proxy_url
-    os.environ["HTTPS_PROXY"] = proxy_url
-    return old_http, old_https
+    Возвращает общий OpenAI клиент с keep-alive пулом соединений через proxy_url.
+    Клиент пересоздаётся только при смене настроек прокси; прокси задаётся
+    самому httpx-клиенту, а не через HTTP_PROXY/HTTPS_PROXY в os.environ.
+    """
+    global openai_client, _openai_proxy_url
+    client = openai_client
+    if client is not None and _openai_proxy_url == proxy_url:
+        return client
+
+    with _openai_client_lock:
+        if openai_client is None or _openai_proxy_url != proxy_url:
+            http_client = httpx.Client(
+                proxy=proxy_url,
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+                    keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+                ),
+                timeout=OPENAI_TIMEOUT,
+            )
+            if openai_client is not None:
+                # Сразу не закрываем: им могут пользоваться запросы, которые уже в полёте
+                closer = threading.Timer(OPENAI_CLIENT_CLOSE_DELAY, openai_client.close)
+                closer.daemon = True
+                closer.start()
+            # Повторы запросов ведёт embedding_pipeline — свои повторы SDK выключены
+            openai_client = OpenAI(api_key=OPENAI_API_KEY, http_client=http_client, max_retries=0)
+            _openai_proxy_url = proxy_url
+            logger.info("OpenAI клиент пересоздан" + (" с прокси" if proxy_url else " без прокси"))
+        return openai_client
+
+
+def get_async_openai_client(proxy_url: str | None) -> AsyncOpenAI:
+    """
+    Асинхронный двойник get_openai_client для цикла движка сообщений.
+    Вызывается только из потока цикла, поэтому блокировка не нужна.
+    """
+    global async_openai_client, _async_openai_proxy_url
+    if async_openai_client is None or _async_openai_proxy_url != proxy_url:
+        http_client = httpx.AsyncClient(
+            proxy=proxy_url,
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+                keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+            ),
+            timeout=OPENAI_TIMEOUT,
+        )
+        if async_openai_client is not None:
+            old_client = async_openai_client
+            asyncio.get_running_loop().call_later(
+                OPENAI_CLIENT_CLOSE_DELAY, lambda: asyncio.ensure_future(old_client.close())
+            )
+        async_openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=http_client)
+        _async_openai_proxy_url = proxy_url
+        logger.info("Async OpenAI клиент пересоздан" + (" с прокси" if proxy_url else " без прокси"))
+    return async_openai_client
 
 
 # ---------- Embedding Helpers ----------
 
-def hash_text(text: str) -> str:
-    return hashlib.md5(text.encode('utf-8')).hexdigest()
+def hash_column(column: pd.Series) -> np.ndarray:
+    """
+    Хэширует колонку целиком (векторизованно, uint64 на строку).
+    """
+    return pd.util.hash_pandas_object(column.astype(str), index=False).to_numpy(dtype=np.uint64)
+
+
+def add_hashes(df: pd.DataFrame) -> pd.DataFrame:
+    for column, hash_name in zip(TEXT_COLUMNS, HASH_COLUMNS):
+        df[hash_name] = hash_column(df[column])
+    return df
+
+
+def prepare_products(df: pd.DataFrame) -> pd.DataFrame:
+    # id товара — номер строки в products.csv, он же id вектора в FAISS
+    df['id'] = np.arange(len(df), dtype=np.int64)
+    return add_hashes(df).set_index('id')
 
 
 def load_products() -> pd.DataFrame:
-    # Читаем CSV с колонками name и price
+    # Читаем CSV с колонками name, description и price; цена — число (NaN, если не указана)
     df = pd.read_csv(PRODUCT_CSV_PATH)
-    df['id'] = df.index.astype(str)
-    df['name_hash'] = df['name'].apply(hash_text)
-    df['price_hash'] = df['price'].astype(str).apply(hash_text)
-    df['description_hash'] = df['description'].astype(str).apply(hash_text)
-    return df.set_index('id')
+    df['price'] = pd.to_numeric(df['price'], errors='coerce')
+    return prepare_products(df)
 
 
 def load_metadata() -> pd.DataFrame:
+    """
+    Возвращает хэши последнего проиндексированного каталога: из бинарного снимка,
+    а если его ещё нет — из products_metadata.csv прежних версий.
+    """
+    if read_manifest(CATALOG_SNAPSHOT_DIR, any_format=True) is not None:
+        return read_hashes(CATALOG_SNAPSHOT_DIR)
     # Если файл с метаданными существует — читаем и ставим index по 'id'
     if os.path.exists(METADATA_CSV_PATH):
-        md = pd.read_csv(METADATA_CSV_PATH, dtype={'id': str})
-        md['name_hash'] = md['name_hash'].astype(str)
-        md['price_hash'] = md['price_hash'].astype(str)
-        md['description_hash'] = md['description_hash'].astype(str)
+        md = pd.read_csv(METADATA_CSV_PATH, dtype={'id': np.int64, **{h: str for h in HASH_COLUMNS}})
+        try:
+            for hash_name in HASH_COLUMNS:
+                md[hash_name] = md[hash_name].astype(np.uint64)
+        except (ValueError, TypeError, OverflowError):
+            # Старый формат с md5 по строке: пересчитываем хэши по сохранённым в метаданных текстам
+            logger.info("Метаданные в старом формате хэшей, пересчитываем")
+            md = add_hashes(md)
         return md.set_index('id')
     # Иначе создаём пустой DataFrame с индексом 'id'
-    cols = ['name', 'description', 'price', 'name_hash', 'description_hash', 'price_hash']
-    df = pd.DataFrame(columns=cols)
-    df.index.name = 'id'
+    df = pd.DataFrame({column: pd.Series(dtype=object) for column in TEXT_COLUMNS})
+    for hash_name in HASH_COLUMNS:
+        df[hash_name] = pd.Series(dtype=np.uint64)
+    df.index = pd.Index([], dtype=np.int64, name='id')
     return df
 
 
-def get_embedding_batch(texts: list[str]) -> np.ndarray:
+@dataclass(frozen=True)
+class CatalogChanges:
     """
-    Возвращает эмбеддинги для списка текстов.
-    Использует OpenAI клиент и корректно обрабатывает ответ.
+    Отличия текущего каталога от сохранённых метаданных, по группам id товаров.
     """
-    resp = openai_client.embeddings.create(input=texts, model=EMBEDDING_MODEL)
-    embs = [datum.embedding for datum in resp.data]
-    return np.array(embs, dtype=np.float32)
+    added: pd.Index
+    removed: pd.Index
+    name_changed: pd.Index
+    description_changed: pd.Index
+    price_changed: pd.Index
 
+    @property
+    def text_changed(self) -> pd.Index:
+        return self.name_changed.union(self.description_changed)
+
+    @property
+    def to_embed(self) -> pd.Index:
+        # Новые товары и товары с изменённым текстом — их эмбеддинги устарели или отсутствуют
+        return self.added.union(self.text_changed)
+
+    @property
+    def to_remove(self) -> pd.Index:
+        return self.removed.union(self.text_changed)
+
+    def __bool__(self) -> bool:
+        return any(len(group) for group in (
+            self.added, self.removed, self.name_changed, self.description_changed, self.price_changed
+        ))
+
+    def summary(self) -> str:
+        return (f"added={len(self.added)} removed={len(self.removed)} name={len(self.name_changed)} "
+                f"description={len(self.description_changed)} price={len(self.price_changed)}")
 
-# ---------- Vectorization Initialization ----------
 
-def initialize_vectorization(proxy_host, proxy_port, proxy_user, proxy_password) -> None:
+def diff_catalog(products: pd.DataFrame, metadata: pd.DataFrame) -> CatalogChanges:
     """
-    Инициализирует OpenAI клиент, загружает данные, строит FAISS-индекс и обновляет метаданные.
+    Сравнивает хэши колонок каталога с метаданными за один проход:
+    inner join по целочисленному id и поколоночное сравнение массивов хэшей.
     """
-    global openai_client, _products, _metadata, index
-    # Настраиваем клиента
-    old_http, old_https = configure_proxy(host=proxy_host, port=proxy_port, user=proxy_user, password=proxy_password)
-    openai_client = OpenAI(api_key=OPENAI_API_KEY)
+    joined = products[HASH_COLUMNS].join(metadata[HASH_COLUMNS], how='inner', rsuffix='_old')
+    current = joined[HASH_COLUMNS].to_numpy(dtype=np.uint64)
+    previous = joined[[h + '_old' for h in HASH_COLUMNS]].to_numpy(dtype=np.uint64)
+    changed = current != previous
+    return CatalogChanges(
+        added=products.index.difference(metadata.index),
+        removed=metadata.index.difference(products.index),
+        name_changed=joined.index[changed[:, 0]],
+        description_changed=joined.index[changed[:, 1]],
+        price_changed=joined.index[changed[:, 2]],
+    )
 
-    old_products = None
-    if _products is not None:
-        old_products = _products.copy()
-    # Загружаем продукты и метаданные
-    _products = load_products()
-    _metadata = load_metadata()
 
+def make_embedding_provider(kind: str) -> EmbeddingProvider:
+    """
+    Фабрика провайдеров эмбеддингов по EMBEDDING_PROVIDER.
+    """
+    if kind == 'openai':
+        return OpenAIEmbeddingProvider(EMBEDDING_MODEL, lambda: openai_client, lambda: async_openai_client)
+    if kind == 'local':
+        return LocalEmbeddingProvider(LOCAL_EMBEDDING_DIM, LOCAL_EMBEDDING_WORKERS)
+    raise ValueError(f"Неизвестный провайдер эмбеддингов: {kind}")
 
-    # 3) проверяем, есть ли изменения
-    rebuild_index = False
 
-    if old_products is not None and old_products.shape != _products.shape:
-        logger.info("products не совпадает, перестроим индексы")
-        rebuild_index = True
+embedding_provider = make_embedding_provider(EMBEDDING_PROVIDER)
 
-    if len(_products) != len(_metadata):
-        logger.info("products не совпадает с metadata, перестроим индексы")
-        rebuild_index = True
 
-    changes = []
-    for pid, row in _products.iterrows():
-        if pid not in _metadata.index:
-            changes.append((pid, 'new'))
-        else:
-            old = _metadata.loc[pid]
-            if row['name_hash'] != old['name_hash']:
-                changes.append((pid, 'name_changed'))
-            if row['price_hash'] != old['price_hash']:
-                changes.append((pid, 'price_changed'))
-            if row['description_hash'] != old['description_hash']:
-                changes.append((pid, 'description_changed'))
+async def get_embedding_batch_async(texts: list[str]) -> np.ndarray:
+    """
+    Возвращает эмбеддинги для списка текстов в цикле движка сообщений.
+    К сетевому провайдеру уходят только тексты, которых ещё нет в кэше эмбеддингов.
+    """
+    provider = embedding_provider
+    if not provider.remote:
+        with stage_seconds.time('embedding'):
+            return await provider.embed_async(texts)
+    # Кэш — SQLite под блокировкой: в пул потоков, чтобы не держать цикл движка
+    vectors, missing = await asyncio.to_thread(_lookup_embeddings, texts)
+    if missing:
+        with stage_seconds.time('embedding'), openai_in_flight.track('embeddings'):
+            fetched = await provider.embed_async(missing)
+        vectors = await asyncio.to_thread(_store_embeddings, texts, vectors, missing, fetched)
+    return np.array(vectors, dtype=np.float32)
+
+
+def _lookup_embeddings(texts: list[str]) -> tuple[list, list[str]]:
+    vectors = embedding_cache.get_many(embedding_provider.name, texts)
+    missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+    return vectors, missing
+
+
+def _store_embeddings(texts: list[str], vectors: list, missing: list[str], fetched: np.ndarray) -> list:
+    embedding_cache.put_many(embedding_provider.name, missing, fetched)
+    by_text = dict(zip(missing, fetched))
+    return [v if v is not None else by_text[t] for t, v in zip(texts, vectors)]
+
+
+# ---------- Vector Storage ----------
+
+def product_texts(df: pd.DataFrame) -> list[str]:
+    return (df['name'].fillna('') + '. ' + df['description'].fillna('')).tolist()
+
+
+def _fetch_embeddings(texts: list[str]) -> np.ndarray:
+    # Один батч пересборки; сохранённый в кэш батч — контрольная точка для следующей попытки
+    fetched = embedding_provider.embed(texts)
+    embedding_cache.put_many(embedding_provider.name, texts, fetched)
+    return fetched
+
+
+embedding_pipeline = EmbeddingPipeline(
+    _fetch_embeddings,
+    concurrency=EMBEDDING_CONCURRENCY,
+    max_tokens=EMBEDDING_BATCH_TOKENS,
+    max_inputs=EMBEDDING_BATCH_MAX_INPUTS,
+    retries=EMBEDDING_RETRIES,
+    backoff=EMBEDDING_BACKOFF,
+    max_backoff=EMBEDDING_MAX_BACKOFF,
+)
+
+
+def clip_embedding_input(text: str) -> str:
+    # Текст длиннее лимита модели роняет весь запрос; токен — не меньше символа, так что короткие не считаем
+    if len(text) > EMBEDDING_MAX_INPUT_TOKENS and embedding_counter.count(text) > EMBEDDING_MAX_INPUT_TOKENS:
+        return embedding_counter.truncate(text, EMBEDDING_MAX_INPUT_TOKENS)
+    return text
+
+
+def embed_products(df: pd.DataFrame) -> np.ndarray:
+    """
+    Возвращает нормированные эмбеддинги товаров df. Уже посчитанные берутся
+    из кэша эмбеддингов, остальные запрашиваются через embedding_pipeline:
+    параллельно, батчами по токенам, с повторами. Каждый батч сразу пишется
+    в кэш, поэтому прерванная пересборка продолжается с места обрыва.
+    Локальный провайдер считает все векторы сам, без кэша и повторов.
+    """
+    if not embedding_provider.remote:
+        embs_np = embedding_provider.embed(product_texts(df))
+        faiss.normalize_L2(embs_np)
+        return embs_np
+    texts = [clip_embedding_input(text) for text in product_texts(df)]
+    vectors, missing = _lookup_embeddings(texts)
+    if missing:
+        logger.info(f"Эмбеддинги товаров: {len(texts) - len(missing)} из кэша, {len(missing)} к запросу")
+        fetched = embedding_pipeline.run(missing, embedding_counter.count_many(missing))
+        by_text = dict(zip(missing, fetched))
+        vectors = [v if v is not None else by_text[t] for t, v in zip(texts, vectors)]
+    embs_np = np.array(vectors, dtype=np.float32)
+    faiss.normalize_L2(embs_np)
+    return embs_np
+
+
+def make_base_index(kind: str, dim: int, n: int) -> faiss.Index:
+    """
+    Фабрика FAISS-индексов по INDEX_TYPE. Векторы нормированы, поэтому
+    flat_l2 и flat_ip дают одинаковый порядок; hnsw и ivf — приближённый поиск.
+    """
+    if kind == 'flat_l2':
+        return faiss.IndexFlatL2(dim)
+    if kind == 'flat_ip':
+        return faiss.IndexFlatIP(dim)
+    if kind == 'hnsw':
+        base = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        base.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        return base
+    if kind == 'ivf':
+        # ~4·√n списков, но не больше, чем точек для обучения
+        nlist = IVF_NLIST or max(1, min(n, int(4 * np.sqrt(max(n, 1)))))
+        quantizer = faiss.IndexFlatIP(dim)
+        return faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+    raise ValueError(f"Неизвестный тип индекса: {kind}")
+
+
+def index_kind(idx: faiss.Index) -> str | None:
+    base = faiss.downcast_index(idx.index) if isinstance(idx, faiss.IndexIDMap) else faiss.downcast_index(idx)
+    if isinstance(base, faiss.IndexHNSWFlat):
+        return 'hnsw'
+    if isinstance(base, faiss.IndexIVFFlat):
+        return 'ivf'
+    if isinstance(base, faiss.IndexFlat):
+        return 'flat_ip' if base.metric_type == faiss.METRIC_INNER_PRODUCT else 'flat_l2'
+    return None
+
+
+def supports_remove(idx: faiss.Index) -> bool:
+    # HNSW не умеет удалять векторы — такой индекс пересобирается из сохранённых векторов
+    return index_kind(idx) != 'hnsw'
+
+
+def apply_search_params(idx: faiss.Index) -> faiss.Index:
+    """
+    Выставляет параметры поиска (efSearch / nprobe) у загруженного или построенного индекса.
+    """
+    base = faiss.downcast_index(idx.index) if isinstance(idx, faiss.IndexIDMap) else faiss.downcast_index(idx)
+    if isinstance(base, faiss.IndexHNSWFlat):
+        base.hnsw.efSearch = HNSW_EF_SEARCH
+    elif isinstance(base, faiss.IndexIVFFlat):
+        base.nprobe = IVF_NPROBE
+    return idx
+
+
+def filtered_search_params(idx: faiss.Index, selector: faiss.IDSelector) -> faiss.SearchParameters:
+    """
+    Параметры поиска только среди id из selector, с теми же efSearch / nprobe,
+    что выставляет apply_search_params. selector должен жить до конца поиска.
+    """
+    kind = index_kind(idx)
+    if kind == 'hnsw':
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = HNSW_EF_SEARCH
+    elif kind == 'ivf':
+        params = faiss.SearchParametersIVF()
+        params.nprobe = IVF_NPROBE
+    else:
+        params = faiss.SearchParameters()
+    params.sel = selector
+    return params
+
+
+def build_index(ids: np.ndarray, vectors: np.ndarray, kind: str | None = None) -> faiss.Index:
+    kind = kind or INDEX_TYPE
+    base_index = make_base_index(kind, vectors.shape[1], len(vectors))
+    if not base_index.is_trained:
+        base_index.train(vectors)
+    new_index = faiss.IndexIDMap(base_index)
+    new_index.add_with_ids(vectors, ids)
+    return apply_search_params(new_index)
+
+
+def write_index(idx: faiss.Index) -> None:
+    # Индекс может быть открыт через mmap в опубликованном снимке — не переписываем файл на месте
+    atomic_write(INDEX_PATH, lambda f: faiss.write_index(idx, faiss.PyCallbackIOWriter(f.write)))
+
+
+def read_index_mmap(path: str) -> faiss.Index:
+    """
+    Открывает индекс без копирования векторов в память, если тип индекса это позволяет.
+    """
+    try:
+        return faiss.read_index(path, INDEX_MMAP_FLAG)
+    except RuntimeError:
+        return faiss.read_index(path)
+
 
+def save_vectors(ids: np.ndarray, vectors: np.ndarray) -> None:
+    for path, array in ((VECTOR_IDS_PATH, ids), (VECTORS_PATH, vectors)):
+        atomic_write(path, lambda f: np.save(f, array))
+
+
+def load_vectors(existing_index=None) -> tuple[np.ndarray, np.ndarray] | None:
+    """
+    Читает сохранённые векторы товаров. Если их ещё нет, но есть плоский индекс,
+    достаёт векторы из него — так индекс всегда можно пересобрать без обращения к API.
+    """
+    if os.path.exists(VECTORS_PATH) and os.path.exists(VECTOR_IDS_PATH):
+        return np.load(VECTOR_IDS_PATH), np.load(VECTORS_PATH)
+    if existing_index is not None and isinstance(existing_index, faiss.IndexIDMap):
+        base = faiss.downcast_index(existing_index.index)
+        if isinstance(base, faiss.IndexFlat):
+            ids = faiss.vector_to_array(existing_index.id_map).astype(np.int64)
+            vectors = base.reconstruct_n(0, base.ntotal)
+            save_vectors(ids, vectors)
+            return ids, vectors
+    return None
+
+
+# ---------- Vectorization Initialization ----------
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """
+    Согласованный набор (каталог, FAISS-индекс, BM25-индекс, индекс цен). Снимок не меняется
+    после публикации: поиск берёт ссылку на него один раз и работает с ней до конца запроса.
+    """
+    version: object
+    products: ProductTable
+    index: faiss.Index
+    lexical: LexicalIndex
+    prices: PriceIndex
+
+
+def indexed_embedding_model() -> str:
+    """
+    Модель эмбеддингов, которой построен сохранённый индекс. Снимки до появления
+    провайдеров (и products_metadata.csv) строились эмбеддингами OpenAI.
+    """
+    manifest = read_manifest(CATALOG_SNAPSHOT_DIR, any_format=True) or {}
+    return manifest.get('embedding_model', EMBEDDING_MODEL)
+
+
+def build_catalog(version=None) -> CatalogSnapshot:
+    """
+    Загружает данные, обновляет FAISS-индекс и метаданные и возвращает новый снимок.
+
+    Индекс обновляется инкрементально: удалённые товары и товары с изменённым
+    названием/описанием убираются через remove_ids, новые и изменённые
+    добавляются через add_with_ids. Изменение только цены не требует эмбеддингов.
+    Опубликованный снимок при этом не трогается: индекс читается с диска заново.
+    """
+    # Загружаем продукты и метаданные
+    source = file_fingerprint(PRODUCT_CSV_PATH)
+    products = load_products()
+    metadata = load_metadata()
+
+    # 3) проверяем, есть ли изменения
+    changes = diff_catalog(products, metadata)
     if changes:
-        rebuild_index = True
-        for pid, change in changes:
-            logger.info(f"Product {pid}: {change}")
+        logger.info(f"Catalog changes: {changes.summary()}")
     else:
         logger.info("No changes detected.")
 
-    # 4) строим или загружаем FAISS-индекс
-    #    — если файла индекса нет, или если надо пересоздать (rebuild_index=True), мы перебираем все данные
-    if rebuild_index or not os.path.exists(INDEX_PATH):
-        logger.info("Rebuilding FAISS index from scratch...")
-        embs_list, ids = [], []
-        for i in range(0, len(_products), EMBEDDING_BATCH_SIZE):
-            batch = _products.iloc[i:i + EMBEDDING_BATCH_SIZE]
-            texts = (batch['name'].fillna('') + '. ' + batch['description'].fillna('')).tolist()
-            embs_list.append(get_embedding_batch(texts))
-            ids += batch.index.astype(int).tolist()
-        embs_np = np.vstack(embs_list)
+    # Товары, которые нужно (пере)эмбеддить, и товары, которые нужно убрать из индекса
+    to_embed = changes.to_embed
+    to_remove = changes.to_remove.to_numpy(dtype=np.int64)
 
-        faiss.normalize_L2(embs_np)
-        dim = embs_np.shape[1]
-        base_index = faiss.IndexFlatL2(dim)
-        index = faiss.IndexIDMap(base_index)
-        index.add_with_ids(embs_np, np.array(ids, dtype=np.int64))
-        faiss.write_index(index, INDEX_PATH)
+    # 4) обновляем или строим FAISS-индекс
+    existing = faiss.read_index(INDEX_PATH) if os.path.exists(INDEX_PATH) else None
+    stored = load_vectors(existing)
+
+    indexed_model = indexed_embedding_model()
+    if indexed_model != embedding_provider.name:
+        logger.info(f"Индекс построен моделью {indexed_model}, текущая — {embedding_provider.name}")
+    if existing is None or stored is None or existing.ntotal != len(stored[0]) \
+            or indexed_model != embedding_provider.name:
+        logger.info("Rebuilding FAISS index from scratch...")
+        ids = products.index.to_numpy(dtype=np.int64)
+        vectors = embed_products(products)
+        new_index = build_index(ids, vectors)
+        write_index(new_index)
+        save_vectors(ids, vectors)
+    elif len(to_embed) or len(to_remove) or index_kind(existing) != INDEX_TYPE:
+        logger.info(f"Updating FAISS index: -{len(to_remove)} +{len(to_embed)}")
+        ids, vectors = stored
+        new_ids = to_embed.to_numpy(dtype=np.int64)
+        # Добавляемые id тоже сначала убираем: если прошлая сборка упала после записи индекса,
+        # но до write_snapshot, они уже в индексе, а diff снова считает их новыми
+        drop_ids = np.union1d(to_remove, new_ids)
+        if len(drop_ids):
+            keep = ~np.isin(ids, drop_ids)
+            ids, vectors = ids[keep], vectors[keep]
+        new_vectors = embed_products(products.loc[to_embed]) if len(to_embed) else None
+        if new_vectors is not None:
+            ids, vectors = np.concatenate([ids, new_ids]), np.vstack([vectors, new_vectors])
+
+        if index_kind(existing) == INDEX_TYPE and supports_remove(existing):
+            if len(drop_ids):
+                existing.remove_ids(faiss.IDSelectorBatch(drop_ids))
+            if new_vectors is not None:
+                existing.add_with_ids(new_vectors, new_ids)
+            new_index = apply_search_params(existing)
+        else:
+            # Сменился INDEX_TYPE или индекс не поддерживает удаление — собираем из сохранённых векторов
+            logger.info(f"Building {INDEX_TYPE} index from stored vectors...")
+            new_index = build_index(ids, vectors)
+        write_index(new_index)
+        save_vectors(ids, vectors)
     else:
         logger.info("Loading existing FAISS index...")
-        index = faiss.read_index(INDEX_PATH)
+        new_index = apply_search_params(existing)
     logger.info("successful")
-    # Сохраняем актуальные метаданные
-    _products[['name', 'description', 'price', 'name_hash', 'description_hash', 'price_hash']].to_csv(METADATA_CSV_PATH)
+    # Лексический индекс и индекс цен строятся рядом с векторным и пишутся до манифеста снимка
+    LexicalIndex.build(products).save(CATALOG_SNAPSHOT_DIR)
+    PriceIndex.build(products).save(CATALOG_SNAPSHOT_DIR)
+    # Сохраняем актуальный каталог бинарным снимком: он же метаданные для следующего diff
+    write_snapshot(CATALOG_SNAPSHOT_DIR, products, source, embedding_provider.name)
+    return CatalogSnapshot(version=version, products=ProductTable(CATALOG_SNAPSHOT_DIR), index=new_index,
+                           lexical=LexicalIndex.load(CATALOG_SNAPSHOT_DIR),
+                           prices=PriceIndex.load(CATALOG_SNAPSHOT_DIR))
 
-    if old_http is not None:
-        os.environ["HTTP_PROXY"] = old_http
-    else:
-        os.environ.pop("HTTP_PROXY", None)
 
-    if old_https is not None:
-        os.environ["HTTPS_PROXY"] = old_https
-    else:
-        os.environ.pop("HTTPS_PROXY", None)
+def open_catalog(version=None) -> CatalogSnapshot | None:
+    """
+    Быстрый холодный старт: если products.csv не менялся с последней сборки,
+    открывает бинарный снимок и индекс через mmap, не читая CSV и не пересчитывая хэши.
+    Возвращает None, если снимок устарел и каталог надо собирать.
+    """
+    manifest = read_manifest(CATALOG_SNAPSHOT_DIR)
+    if manifest is None or not os.path.exists(INDEX_PATH):
+        return None
+    if manifest['source'] != file_fingerprint(PRODUCT_CSV_PATH):
+        return None
+    if manifest.get('embedding_model', EMBEDDING_MODEL) != embedding_provider.name:
+        return None
+    lexical = LexicalIndex.load(CATALOG_SNAPSHOT_DIR)
+    prices = PriceIndex.load(CATALOG_SNAPSHOT_DIR)
+    if lexical is None or prices is None:
+        return None
+    idx = read_index_mmap(INDEX_PATH)
+    if idx.ntotal != manifest['rows'] or index_kind(idx) != INDEX_TYPE:
+        return None
+    logger.info("Catalog snapshot is up to date, opened without rebuild")
+    return CatalogSnapshot(version=version, products=ProductTable(CATALOG_SNAPSHOT_DIR),
+                           index=apply_search_params(idx), lexical=lexical, prices=prices)
+
+
+def initialize_vectorization(proxy_host, proxy_port, proxy_user, proxy_password, version=None) -> None:
+    """
+    Инициализирует OpenAI клиент, строит снимок каталога и публикует его
+    одной заменой ссылки _catalog.
+    """
+    global _catalog
+    # Настраиваем клиента
+    get_openai_client(build_proxy_url(proxy_host, proxy_port, proxy_user, proxy_password))
+    _catalog = open_catalog(version) or build_catalog(version)
+
+
+def catalog_version():
+    catalog = _catalog
+    return catalog.version if catalog is not None else None
+
+
+def catalog_size() -> int:
+    catalog = _catalog
+    return catalog.index.ntotal if catalog is not None else 0
+
+
+class CatalogReindexer:
+    """
+    Фоновый поток переиндексации каталога. Запросы схлопываются: если за время
+    сборки пришло несколько новых версий, следующей соберётся только последняя.
+    Пока новый снимок строится, поиск продолжает работать по старому.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending: tuple | None = None
+        self._building = None
+        self._thread = threading.Thread(target=self._run, name='catalog-reindexer', daemon=True)
+        self._thread.start()
+
+    def request(self, version, proxy_host, proxy_port, proxy_user, proxy_password):
+        with self._lock:
+            if version == self._building or (self._pending and self._pending[0] == version):
+                return
+            self._pending = (version, proxy_host, proxy_port, proxy_user, proxy_password)
+        logger.info(f"Запрошена переиндексация каталога, версия {version}")
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            with self._lock:
+                self._wakeup.clear()
+                pending, self._pending = self._pending, None
+                if pending is None:
+                    continue
+                self._building = pending[0]
+            version, *proxy = pending
+            try:
+                initialize_vectorization(*proxy, version=version)
+                logger.info(f"Каталог переиндексирован, версия {version}")
+            except Exception as e:
+                logger.error(f"Ошибка переиндексации каталога: {e}")
+                # Не долбим API повторными сборками: следующая попытка не раньше чем через паузу
+                time.sleep(REINDEX_RETRY_DELAY)
+            finally:
+                with self._lock:
+                    self._building = None
 
 
 # ---------- Retrieval ----------
-def get_conversation_embedding(history: list[dict], user_message: str) -> np.ndarray:
+async def embed_message(text: str, proxy_url: str | None) -> np.ndarray:
     """
-    Собирает все user-сообщения из истории + текущее в одну строку
-    и возвращает единичный эмбеддинг.
+    Эмбеддинг одной реплики пользователя — его сохраняют рядом с репликой в истории.
     """
-    # Берём только тексты сообщений, где роль — 'user'
-    user_texts = [m['content'] for m in history if m['role'] == 'user']
-    # Добавляем текущее сообщение
-    full_text = " ".join(user_texts + [user_message])
-    # Получаем эмбеддинг одной строкой
-    emb = get_embedding_batch([full_text])[0]  # shape (dim,)
-    return emb
+    get_async_openai_client(proxy_url)
+    return (await get_embedding_batch_async([text]))[0]
 
 
-def retrieve_products_with_history(history: list[dict], user_message: str, k: int = TOP_K) -> pd.DataFrame:
+def combine_embeddings(vectors: list[np.ndarray], decay: float = CONVERSATION_DECAY) -> np.ndarray:
+    """
+    Взвешенная сумма эмбеддингов реплик (от старых к новым): последняя с весом 1,
+    каждая предыдущая в decay раз слабее. Результат нормирован.
+    """
+    matrix = np.vstack(vectors).astype(np.float32)
+    weights = decay ** np.arange(len(vectors) - 1, -1, -1, dtype=np.float32)
+    emb = weights @ matrix
+    norm = np.linalg.norm(emb)
+    return emb / norm if norm else emb
+
+
+async def get_conversation_embedding(user_message: str, history_embeddings: list[np.ndarray] = (),
+                                     message_embedding: np.ndarray | None = None) -> np.ndarray:
+    """
+    Эмбеддинг беседы из сохранённых векторов прошлых реплик пользователя и текущей.
+    Запрос к API — только за текущей репликой и только если её вектор не передан.
+    """
+    if message_embedding is None:
+        message_embedding = (await get_embedding_batch_async([user_message]))[0]
+    return combine_embeddings([*history_embeddings, message_embedding])
+
+
+def price_candidates(catalog: CatalogSnapshot, price_range: PriceRange | None) -> np.ndarray | None:
+    """
+    id товаров, подходящих под ценовой фильтр, или None — искать по всему каталогу.
+    Если в диапазон не попал ни один товар, фильтр снимается: модель увидит цены
+    ближайших по смыслу товаров и сама скажет, что в бюджет ничего нет.
+    """
+    if price_range is None:
+        return None
+    allowed = catalog.prices.select(price_range)
+    if not len(allowed):
+        logger.info(f"Нет товаров в диапазоне цен {price_range}, поиск без фильтра")
+        return None
+    return allowed
+
+
+async def retrieve_products_with_history(history: list[dict], user_message: str, k: int = TOP_K,
+                                         q_emb: np.ndarray | None = None,
+                                         price_range: PriceRange | None = None) -> list[str]:
     """
     Делает поиск по FAISS на основе эмбеддинга всей беседы + последнего вопроса.
+    Возвращает готовые фрагменты контекста найденных товаров по убыванию близости.
+    q_emb — уже посчитанный эмбеддинг беседы, если он есть; price_range — ограничение
+    цены: кандидаты отбираются только среди подходящих товаров, до взятия топ-k.
     """
-    q_emb = get_conversation_embedding(history, user_message)
-    # поиск возвращает (distances, indices)
-    distances, idxs = index.search(q_emb.reshape(1, -1), k)
-    # приводим к DataFrame
-    df = _products.iloc[idxs[0]].reset_index(drop=True)
-    df['distance'] = distances[0]
-    return df
+    catalog = _catalog
+    if q_emb is None:
+        q_emb = await get_conversation_embedding(user_message)
+    allowed = price_candidates(catalog, price_range)
+    # поиск возвращает (distances, indices); -1 — FAISS не нашёл столько соседей
+    with stage_seconds.time('faiss_search'):
+        if allowed is None:
+            _, idxs = catalog.index.search(q_emb.reshape(1, -1), max(k, HYBRID_CANDIDATES))
+        else:
+            selector = faiss.IDSelectorBatch(allowed)
+            _, idxs = catalog.index.search(q_emb.reshape(1, -1), max(k, HYBRID_CANDIDATES),
+                                           params=filtered_search_params(catalog.index, selector))
+    vector_ids = idxs[0][idxs[0] >= 0]
+    # Названия, артикулы и бренды лучше ловит BM25 по тексту текущего сообщения
+    with stage_seconds.time('lexical_search'):
+        lexical_ids, _ = catalog.lexical.search(user_message, HYBRID_CANDIDATES, allowed)
+    return catalog.products.snippets(reciprocal_rank_fusion([vector_ids, lexical_ids], k, RRF_K))
+
+
+def find_exact_products(user_message: str, k: int = TOP_K,
+                        price_range: PriceRange | None = None) -> list[str] | None:
+    """
+    Если все слова сообщения есть в названиях не более чем k товаров (из подходящих
+    по цене) — фрагменты этих товаров. Такой запрос обслуживается без эмбеддинга. Иначе None.
+    """
+    catalog = _catalog
+    with stage_seconds.time('exact_match'):
+        ids = catalog.lexical.exact_match(user_message, k, price_candidates(catalog, price_range))
+    return catalog.products.snippets(ids) if ids is not None else None
 
 
-def get_gpt_response(history, user_message, system_prompt, proxy_host, proxy_port, proxy_user, proxy_password):
+async def get_gpt_response(history, user_message, system_prompt, proxy_host, proxy_port, proxy_user, proxy_password,
+                           history_embeddings=(), message_embedding=None):
     """
     Аргументы:
       history (list of dict) — список предыдущих сообщений в формате:
             [{"role": "user"|"assistant", "content": "..."} ...]
       user_message (str) — новое сообщение от пользователя.
+      history_embeddings — сохранённые эмбеддинги прошлых реплик пользователя,
+      message_embedding — эмбеддинг user_message, если уже посчитан.
 
-    Возвращает кортеж (assistant_content, assistant_entry), где:
+    Возвращает кортеж (assistant_content, assistant_entry, message_embedding), где:
       assistant_content (str) — текст ответа GPT,
-      assistant_entry (dict) — {"role": "assistant", "content": assistant_content}
-    """
-    retrieved = retrieve_products_with_history(history, user_message)
-    context = "\n\n".join(
-        f"Товар {i + 1}:\n"
-        f"Название: {row['name']}\n"
-        f"Описание: {row['description']}\n"
-        f"Цена: {row['price']}\n"
-        for i, row in retrieved.iterrows()
-    )
-    # объединяем базовый системный промпт и контекст товаров
-    sales_prompt = f"{system_prompt}\n\nИнформация по релевантным товарам:\n{context}"
-
-    logger.info("щас будет запрос к гпт")
-    messages = [{"role": "system", "content": sales_prompt}]
-    messages.extend(history)
-    messages.append({"role": "user", "content": user_message})
-    logger.info(messages)
-    # Формируем URL прокси
-    proxy_url = f"http://{proxy_user}:{proxy_password}@{proxy_host}:{proxy_port}"
-
-    # Сохраняем старые значения переменных окружения (если были)
-    old_http = os.environ.get("HTTP_PROXY")
-    old_https = os.environ.get("HTTPS_PROXY")
+      assistant_entry (dict) — {"role": "assistant", "content": assistant_content},
+      message_embedding — эмбеддинг user_message, если он понадобился для поиска;
+      None, если сообщение обслужено точным совпадением по названию товара
+      (вызывающий досчитает вектор для истории в фоне, вне пути ответа).
+    """
+    client = get_async_openai_client(build_proxy_url(proxy_host, proxy_port, proxy_user, proxy_password))
+    # «до 3000 рублей» — фильтр по цене; в лексический поиск идёт текст без ограничения
+    search_text, price_range = split_price_constraint(user_message)
+    if price_range is not None:
+        logger.info(f"Ограничение цены из сообщения: {price_range}")
+    # Точное совпадение решается один раз и здесь: по тексту без цены и в пределах цены
+    exact_products = find_exact_products(search_text, price_range=price_range)
+    if exact_products is None:
+        if message_embedding is None:
+            message_embedding = (await get_embedding_batch_async([user_message]))[0]
+        q_emb = await get_conversation_embedding(user_message, history_embeddings, message_embedding)
+    else:
+        logger.info("Точное совпадение по названию товара, поиск без эмбеддинга")
+        q_emb = message_embedding = None
+
+    cache_scope = None
+    if ANSWER_CACHE_ENABLED and not history and q_emb is not None and price_range is None:
+        # Кэшируем только первую реплику: дальше ответ зависит от истории диалога.
+        # С ценой не кэшируем: «до 3000» и «до 30000» почти не различаются по эмбеддингу
+        cache_scope = (catalog_version(), text_key(system_prompt))
+        cached = answer_cache.get(cache_scope, q_emb)
+        if cached is not None:
+            logger.info(f"Ответ из кэша: hit rate {answer_cache.hit_rate:.0%}, "
+                        f"сэкономлено {answer_cache.saved_seconds:.1f} с")
+            return cached.content, dict(cached.entry), message_embedding
+
+    started = time.perf_counter()
+    if exact_products is not None:
+        products = exact_products
+    else:
+        products = await retrieve_products_with_history(history, search_text, q_emb=q_emb,
+                                                        price_range=price_range)
+    # системный промпт, товары и история укладываются в бюджет токенов
+    with stage_seconds.time('prompt'):
+        messages, stats = build_prompt(
+            token_counter, PROMPT_TOKEN_BUDGET, system_prompt, products, history, user_message,
+            product_share=PRODUCT_CONTEXT_SHARE
+        )
+    prompt_meter.record(stats)
 
-    # Устанавливаем прокси только для этого блока
-    os.environ["HTTP_PROXY"] = proxy_url
-    os.environ["HTTPS_PROXY"] = proxy_url
+    logger.info(
+        f"щас будет запрос к гпт: {stats.total}/{stats.budget} токенов "
+        f"(промпт {stats.system}, товары {stats.products} [{stats.products_used}/{len(products)}], "
+        f"история {stats.history} [{stats.history_used}/{len(history)}], сообщение {stats.user})"
+    )
+    logger.debug(messages)
 
     try:
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            max_tokens=400,
-            temperature=0.3
-        )
+        with stage_seconds.time('chat_completion'), openai_in_flight.track('chat'):
+            response = await client.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=messages,
+                max_tokens=CHAT_MAX_TOKENS,
+                temperature=0.3
+            )
+        if response.usage is not None:
+            openai_tokens.inc(response.usage.prompt_tokens, 'prompt')
+            openai_tokens.inc(response.usage.completion_tokens, 'completion')
 
         assistant_content = response.choices[0].message.content.strip()
         logger.info("запрос закончен")
@@ -270,23 +883,16 @@ def get_gpt_response(history, user_message, system_prompt, proxy_host, proxy_por
         else:
             assistant_entry = {"role": "assistant", "content": assistant_content}
 
-        return assistant_content, assistant_entry
+        if cache_scope is not None:
+            answer_cache.put(cache_scope, q_emb, assistant_content, assistant_entry, time.perf_counter() - started)
+        return assistant_content, assistant_entry, message_embedding
 
     except RateLimitError:
+        openai_errors.inc(1, 'rate_limit')
         warning = "Сервис временно недоступен (превышена квота). Попробуйте позже."
-        return warning, {"role": "assistant", "content": warning}
+        return warning, {"role": "assistant", "content": warning}, message_embedding
 
-    except APIError:
+    except APIError as e:
+        openai_errors.inc(1, type(e).__name__)
         warning = "Ошибка при обращении к GPT. Попробуйте позже."
-        return warning, {"role": "assistant", "content": warning}
-    finally:
-        # Восстанавливаем старые значения переменных окружения
-        if old_http is not None:
-            os.environ["HTTP_PROXY"] = old_http
-        else:
-            os.environ.pop("HTTP_PROXY", None)
-
-        if old_https is not None:
-            os.environ["HTTPS_PROXY"] = old_https
-        else:
-            os.environ.pop("HTTPS_PROXY", None)
+        return warning, {"role": "assistant", "content": warning}, message_embedding
@@ -0,0 +1,284 @@
+import json
+import logging
+import math
+import os
+import re
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from catalog_snapshot import atomic_write
+
+try:
+    import snowballstemmer
+except ImportError:  # без snowballstemmer — встроенный упрощённый стеммер ниже
+    snowballstemmer = None
+
+logger = logging.getLogger('lexical_index')
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Совпадение в названии весит как NAME_WEIGHT совпадений в описании
+NAME_WEIGHT = 3
+# Для каждого термина хранятся не больше MAX_POSTINGS лучших документов:
+# частые слова с низким idf иначе делали бы поиск линейным по каталогу
+MAX_POSTINGS = 2_000
+LEXICAL_FILES = ('lexical_manifest.json', 'lexical_vocab.json', 'lexical_offsets.npy', 'lexical_docs.npy',
+                 'lexical_weights.npy', 'lexical_name_offsets.npy', 'lexical_name_docs.npy')
+
+TOKEN_RE = re.compile(r'[0-9a-zа-я]+', re.IGNORECASE)
+STOP_WORDS = frozenset("""
+а без бы в вам вас ваш вы да для до его ее если есть же за и из или им их к как ко
+когда кто ли мне мой мы на над не нет но ну о об от по под при про с со так там то тот
+ты у уже хочу хотел хотела чем что чтобы это эта этот я можно нужно нужен нужна подскажите
+здравствуйте привет добрый день вечер спасибо пожалуйста сколько стоит есть ли какой какая какие
+""".split())
+
+_VOWELS = 'аеиоуыэюя'
+_PERFECTIVE_1 = ('вшись', 'вши', 'в')
+_PERFECTIVE_2 = ('ившись', 'ывшись', 'ивши', 'ывши', 'ив', 'ыв')
+_REFLEXIVE = ('ся', 'сь')
+_ADJECTIVE = ('ими', 'ыми', 'его', 'ого', 'ему', 'ому', 'ее', 'ие', 'ые', 'ое', 'ей', 'ий', 'ый', 'ой', 'ем',
+              'им', 'ым', 'ом', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею')
+_PARTICIPLE_1 = ('ем', 'нн', 'вш', 'ющ', 'щ')
+_PARTICIPLE_2 = ('ивш', 'ывш', 'ующ')
+_VERB_1 = ('ете', 'йте', 'ешь', 'нно', 'ла', 'на', 'ли', 'ем', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'й', 'л', 'н')
+_VERB_2 = ('ейте', 'уйте', 'ила', 'ыла', 'ена', 'ите', 'или', 'ыли', 'ило', 'ыло', 'ено', 'ует', 'уют', 'ены',
+           'ить', 'ыть', 'ишь', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен', 'ят', 'ит', 'ыт', 'ую', 'ю')
+_NOUN = ('иями', 'ями', 'ами', 'ией', 'иям', 'ием', 'иях', 'ев', 'ов', 'ие', 'ье', 'еи', 'ии', 'ей', 'ой',
+         'ий', 'ям', 'ем', 'ам', 'ом', 'ах', 'ях', 'ию', 'ью', 'ия', 'ья', 'а', 'е', 'и', 'й', 'о', 'у', 'ы',
+         'ь', 'ю', 'я')
+
+
+def _strip(word: str, rv: int, endings: tuple, after_a: bool = False) -> str | None:
+    for ending in endings:
+        cut = len(word) - len(ending)
+        if cut >= rv and word.endswith(ending):
+            if not after_a:
+                return word[:cut]
+            if cut - 1 >= rv and word[cut - 1] in 'ая':
+                return word[:cut]
+    return None
+
+
+def _light_stem(word: str) -> str:
+    """
+    Упрощённый стеммер Портера (Snowball) для русского: шаги 1, 2 и 4 без R2.
+    """
+    rv = next((i + 1 for i, ch in enumerate(word) if ch in _VOWELS), None)
+    if rv is None:
+        return word
+
+    stripped = _strip(word, rv, _PERFECTIVE_1, after_a=True) or _strip(word, rv, _PERFECTIVE_2)
+    if stripped is None:
+        word = _strip(word, rv, _REFLEXIVE) or word
+        stripped = _strip(word, rv, _ADJECTIVE)
+        if stripped is not None:
+            stripped = _strip(stripped, rv, _PARTICIPLE_1, after_a=True) or _strip(stripped, rv, _PARTICIPLE_2) \
+                or stripped
+        else:
+            stripped = _strip(word, rv, _VERB_1, after_a=True) or _strip(word, rv, _VERB_2) \
+                or _strip(word, rv, _NOUN)
+    if stripped is not None:
+        word = stripped
+
+    if word.endswith('и') and len(word) - 1 >= rv:
+        word = word[:-1]
+    word = _strip(word, rv, ('ейше', 'ейш')) or word
+    if word.endswith('нн') and len(word) - 1 >= rv:
+        word = word[:-1]
+    elif word.endswith('ь') and len(word) - 1 >= rv:
+        word = word[:-1]
+    return word
+
+
+_snowball = snowballstemmer.stemmer('russian') if snowballstemmer is not None else None
+# Пишется в манифест индекса: термины, полученные другим стеммером, с запросами не совпадут
+STEMMER = 'snowball' if _snowball is not None else 'light'
+
+
+@lru_cache(maxsize=200_000)
+def stem(token: str) -> str:
+    # Артикулы, модели и латиницу не трогаем: они должны совпадать буквально
+    if not re.fullmatch('[а-я]+', token) or len(token) < 4:
+        return token
+    return _snowball.stemWord(token) if _snowball is not None else _light_stem(token)
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Термины текста: нижний регистр, ё -> е, без стоп-слов, русские слова — по основе.
+    """
+    if not isinstance(text, str):
+        return []
+    text = text.lower().replace('ё', 'е')
+    return [stem(token) for token in TOKEN_RE.findall(text) if token not in STOP_WORDS]
+
+
+def _pack(lists: list[np.ndarray], dtype) -> tuple[np.ndarray, np.ndarray]:
+    # Списки подряд в одном массиве + смещения их начал (CSR)
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    np.cumsum([len(values) for values in lists], out=offsets[1:])
+    flat = np.concatenate(lists).astype(dtype) if lists else np.empty(0, dtype=dtype)
+    return offsets, flat
+
+
+class LexicalIndex:
+    """
+    Инвертированный индекс BM25 по name и description каталога.
+
+    Для каждого термина хранится список документов с уже посчитанным весом BM25
+    (по убыванию веса, не больше MAX_POSTINGS), так что запрос — это сложение
+    нескольких коротких массивов. Отдельно хранятся полные списки документов
+    по терминам названия для проверки точного совпадения.
+    """
+
+    def __init__(self, vocab: dict[str, int], offsets: np.ndarray, docs: np.ndarray, weights: np.ndarray,
+                 name_offsets: np.ndarray, name_docs: np.ndarray):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.docs = docs
+        self.weights = weights
+        self.name_offsets = name_offsets
+        self.name_docs = name_docs
+
+    @classmethod
+    def build(cls, products: pd.DataFrame) -> "LexicalIndex":
+        ids = products.index.to_numpy(dtype=np.int64)
+        vocab: dict[str, int] = {}
+        term_docs: list[list[int]] = []
+        term_tf: list[list[int]] = []
+        name_docs: list[list[int]] = []
+        lengths = np.empty(len(products), dtype=np.float32)
+
+        for pos, (name, description) in enumerate(zip(products['name'], products['description'])):
+            name_terms = tokenize(name)
+            counts = Counter(tokenize(description))
+            for term in name_terms:
+                counts[term] += NAME_WEIGHT
+            lengths[pos] = sum(counts.values())
+            for term, tf in counts.items():
+                term_id = vocab.setdefault(term, len(vocab))
+                if term_id == len(term_docs):
+                    term_docs.append([])
+                    term_tf.append([])
+                    name_docs.append([])
+                term_docs[term_id].append(pos)
+                term_tf[term_id].append(tf)
+            for term in set(name_terms):
+                name_docs[vocab[term]].append(pos)
+
+        n = len(products)
+        avg_length = float(lengths.mean()) if n else 0.0
+        posting_docs, posting_weights = [], []
+        for term_id in range(len(vocab)):
+            positions = np.array(term_docs[term_id], dtype=np.int64)
+            docs = ids[positions]
+            tf = np.array(term_tf[term_id], dtype=np.float32)
+            doc_length = lengths[positions]
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            weights = idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * doc_length / avg_length))
+            order = np.argsort(-weights, kind='stable')[:MAX_POSTINGS]
+            posting_docs.append(docs[order])
+            posting_weights.append(weights[order])
+
+        offsets, docs = _pack(posting_docs, np.int64)
+        _, weights = _pack(posting_weights, np.float32)
+        name_offsets, name_docs_flat = _pack([np.sort(ids[np.array(d, dtype=np.int64)]) for d in name_docs], np.int64)
+        return cls(vocab, offsets, docs, weights, name_offsets, name_docs_flat)
+
+    def save(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        terms = sorted(self.vocab, key=self.vocab.get)
+        atomic_write(os.path.join(directory, 'lexical_vocab.json'),
+                     lambda f: f.write(json.dumps(terms, ensure_ascii=False).encode('utf-8')))
+        for name, array in (('lexical_offsets', self.offsets), ('lexical_docs', self.docs),
+                            ('lexical_weights', self.weights), ('lexical_name_offsets', self.name_offsets),
+                            ('lexical_name_docs', self.name_docs)):
+            atomic_write(os.path.join(directory, f'{name}.npy'), lambda f: np.save(f, array))
+        # Манифест последним: прерванная запись не выдаст себя за готовый индекс
+        atomic_write(os.path.join(directory, 'lexical_manifest.json'),
+                     lambda f: f.write(json.dumps({'stemmer': STEMMER}).encode('utf-8')))
+
+    @classmethod
+    def load(cls, directory: str) -> "LexicalIndex | None":
+        if not all(os.path.exists(os.path.join(directory, name)) for name in LEXICAL_FILES):
+            return None
+        with open(os.path.join(directory, 'lexical_manifest.json'), encoding='utf-8') as f:
+            stemmer = json.load(f).get('stemmer')
+        if stemmer != STEMMER:
+            logger.info(f"Лексический индекс собран стеммером {stemmer}, а сейчас {STEMMER}: нужна пересборка")
+            return None
+        with open(os.path.join(directory, 'lexical_vocab.json'), encoding='utf-8') as f:
+            vocab = {term: i for i, term in enumerate(json.load(f))}
+
+        def load(name):
+            return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+
+        return cls(vocab, load('lexical_offsets'), load('lexical_docs'), load('lexical_weights'),
+                   load('lexical_name_offsets'), load('lexical_name_docs'))
+
+    def _term_ids(self, query: str) -> list[int]:
+        return list(dict.fromkeys(self.vocab[t] for t in tokenize(query) if t in self.vocab))
+
+    def search(self, query: str, k: int, allowed: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Топ-k id товаров по BM25 и их оценки, по убыванию оценки.
+        allowed — отсортированные id, среди которых ищем (ценовой фильтр); None — весь каталог.
+        """
+        term_ids = self._term_ids(query)
+        if not term_ids or allowed is not None and not len(allowed):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if len(term_ids) == 1 and allowed is None:
+            start, end = self.offsets[term_ids[0]], self.offsets[term_ids[0] + 1]
+            # Списки уже отсортированы по убыванию веса
+            return np.asarray(self.docs[start:min(end, start + k)]), np.asarray(self.weights[start:min(end, start + k)])
+        docs = np.concatenate([self.docs[self.offsets[t]:self.offsets[t + 1]] for t in term_ids])
+        weights = np.concatenate([self.weights[self.offsets[t]:self.offsets[t + 1]] for t in term_ids])
+        if allowed is not None:
+            # Фильтр до выбора топ-k: иначе подходящие по цене товары вытеснялись бы остальными
+            keep = np.isin(docs, allowed)
+            docs, weights = docs[keep], weights[keep]
+        candidates, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights).astype(np.float32)
+        top = np.argsort(-scores, kind='stable')[:k] if len(scores) <= 4 * k else \
+            np.argpartition(-scores, k)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return candidates[top], scores[top]
+
+    def exact_match(self, query: str, k: int, allowed: np.ndarray | None = None) -> np.ndarray | None:
+        """
+        Товары, в названии которых есть все термины запроса, если их от 1 до k.
+        Иначе None: запрос не указывает на конкретные товары.
+        """
+        terms = tokenize(query)
+        if not terms or any(t not in self.vocab for t in terms):
+            return None
+        matched = None
+        for term_id in dict.fromkeys(self.vocab[t] for t in terms):
+            docs = self.name_docs[self.name_offsets[term_id]:self.name_offsets[term_id + 1]]
+            matched = np.asarray(docs) if matched is None else np.intersect1d(matched, docs, assume_unique=True)
+            if len(matched) == 0:
+                return None
+        if allowed is not None:
+            matched = np.intersect1d(matched, allowed, assume_unique=True)
+        if len(matched) == 0 or len(matched) > k:
+            return None
+        # Порядок — по BM25 среди найденных, остальные (за пределами MAX_POSTINGS) в конец
+        matched = set(matched.tolist())
+        ranked, _ = self.search(query, 4 * k, allowed)
+        order = [d for d in ranked.tolist() if d in matched]
+        return np.array(order + sorted(matched.difference(order)), dtype=np.int64)
+
+
+def reciprocal_rank_fusion(rankings: list[np.ndarray], k: int, rrf_k: int = 60) -> np.ndarray:
+    """
+    Объединяет несколько ранжированных списков id: score = sum(1 / (rrf_k + rank)).
+    """
+    scores: dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking.tolist()):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+    return np.array(sorted(scores, key=scores.get, reverse=True)[:k], dtype=np.int64)
@@ -0,0 +1,199 @@
+import bisect
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+# Границы корзин гистограмм времени, с: от поиска по индексу до ответа модели
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def samples(self) -> Iterator[tuple[str, str, float]]:
+        ...
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name}{labels} {_format_value(value)}" for name, labels, value in self.samples()]
+        return '\n'.join(lines)
+
+
+class _Value(_Metric):
+    """
+    Значение по набору меток. Если задан fn, значение снимается им в момент
+    выдачи /metrics: так отдаются счётчики, которые уже ведут другие объекты
+    (кэш ответов, движок, конвейер эмбеддингов).
+    """
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), fn: Callable[[], float] | None = None):
+        super().__init__(name, help, labels)
+        self.fn = fn
+        self._values: dict[tuple, float] = {}
+
+    def _add(self, amount: float, label_values: tuple):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def samples(self):
+        if self.fn is not None:
+            yield self.name, '', self.fn()
+            return
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            yield self.name, _format_labels(self.labels, label_values), value
+
+
+class Counter(_Value):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1.0, *label_values):
+        self._add(amount, label_values)
+
+
+class Gauge(_Value):
+    kind = 'gauge'
+
+    def set(self, value: float, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+    def inc(self, amount: float = 1.0, *label_values):
+        self._add(amount, label_values)
+
+    def dec(self, amount: float = 1.0, *label_values):
+        self._add(-amount, label_values)
+
+    @contextmanager
+    def track(self, *label_values):
+        """Счётчик «в работе»: +1 на время блока."""
+        self.inc(1.0, *label_values)
+        try:
+            yield
+        finally:
+            self.dec(1.0, *label_values)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счётчики по корзинам (последняя — +Inf), сумма]
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        """Время блока, в том числе с await внутри."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def samples(self):
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for label_values, counts, total in series:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket", _format_labels(self.labels, label_values, le), cumulative
+            yield f"{self.name}_sum", _format_labels(self.labels, label_values), total
+            yield f"{self.name}_count", _format_labels(self.labels, label_values), cumulative
+
+
+class Registry:
+    """
+    Набор метрик процесса и их выдача в текстовом формате Prometheus.
+    Запись в метрику — блокировка и пара арифметических операций, поэтому
+    её можно звать на горячем пути из любых потоков и из цикла движка.
+    """
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: tuple[str, ...] = (), fn=None) -> Counter:
+        return self.register(Counter(name, help, labels, fn))
+
+    def gauge(self, name: str, help: str, labels: tuple[str, ...] = (), fn=None) -> Gauge:
+        return self.register(Gauge(name, help, labels, fn))
+
+    def histogram(self, name: str, help: str, labels: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+registry = Registry()
+
+# Общие метрики горячего пути; модули пишут в них напрямую
+stage_seconds = registry.histogram(
+    'bot_stage_seconds',
+    'Время этапов обработки: webhook, settings, sqlite, embedding, exact_match, faiss_search, '
+    'lexical_search, prompt, chat_completion, bitrix_call, reply, reminder_tick',
+    labels=('stage',),
+)
+openai_in_flight = registry.gauge('bot_openai_in_flight', 'Запросы к OpenAI, ожидающие ответа', labels=('endpoint',))
+openai_tokens = registry.counter('bot_openai_tokens_total', 'Токены по usage ответов OpenAI', labels=('type',))
+openai_errors = registry.counter('bot_openai_errors_total', 'Ошибки запросов к модели', labels=('error',))
+webhook_events = registry.counter('bot_webhook_events_total', 'События от Bitrix24', labels=('event',))
+reminders = registry.counter('bot_reminders_total', 'Напоминания по исходу отправки', labels=('result',))
+reminder_lag_seconds = registry.histogram(
+    'bot_reminder_lag_seconds', 'Опоздание прохода напоминаний относительно ближайшего срока',
+    buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0),
+)
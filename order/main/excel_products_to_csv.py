@@ -0,0 +1,39 @@
+import re
+
+import pandas as pd
+
+
+def parse_price(value) -> float:
+    """
+    Цена из ячейки прайса: "62 000 руб." -> 62000, "62000-00" (рубли-копейки) -> 62000,
+    "1-500" (разделитель тысяч) -> 1500, диапазон "1000-2000" -> 1000 (цена «от»).
+    Текст без числа ("по запросу") -> NaN.
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return float('nan')
+    text = re.sub(r'[\s ]', '', value).replace(',', '.')
+    text = re.sub(r'[–—]', '-', text)
+    text = re.sub(r'(?<=\d)-(?=\d{2}(?!\d))', '.', text)
+    text = re.sub(r'(?<![\d.])\d{1,3}(?:-\d{3})+(?![\d-])', lambda m: m.group().replace('-', ''), text)
+    match = re.search(r'\d+(?:\.\d+)?', text)
+    return float(match.group()) if match else float('nan')
+
+
+def toCSV(file, output_path):
+    df = pd.read_excel(file)
+
+    df = df.rename(columns={
+        df.columns[0]: 'name',
+        df.columns[1]: 'description',
+        df.columns[2]: 'price'
+    })
+
+    df = df[df['name'] != 'Наименование']
+    # Пустая ячейка цены — строка-заголовок раздела, а товар с ценой текстом
+    # ("по запросу") остаётся в каталоге с ценой NaN
+    df = df.dropna(subset=['price'])
+    df['price'] = df['price'].map(parse_price)
+
+    df.to_csv(output_path, index=False)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_bot_last_change'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bot',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
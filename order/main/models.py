@@ -14,4 +14,20 @@ class Bot(models.Model):
     proxy_port = models.TextField()
     proxy_user = models.TextField()
     proxy_password = models.TextField()
-    last_change = models.DateTimeField(blank=True, null=True)
\ No newline at end of file
+    last_change = models.DateTimeField(blank=True, null=True)
+
+    # Счётчик изменений строки: бот сравнивает его со своим кэшем настроек
+    version = models.PositiveIntegerField(default=0)
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            self.version = (self.version or 0) + 1
+        else:
+            # Увеличиваем в самом UPDATE: два сохранения экземпляров, загруженных
+            # раньше, иначе записали бы одну и ту же версию
+            self.version = models.F('version') + 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+        super().save(*args, **kwargs)
+        if not isinstance(self.version, int):
+            self.refresh_from_db(fields=['version'])
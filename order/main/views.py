@@ -2,15 +2,12 @@ import sqlite3
 
 from django.shortcuts import render
 from django.shortcuts import get_object_or_404, redirect
+from django.conf import settings
 from .models import Bot
 from .forms import BotForm
+from . import excel_products_to_csv
 import os
 
-
-import sys
-sys.path.append("..")
-from products import excel_products_to_csv
-
 # Create your views here.
 def index(request):
     if not request.user.is_authenticated:
@@ -23,7 +20,7 @@ def index(request):
         print("get request")
         if 'reset' in request.POST:
             print("reset in request")
-            conn: sqlite3.Connection = sqlite3.connect("database.sqlt", check_same_thread=False)
+            conn: sqlite3.Connection = sqlite3.connect(os.getenv("HISTORY_DB_PATH", "database.sqlt"), check_same_thread=False)
             cursor: sqlite3.Cursor = conn.cursor()
 
             cursor.execute("DELETE FROM blacklist;")
@@ -68,7 +65,8 @@ def index(request):
                 bot.last_change = timezone.now()
                 print(bot.promt)
 
-                excel_products_to_csv.toCSV(file_path)
+                # MEDIA_ROOT — общая с ботом папка products
+                excel_products_to_csv.toCSV(file_path, os.path.join(settings.MEDIA_ROOT, "products.csv"))
             
             bot.save()
             return render(request, "index.html", {'form': form, "change": bot.last_change})
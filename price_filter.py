@@ -0,0 +1,182 @@
+import logging
+import math
+import os
+import re
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from catalog_snapshot import atomic_write
+
+logger = logging.getLogger('price_filter')
+
+PRICE_FILES = ('price_sorted.npy', 'price_ids.npy')
+# «около 30000» — допуск в обе стороны
+PRICE_APPROX_SHARE = 0.2
+# Число без валюты и множителя считается ценой, только если оно не меньше этого
+MIN_IMPLICIT_PRICE = 100
+
+_MULTIPLIERS = {'тыс': 1_000, 'т.р': 1_000, 'к': 1_000, 'k': 1_000, 'млн': 1_000_000, 'миллион': 1_000_000}
+_NUMBER = r'(\d{1,3}(?:[  ]\d{3})+(?!\d)|\d+(?:[.,]\d+)?)'
+_MULTIPLIER = r'(?:\s*(тыс(?:яч[аи]?)?\.?|т\.\s?р\.?|к|k|млн\.?|миллион(?:а|ов)?)(?![a-zа-я]))?'
+_CURRENCY = r'(?:[\s.]*(руб(?:л(?:ь|я|ей))?\.?|р\.|р(?![a-zа-я])|₽|rub))?'
+# Единицы измерения: «до 220 в», «от 2 до 5 кг», «до 365 дней», «до 1500 ватт» — не цена.
+# Основы слов сравниваются как префиксы, чтобы ловить любые падежи («дней», «штук», «граммов»);
+# однобуквенные единицы — только отдельным словом и не перед обычным словом («до 150000 в наличии»)
+_UNIT = re.compile(r'\s*(?:(?:[гмлвvwj]\.?(?![a-zа-я])(?!\s*[a-zа-я]{2,}))|%|°|'
+                   r'дн|день|недел|месяц|мес(?![a-zа-я])|год|лет|час|мин|сек|'
+                   r'шт|штук|грамм|гр|кг|килограмм|мг|мл|литр|мм|см|метр|мкм|нм|'
+                   r'вт|ватт|квт|киловатт|вольт|ампер|гц|кгц|мгц|khz|hz|дж|атм|бар|градус|'
+                   r'раз|процедур|сеанс|импульс|выстрел|насад|режим|программ)')
+_AMOUNT = _NUMBER + _MULTIPLIER + _CURRENCY
+_AMOUNT_GROUPS = 3
+_DASHES = ('-', '–', '—')
+
+# Группы: 1 — «от»/«с», 2-4 — нижняя граница, 5 — разделитель, 6-8 — верхняя
+_RANGE_RE = re.compile(rf'(?:(?<![a-zа-я])(от|с)\s*)?{_AMOUNT}\s*(-|–|—|до)\s*{_AMOUNT}')
+_APPROX_RE = re.compile(rf'(?<![a-zа-я])(?:около|примерно|порядка|в\s+районе|приблизительно)\s*{_AMOUNT}')
+_UPPER_RE = re.compile(rf'(?<![a-zа-я])(?:до|не\s+дороже|дешевле|не\s+более|не\s+больше|менее|меньше|ниже|'
+                       rf'не\s+выше|в\s+пределах|максимум|бюджет(?:ом)?(?:\s+до)?)\s*{_AMOUNT}')
+_LOWER_RE = re.compile(rf'(?<![a-zа-я])(?:от|дороже|не\s+дешевле|не\s+менее|не\s+меньше|более|больше|свыше|'
+                       rf'выше|минимум)\s*{_AMOUNT}')
+
+
+@dataclass(frozen=True)
+class PriceRange:
+    """
+    Ограничение цены из сообщения пользователя; None — граница не задана.
+    """
+    low: float | None = None
+    high: float | None = None
+
+    def __str__(self) -> str:
+        low = f"{self.low:g}" if self.low is not None else ''
+        high = f"{self.high:g}" if self.high is not None else ''
+        return f"[{low}..{high}]"
+
+
+def _group_end(match: re.Match, first: int, last: int) -> int:
+    # Конец последней сработавшей группы: у невстретившихся групп end() равен -1
+    return max(match.end(g) for g in range(first, last + 1))
+
+
+def _amount(groups: tuple, end: int, text: str, multiplier: str | None = None) -> float | None:
+    number, own_multiplier, currency = groups
+    multiplier = own_multiplier or multiplier
+    if not currency and not multiplier and _UNIT.match(text, end):
+        return None
+    value = float(re.sub(r'[  ]', '', number).replace(',', '.'))
+    if multiplier:
+        value *= next(m for prefix, m in _MULTIPLIERS.items() if multiplier.startswith(prefix))
+    elif not currency and value < MIN_IMPLICIT_PRICE:
+        return None
+    return value
+
+
+def split_price_constraint(text: str) -> tuple[str, PriceRange | None]:
+    """
+    Находит в сообщении ограничения цены («до 3000 рублей», «от 5 до 10 тыс»,
+    «дешевле 50к», «около 30000») и возвращает текст без них и диапазон.
+    Если ограничений нет или они противоречат друг другу — (text, None).
+
+    Граница без валюты и множителя — только после явного слова («до», «от»,
+    «дешевле»...). Число перед «до» без «от» нижней границей не считается:
+    в «лазер 808 до 500000» и «3 в 1 до 100 тыс» это модель, а не цена.
+    """
+    if not isinstance(text, str):
+        return text, None
+    lowered = text.lower().replace('ё', 'е')
+    low, high, spans = None, None, []
+    # Диапазоны с единицами («от 200 до 300 граммов»): их части не разбираются и поодиночке
+    blocked = []
+
+    def taken(match):
+        return any(match.start() < end and start < match.end() for start, end in spans + blocked)
+
+    for match in _RANGE_RE.finditer(lowered):
+        cue, separator = match.group(1), match.group(5)
+        first, second = match.groups()[1:1 + _AMOUNT_GROUPS], match.groups()[2 + _AMOUNT_GROUPS:]
+        # Без «от» диапазон — только «5-10 тыс» / «3000-5000 руб»: через тире и с валютой или множителем
+        if cue is None and (separator not in _DASHES or not any(first[1:] + second[1:])):
+            continue
+        # «5-10 тыс»: множитель второй границы действует и на первую
+        upper = _amount(second, match.end(), lowered)
+        lower = _amount(first, _group_end(match, 2, 4), lowered, multiplier=None if first[1] else second[1])
+        if lower is None or upper is None:
+            if cue is not None:
+                blocked.append(match.span())
+            continue
+        low, high = max(low or 0, lower), min(high if high is not None else math.inf, upper)
+        spans.append(match.span())
+    for regex in (_APPROX_RE, _UPPER_RE, _LOWER_RE):
+        for match in regex.finditer(lowered):
+            if taken(match):
+                continue
+            value = _amount(match.groups(), match.end(), lowered)
+            if value is None:
+                continue
+            if regex is _APPROX_RE:
+                low = max(low or 0, value * (1 - PRICE_APPROX_SHARE))
+                high = min(high if high is not None else math.inf, value * (1 + PRICE_APPROX_SHARE))
+            elif regex is _UPPER_RE:
+                high = min(high if high is not None else math.inf, value)
+            else:
+                low = max(low or 0, value)
+            spans.append(match.span())
+
+    if not spans:
+        return text, None
+    if low is not None and high is not None and low > high:
+        logger.info(f"Противоречивые ограничения цены в сообщении, фильтр не применяется: {low:g} > {high:g}")
+        return text, None
+    rest = text
+    for start, end in sorted(spans, reverse=True):
+        rest = rest[:start] + ' ' + rest[end:]
+    return " ".join(rest.split()), PriceRange(low, high)
+
+
+class PriceIndex:
+    """
+    Цены каталога по возрастанию и id соответствующих товаров. Товары
+    с неизвестной или нулевой ценой в индекс не попадают: под ценовой
+    фильтр они не подходят. Выборка диапазона — два бинарных поиска.
+    """
+
+    def __init__(self, prices: np.ndarray, ids: np.ndarray):
+        self.prices = prices
+        self.ids = ids
+
+    @classmethod
+    def build(cls, products: pd.DataFrame) -> "PriceIndex":
+        prices = pd.to_numeric(products['price'], errors='coerce').to_numpy(dtype=np.float64)
+        known = np.isfinite(prices) & (prices > 0)
+        order = np.argsort(prices[known], kind='stable')
+        return cls(prices[known][order], products.index.to_numpy(dtype=np.int64)[known][order])
+
+    def save(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        for name, array in (('price_sorted', self.prices), ('price_ids', self.ids)):
+            atomic_write(os.path.join(directory, f'{name}.npy'), lambda f: np.save(f, array))
+
+    @classmethod
+    def load(cls, directory: str) -> "PriceIndex | None":
+        if not all(os.path.exists(os.path.join(directory, name)) for name in PRICE_FILES):
+            return None
+
+        def load(name):
+            return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+
+        return cls(load('price_sorted'), load('price_ids'))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def select(self, price_range: PriceRange) -> np.ndarray:
+        """
+        id товаров с ценой в диапазоне (границы включительно), по возрастанию id.
+        """
+        start = 0 if price_range.low is None else int(np.searchsorted(self.prices, price_range.low, 'left'))
+        end = len(self.prices) if price_range.high is None else \
+            int(np.searchsorted(self.prices, price_range.high, 'right'))
+        return np.sort(self.ids[start:end])
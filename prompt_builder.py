@@ -0,0 +1,207 @@
+import logging
+import math
+import threading
+from dataclasses import dataclass
+
+try:
+    import tiktoken
+except ImportError:  # без tiktoken токены считаются по длине текста с запасом
+    tiktoken = None
+
+logger = logging.getLogger('prompt_builder')
+
+# Служебные токены на каждое сообщение чата и на затравку ответа (как в OpenAI cookbook)
+MESSAGE_OVERHEAD = 3
+REPLY_PRIMING = 3
+# Приближённая оценка для кириллицы: не меньше токена на 3 символа
+CHARS_PER_TOKEN = 3
+# Товар, которому осталось меньше этого числа токенов, не добавляется вовсе
+MIN_PRODUCT_TOKENS = 40
+TRUNCATION_MARK = '…'
+
+
+class TokenCounter:
+    """
+    Подсчёт токенов той же кодировкой, что у модели (tiktoken),
+    либо консервативная оценка, если tiktoken не установлен.
+
+    Кодировка загружается при первом подсчёте, а не при создании: без
+    кэша (TIKTOKEN_CACHE_DIR) tiktoken качает её из сети в обход прокси,
+    и сбой не должен ронять импорт — тогда счёт идёт по оценке.
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        self._encoding = None
+        self._loaded = tiktoken is None
+        self._load_lock = threading.Lock()
+        if tiktoken is None:
+            logger.warning("tiktoken не установлен, число токенов считается приближённо")
+
+    def _get_encoding(self):
+        if self._loaded:
+            return self._encoding
+        with self._load_lock:
+            if not self._loaded:
+                try:
+                    try:
+                        self._encoding = tiktoken.encoding_for_model(self.model)
+                    except KeyError:
+                        self._encoding = tiktoken.get_encoding('o200k_base')
+                except Exception as e:
+                    logger.warning(f"Кодировка tiktoken для {self.model} недоступна, "
+                                   f"число токенов считается приближённо: {e}")
+                self._loaded = True
+        return self._encoding
+
+    @property
+    def exact(self) -> bool:
+        return self._get_encoding() is not None
+
+    def count(self, text: str) -> int:
+        encoding = self._get_encoding()
+        if encoding is not None:
+            return len(encoding.encode(text, disallowed_special=()))
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+    def count_many(self, texts: list[str]) -> list[int]:
+        # tiktoken кодирует пачку текстов в нескольких потоках
+        encoding = self._get_encoding()
+        if encoding is not None:
+            return [len(tokens) for tokens in encoding.encode_batch(texts, disallowed_special=())]
+        return [math.ceil(len(text) / CHARS_PER_TOKEN) for text in texts]
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """
+        Обрезает текст до max_tokens токенов (вместе с многоточием в конце).
+        """
+        if max_tokens <= 0:
+            return ''
+        if self.count(text) <= max_tokens:
+            return text
+        encoding = self._get_encoding()
+        if encoding is not None:
+            tokens = encoding.encode(text, disallowed_special=())
+            return encoding.decode(tokens[:max_tokens - 1]).rstrip() + TRUNCATION_MARK
+        return text[:(max_tokens - 1) * CHARS_PER_TOKEN].rstrip() + TRUNCATION_MARK
+
+
+@dataclass(frozen=True)
+class PromptStats:
+    system: int
+    products: int
+    history: int
+    user: int
+    total: int
+    budget: int
+    products_used: int
+    products_dropped: int
+    history_used: int
+    history_dropped: int
+    truncated: bool
+
+
+def build_prompt(
+        counter: TokenCounter,
+        budget: int,
+        system_prompt: str,
+        products: list[str],
+        history: list[dict],
+        user_message: str,
+        product_share: float = 0.6,
+) -> tuple[list[dict], PromptStats]:
+    """
+    Собирает сообщения для chat.completions в пределах budget токенов.
+
+    Приоритет частей: текущее сообщение пользователя, системный промпт,
+    товары (в порядке релевантности), история (от свежих к старым).
+    Товарам достаётся не больше product_share того, что осталось после
+    промпта и сообщения, остальное — истории. При нехватке первыми
+    выпадают старые реплики истории, затем наименее релевантные товары;
+    системный промпт и сообщение обрезаются только в крайнем случае.
+    """
+    truncated = False
+    fixed_overhead = 2 * MESSAGE_OVERHEAD + REPLY_PRIMING
+
+    user_tokens = counter.count(user_message)
+    system_tokens = counter.count(system_prompt)
+    if fixed_overhead + system_tokens + user_tokens > budget:
+        truncated = True
+        user_message = counter.truncate(user_message, min(user_tokens, (budget - fixed_overhead) // 2))
+        user_tokens = counter.count(user_message)
+        system_prompt = counter.truncate(system_prompt, budget - fixed_overhead - user_tokens)
+        system_tokens = counter.count(system_prompt)
+
+    remaining = budget - fixed_overhead - system_tokens - user_tokens
+
+    context_header = "\n\nИнформация по релевантным товарам:\n"
+    product_cap = int(remaining * product_share) - counter.count(context_header)
+    blocks, product_tokens = [], 0
+    for product in products:
+        block = f"Товар {len(blocks) + 1}:\n{product}"
+        # Блоки склеиваются через пустую строку
+        tokens = counter.count(block) + 1
+        if product_tokens + tokens > product_cap:
+            room = product_cap - product_tokens - 1
+            if room < MIN_PRODUCT_TOKENS:
+                break
+            block = counter.truncate(block, room)
+            tokens = counter.count(block) + 1
+            truncated = True
+        blocks.append(block)
+        product_tokens += tokens
+    if blocks:
+        system_prompt = f"{system_prompt}{context_header}" + "\n\n".join(blocks)
+        product_tokens = counter.count(system_prompt) - system_tokens
+        remaining -= product_tokens
+
+    kept, history_tokens = [], 0
+    for message in reversed(history):
+        tokens = counter.count(message['content']) + MESSAGE_OVERHEAD
+        if history_tokens + tokens > remaining:
+            break
+        kept.append(message)
+        history_tokens += tokens
+    kept.reverse()
+
+    messages = [{"role": "system", "content": system_prompt}, *kept, {"role": "user", "content": user_message}]
+    stats = PromptStats(
+        system=system_tokens,
+        products=product_tokens,
+        history=history_tokens,
+        user=user_tokens,
+        total=fixed_overhead + system_tokens + product_tokens + history_tokens + user_tokens,
+        budget=budget,
+        products_used=len(blocks),
+        products_dropped=len(products) - len(blocks),
+        history_used=len(kept),
+        history_dropped=len(history) - len(kept),
+        truncated=truncated or len(blocks) < len(products) or len(kept) < len(history),
+    )
+    return messages, stats
+
+
+class PromptMeter:
+    """
+    Накопительная статистика размера промптов для мониторинга.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.total_tokens = 0
+        self.max_tokens = 0
+        self.truncated = 0
+        self.last: PromptStats | None = None
+
+    def record(self, stats: PromptStats):
+        with self._lock:
+            self.requests += 1
+            self.total_tokens += stats.total
+            self.max_tokens = max(self.max_tokens, stats.total)
+            self.truncated += stats.truncated
+            self.last = stats
+
+    @property
+    def mean_tokens(self) -> float:
+        return self.total_tokens / self.requests if self.requests else 0.0
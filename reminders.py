@@ -0,0 +1,64 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Callable
+
+import httpx
+
+from bitrix_client import BATCH_MAX_COMMANDS, RETRY_ERRORS, BitrixClient, BitrixError
+from utils import HistoryManager
+
+logger = logging.getLogger('reminders')
+
+
+@dataclass
+class DispatchResult:
+    sent: int = 0
+    # Упёрлись в лимит или сбой сети: диалог остаётся в очереди до следующего прохода
+    deferred: int = 0
+    # Bitrix24 отказал по существу (нет доступа к чату): диалог уходит в чёрный список
+    failed: int = 0
+
+
+async def dispatch_reminders(
+        bitrix: BitrixClient,
+        history_manager: HistoryManager,
+        due: list[tuple[str, int, str]],
+        texts: dict[int, str],
+        command: Callable[[str, str], tuple[str, dict]],
+) -> DispatchResult:
+    """
+    Рассылает напоминания due = [(dialog_id, stage, last_user_at), ...] пачками через Bitrix batch.
+    texts — текст напоминания по текущему этапу, command(dialog_id, text) — команда отправки.
+    Этапы доставленных напоминаний фиксируются одной транзакцией на пачку.
+    """
+    result = DispatchResult()
+    due = [reminder for reminder in due if reminder[1] in texts]
+    for start in range(0, len(due), BATCH_MAX_COMMANDS):
+        chunk = due[start:start + BATCH_MAX_COMMANDS]
+        commands = {f"r{i}": command(dialog_id, texts[stage]) for i, (dialog_id, stage, _) in enumerate(chunk)}
+        try:
+            _, errors = await bitrix.batch(commands)
+        except (BitrixError, httpx.HTTPError) as e:
+            # Пачка целиком не дошла даже после повторов клиента — попробуем на следующем проходе
+            logger.warning(f"Напоминания отложены: {e!r}")
+            result.deferred += len(due) - start
+            break
+
+        delivered, rejected = [], []
+        for i, (dialog_id, stage, last_user_at) in enumerate(chunk):
+            error = errors.get(f"r{i}")
+            if error is None:
+                delivered.append((dialog_id, stage, stage + 1, last_user_at))
+            elif error.get('error') in RETRY_ERRORS:
+                result.deferred += 1
+            else:
+                logger.error(f"Error in reminder for {dialog_id}: {error}")
+                rejected.append(dialog_id)
+
+        await asyncio.to_thread(history_manager.advance_stages, delivered)
+        for dialog_id in rejected:
+            await asyncio.to_thread(history_manager.put_in_blacklist, dialog_id, "no_access")
+        result.sent += len(delivered)
+        result.failed += len(rejected)
+    return result
@@ -0,0 +1,15 @@
+import random
+
+# HTTP-статусы, после которых запрос имеет смысл повторить:
+# таймаут, конфликт, превышение лимита и сбои на стороне сервера
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+def retry_delay(attempt: int, backoff: float, max_backoff: float) -> float:
+    """
+    Пауза перед повтором номер attempt (с нуля): экспонента от backoff, не больше
+    max_backoff, со случайным разбросом в половину — чтобы повторы разных
+    клиентов не приходили на сервер одновременно.
+    """
+    delay = min(backoff * 2 ** attempt, max_backoff)
+    return delay * random.uniform(0.5, 1.0)
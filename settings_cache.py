@@ -0,0 +1,95 @@
+import logging
+import re
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Optional, Pattern
+
+logger = logging.getLogger('settings')
+
+
+@dataclass(frozen=True)
+class BotSettings:
+    """
+    Неизменяемый снимок строки main.models.Bot (pk=1) с заранее разобранными полями.
+    """
+    version: int
+    last_change: Optional[datetime]
+    interval_first: float
+    interval_second: float
+    text_one_remember: str
+    text_two_remember: str
+    # agent_promt + key_word, как их склеивает webhook_handler
+    system_prompt: str
+    ban_words: tuple[str, ...]
+    ban_pattern: Optional[Pattern[str]]
+    proxy_host: str
+    proxy_port: str
+    proxy_user: str
+    proxy_password: str
+
+    @classmethod
+    def from_model(cls, bot) -> "BotSettings":
+        ban_words = tuple(w.strip() for w in bot.ban_word.split(",") if w.strip())
+        ban_pattern = re.compile("|".join(map(re.escape, ban_words))) if ban_words else None
+        return cls(
+            version=bot.version,
+            last_change=bot.last_change,
+            interval_first=bot.interval_first,
+            interval_second=bot.interval_second,
+            text_one_remember=bot.text_one_remember,
+            text_two_remember=bot.text_two_remember,
+            system_prompt=bot.agent_promt + bot.key_word,
+            ban_words=ban_words,
+            ban_pattern=ban_pattern,
+            proxy_host=bot.proxy_host,
+            proxy_port=bot.proxy_port,
+            proxy_user=bot.proxy_user,
+            proxy_password=bot.proxy_password,
+        )
+
+    def has_ban_word(self, text: str) -> bool:
+        return self.ban_pattern is not None and self.ban_pattern.search(text) is not None
+
+
+class SettingsCache:
+    """
+    Держит последний BotSettings и перечитывает строку только когда она изменилась.
+
+    Изменение определяется по Bot.version, который увеличивается при каждом save().
+    Сам номер версии проверяется не чаще раза в check_interval секунд, поэтому
+    обработка сообщения обычно не делает ни одного запроса к базе за настройками.
+    """
+
+    def __init__(self,
+                 loader: Callable[[], BotSettings],
+                 version_loader: Callable[[], int],
+                 check_interval: float = 5.0):
+        self._loader = loader
+        self._version_loader = version_loader
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._settings: Optional[BotSettings] = None
+        self._checked_at = 0.0
+
+    def get(self) -> BotSettings:
+        settings = self._settings
+        if settings is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return settings
+
+        with self._lock:
+            # Пока ждали блокировку, другой поток мог уже всё проверить
+            if self._settings is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return self._settings
+
+            if self._settings is None or self._version_loader() != self._settings.version:
+                self._settings = self._loader()
+                logger.info(f"Настройки бота перечитаны, версия {self._settings.version}")
+            self._checked_at = time.monotonic()
+            return self._settings
+
+    def invalidate(self):
+        """Заставляет следующий get() сверить версию с базой."""
+        self._checked_at = 0.0
@@ -0,0 +1,54 @@
+import os
+import re
+import sys
+
+import pytest
+
+from settings_cache import BotSettings, SettingsCache
+from utils import HistoryManager
+
+# Django-проект — как в bitrix_openline: пакеты order и main импортируются из папки order/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'order'))
+
+
+@pytest.fixture
+def history(tmp_path):
+    manager = HistoryManager(str(tmp_path / 'database.sqlt'))
+    yield manager
+    manager.close()
+
+
+class FakeEngine:
+    """
+    Вместо MessageEngine: отложенные задачи только записываются, тест запускает их сам.
+    """
+
+    def __init__(self):
+        self.delayed = []
+
+    def call_later(self, delay, coro_fn, *args):
+        self.delayed.append((delay, coro_fn, args))
+
+
+@pytest.fixture
+def bot(history, monkeypatch):
+    """
+    Модуль bitrix_openline с историей во временной базе, фиксированными настройками
+    (напоминание через 24 ч, бан-слово «спам») и записывающим движком.
+    """
+    import bitrix_openline
+
+    settings = BotSettings(
+        version=1, last_change=None, interval_first=24, interval_second=72,
+        text_one_remember='Остались вопросы?', text_two_remember='Будем рады помочь.',
+        system_prompt='Ты консультант магазина.', ban_words=('спам',), ban_pattern=re.compile('спам'),
+        proxy_host='', proxy_port='', proxy_user='', proxy_password='',
+    )
+    monkeypatch.setattr(bitrix_openline, 'settings_cache',
+                        SettingsCache(loader=lambda: settings, version_loader=lambda: settings.version))
+    monkeypatch.setattr(bitrix_openline, 'history_manager', history, raising=False)
+    monkeypatch.setattr(bitrix_openline, 'engine', FakeEngine())
+    monkeypatch.setattr(bitrix_openline, 'pending_messages', {})
+    monkeypatch.setattr(bitrix_openline, 'reminder_wake_at', None)
+    bitrix_openline.reminder_wakeup.clear()
+    return bitrix_openline
@@ -0,0 +1,48 @@
+import numpy as np
+
+import answer_cache
+from answer_cache import AnswerCache
+
+SCOPE = ('2026-10-01', 'Ты консультант магазина.')
+
+
+def vector(*values) -> np.ndarray:
+    return np.array(values, dtype=np.float32)
+
+
+def test_similar_question_hits_and_different_misses():
+    cache = AnswerCache(threshold=0.95)
+    assert cache.get(SCOPE, vector(1, 0, 0)) is None
+
+    cache.put(SCOPE, vector(2, 0, 0), 'HIFU стоит 150 000 ₽', {'role': 'assistant', 'content': '...'}, latency=2.5)
+    hit = cache.get(SCOPE, vector(1, 0.1, 0))
+    assert hit is not None and hit.content == 'HIFU стоит 150 000 ₽'
+    assert cache.get(SCOPE, vector(0, 1, 0)) is None
+
+    assert cache.stats() == {'entries': 1, 'hits': 1, 'misses': 2, 'hit_rate': 1 / 3, 'saved_seconds': 2.5}
+
+
+def test_scope_change_clears_cache():
+    cache = AnswerCache()
+    cache.put(SCOPE, vector(1, 0), 'ответ', {}, latency=1.0)
+    assert cache.get(('2026-10-02', SCOPE[1]), vector(1, 0)) is None
+    assert cache.get(SCOPE, vector(1, 0)) is None
+
+
+def test_expired_and_least_recently_used_entries_are_dropped(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache.time, 'time', lambda: now[0])
+    cache = AnswerCache(ttl=60, max_entries=2)
+    cache.put(SCOPE, vector(1, 0, 0), 'первый', {}, latency=1.0)
+    now[0] += 1
+    cache.put(SCOPE, vector(0, 1, 0), 'второй', {}, latency=1.0)
+    now[0] += 1
+    # Первый использован позже второго — при переполнении вытесняется второй
+    assert cache.get(SCOPE, vector(1, 0, 0)).content == 'первый'
+    cache.put(SCOPE, vector(0, 0, 1), 'третий', {}, latency=1.0)
+    assert cache.get(SCOPE, vector(0, 1, 0)) is None
+    assert cache.get(SCOPE, vector(0, 0, 1)).content == 'третий'
+
+    now[0] += 61
+    assert cache.get(SCOPE, vector(0, 0, 1)) is None
+    assert cache.stats()['entries'] == 0
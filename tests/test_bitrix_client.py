@@ -0,0 +1,114 @@
+import asyncio
+from urllib.parse import parse_qs
+
+import httpx
+import pytest
+
+from bitrix_client import BitrixClient, BitrixError, BATCH_MAX_COMMANDS
+
+
+def make_client(handler, retries: int = 3) -> tuple[BitrixClient, list[httpx.Request]]:
+    """
+    Клиент без пауз между повторами, запросы которого обрабатывает handler(request, номер).
+    """
+    requests = []
+
+    def transport(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return handler(request, len(requests))
+
+    client = BitrixClient('https://example.bitrix24.ru/rest/1/token/', retries=retries, backoff=0)
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(transport))
+    return client, requests
+
+
+def ok(result=True) -> httpx.Response:
+    return httpx.Response(200, json={'result': result})
+
+
+def test_retries_server_errors_and_query_limit():
+    def handler(request, n):
+        if n == 1:
+            return httpx.Response(503, text='Service Unavailable')
+        if n == 2:
+            return httpx.Response(503, json={'error': 'QUERY_LIMIT_EXCEEDED', 'error_description': 'Too many'})
+        return ok({'ID': 7})
+
+    client, requests = make_client(handler)
+    assert asyncio.run(client.call('crm.lead.get', {'ID': 7}))['result'] == {'ID': 7}
+    assert len(requests) == 3
+
+
+def test_gives_up_after_retries():
+    client, requests = make_client(lambda request, n: httpx.Response(500, text='oops'), retries=2)
+    with pytest.raises(BitrixError) as error:
+        asyncio.run(client.call('crm.lead.get'))
+    assert error.value.status == 500
+    assert len(requests) == 3
+
+
+def test_does_not_retry_application_errors():
+    client, requests = make_client(
+        lambda request, n: httpx.Response(400, json={'error': 'ERROR_CORE', 'error_description': 'bad'}))
+    with pytest.raises(BitrixError):
+        asyncio.run(client.call('crm.lead.get'))
+    assert len(requests) == 1
+
+
+def test_non_idempotent_method_not_retried_after_read_timeout():
+    def handler(request, n):
+        raise httpx.ReadTimeout('timed out', request=request)
+
+    client, requests = make_client(handler)
+    with pytest.raises(httpx.ReadTimeout):
+        asyncio.run(client.call('imbot.message.add', {'DIALOG_ID': 'chat1', 'MESSAGE': 'Здравствуйте'}))
+    assert len(requests) == 1
+
+
+def test_non_idempotent_method_retried_when_not_sent():
+    def handler(request, n):
+        if n == 1:
+            raise httpx.ConnectError('connection refused', request=request)
+        if n == 2:
+            return httpx.Response(503, json={'error': 'QUERY_LIMIT_EXCEEDED'})
+        return ok(1)
+
+    client, requests = make_client(handler)
+    assert asyncio.run(client.call('imbot.message.add', {'DIALOG_ID': 'chat1'}))['result'] == 1
+    assert len(requests) == 3
+
+
+def test_non_idempotent_method_not_retried_after_server_error():
+    client, requests = make_client(lambda request, n: httpx.Response(502, text='Bad Gateway'))
+    with pytest.raises(BitrixError):
+        asyncio.run(client.call('imbot.message.add', {'DIALOG_ID': 'chat1'}))
+    assert len(requests) == 1
+
+
+def test_batch_splits_by_max_commands():
+    def handler(request, n):
+        form = parse_qs(request.content.decode())
+        keys = [name[4:-1] for name in form if name.startswith('cmd[')]
+        return ok({'result': {key: True for key in keys if key != 'c3'},
+                   'result_error': {'c3': 'not found'} if 'c3' in keys else []})
+
+    client, requests = make_client(handler)
+    commands = {f'c{i}': ('crm.lead.get', {'ID': i}) for i in range(BATCH_MAX_COMMANDS + 3)}
+    results, errors = asyncio.run(client.batch(commands))
+
+    assert [len([name for name in parse_qs(r.content.decode()) if name.startswith('cmd[')]) for r in requests] == [
+        BATCH_MAX_COMMANDS, 3]
+    assert all(str(r.url).endswith('/batch') for r in requests)
+    assert len(results) == BATCH_MAX_COMMANDS + 2
+    assert errors == {'c3': 'not found'}
+
+
+def test_batch_with_message_add_is_not_idempotent():
+    def handler(request, n):
+        raise httpx.ReadTimeout('timed out', request=request)
+
+    client, requests = make_client(handler)
+    commands = {'lead': ('crm.lead.get', {'ID': 1}), 'reply': ('imbot.message.add', {'DIALOG_ID': 'chat1'})}
+    with pytest.raises(httpx.ReadTimeout):
+        asyncio.run(client.batch(commands))
+    assert len(requests) == 1
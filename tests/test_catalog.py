@@ -0,0 +1,122 @@
+import faiss
+import numpy as np
+import pandas as pd
+import pytest
+
+import gpt_client
+from embedding_providers import LocalEmbeddingProvider
+
+PRODUCTS = [
+    ('Аппарат HIFU', 'Подтяжка кожи лица ультразвуком', 150000),
+    ('Микротоки', 'Массаж лица микротоками', 30000),
+    ('RF-лифтинг', 'Радиочастотный лифтинг тела', 90000),
+]
+
+
+class CountingProvider(LocalEmbeddingProvider):
+    """
+    Локальные эмбеддинги, которые запоминают тексты каждого вызова embed.
+    """
+
+    def __init__(self):
+        super().__init__(dim=32, workers=1)
+        self.calls = []
+
+    def embed(self, texts):
+        self.calls.append(list(texts))
+        return super().embed(texts)
+
+
+@pytest.fixture
+def catalog(tmp_path, monkeypatch):
+    """
+    Пути каталога — во временной папке, эмбеддинги — локальные. Возвращает провайдер.
+    """
+    for name, path in (('PRODUCT_CSV_PATH', 'products.csv'), ('METADATA_CSV_PATH', 'products_metadata.csv'),
+                       ('INDEX_PATH', 'products.index'), ('CATALOG_SNAPSHOT_DIR', 'catalog'),
+                       ('VECTORS_PATH', 'vectors.npy'), ('VECTOR_IDS_PATH', 'vector_ids.npy')):
+        monkeypatch.setattr(gpt_client, name, str(tmp_path / path))
+    provider = CountingProvider()
+    monkeypatch.setattr(gpt_client, 'embedding_provider', provider)
+    return provider
+
+
+def write_products(rows):
+    pd.DataFrame(rows, columns=['name', 'description', 'price']).to_csv(gpt_client.PRODUCT_CSV_PATH, index=False)
+
+
+def index_ids(snapshot) -> list[int]:
+    return sorted(faiss.vector_to_array(snapshot.index.id_map).tolist())
+
+
+def embedded_names(provider) -> list[str]:
+    return sorted(text.split('. ')[0] for call in provider.calls for text in call)
+
+
+def products_frame(rows) -> pd.DataFrame:
+    return gpt_client.prepare_products(pd.DataFrame(rows, columns=['name', 'description', 'price']))
+
+
+def test_diff_catalog_groups_changes_by_column():
+    old = products_frame(PRODUCTS)
+    new = products_frame([(PRODUCTS[0][0], PRODUCTS[0][1], 140000), ('Микротоки PRO', PRODUCTS[1][1], 30000),
+                          (PRODUCTS[2][0], 'Радиочастотный лифтинг лица', 90000), ('Прессотерапия', '', 60000)])
+
+    changes = gpt_client.diff_catalog(new, old)
+    assert changes.summary() == 'added=1 removed=0 name=1 description=1 price=1'
+    assert changes.price_changed.tolist() == [0]
+    assert changes.to_embed.tolist() == [1, 2, 3]
+    assert changes.to_remove.tolist() == [1, 2]
+
+
+def test_diff_catalog_reports_removed_and_unchanged():
+    old = products_frame(PRODUCTS)
+    assert not gpt_client.diff_catalog(products_frame(PRODUCTS), old)
+
+    changes = gpt_client.diff_catalog(products_frame(PRODUCTS[:1]), old)
+    assert changes.removed.tolist() == [1, 2]
+    assert changes.to_embed.tolist() == []
+    assert changes.to_remove.tolist() == [1, 2]
+
+
+def test_build_catalog_updates_index_by_id(catalog):
+    write_products(PRODUCTS)
+    assert index_ids(gpt_client.build_catalog()) == [0, 1, 2]
+
+    # id товара — номер строки: правим описание второго, меняем цену первого, дописываем четвёртый
+    catalog.calls.clear()
+    updated = [(PRODUCTS[0][0], PRODUCTS[0][1], 140000), (PRODUCTS[1][0], 'Лифтинг лица микротоками', 30000),
+               PRODUCTS[2], ('Прессотерапия', 'Лимфодренаж ног', 60000)]
+    write_products(updated)
+    snapshot = gpt_client.build_catalog()
+    assert index_ids(snapshot) == [0, 1, 2, 3]
+    assert embedded_names(catalog) == ['Микротоки', 'Прессотерапия']
+
+    # Удалённый последний товар уходит из индекса без новых эмбеддингов
+    catalog.calls.clear()
+    write_products(updated[:3])
+    snapshot = gpt_client.build_catalog()
+    assert index_ids(snapshot) == [0, 1, 2]
+    assert catalog.calls == []
+    ids, vectors = gpt_client.load_vectors()
+    assert sorted(ids.tolist()) == [0, 1, 2] and len(vectors) == 3
+
+
+def test_build_catalog_replay_after_crash_keeps_ids_unique(catalog, monkeypatch):
+    write_products(PRODUCTS)
+    gpt_client.build_catalog()
+
+    write_products(PRODUCTS + [('Прессотерапия', 'Лимфодренаж ног', 60000)])
+    # Индекс и векторы уже записаны, снимок — нет: следующий diff снова видит товар 3 новым
+    def crash(*args):
+        raise OSError('нет места на диске')
+
+    with monkeypatch.context() as m:
+        m.setattr(gpt_client, 'write_snapshot', crash)
+        with pytest.raises(OSError):
+            gpt_client.build_catalog()
+
+    snapshot = gpt_client.build_catalog()
+    assert index_ids(snapshot) == [0, 1, 2, 3]
+    ids, _ = gpt_client.load_vectors()
+    assert sorted(ids.tolist()) == [0, 1, 2, 3]
@@ -0,0 +1,87 @@
+import random
+import threading
+import time
+
+import httpx
+import numpy as np
+import pytest
+from openai import APIConnectionError, APIStatusError, BadRequestError, RateLimitError
+
+from embedding_pipeline import EmbeddingPipeline, retry_after, token_batches
+
+REQUEST = httpx.Request('POST', 'https://api.openai.com/v1/embeddings')
+
+
+def status_error(cls, status: int, headers=None) -> APIStatusError:
+    return cls('error', response=httpx.Response(status, headers=headers, request=REQUEST), body=None)
+
+
+def fake_embed(texts: list[str]) -> np.ndarray:
+    # Вектор текста — его номер: по нему видно, вернулся ли результат на своё место
+    return np.array([[float(text.split()[-1])] for text in texts], dtype=np.float32)
+
+
+def test_token_batches():
+    assert token_batches([5, 5, 5, 20, 1], max_tokens=10, max_inputs=3) == [[0, 1], [2], [3], [4]]
+    assert token_batches([1] * 5, max_tokens=100, max_inputs=2) == [[0, 1], [2, 3], [4]]
+    assert token_batches([], max_tokens=10, max_inputs=2) == []
+
+
+def test_results_keep_input_order():
+    def slow_embed(texts):
+        time.sleep(random.uniform(0, 0.01))
+        return fake_embed(texts)
+
+    pipeline = EmbeddingPipeline(slow_embed, concurrency=8, max_tokens=10, max_inputs=3)
+    texts = [f"товар {i}" for i in range(50)]
+
+    vectors = pipeline.run(texts, [2] * len(texts))
+    assert vectors[:, 0].tolist() == list(range(50))
+    assert pipeline.requests == 17
+
+
+def test_retries_transient_errors():
+    failures = [status_error(RateLimitError, 429, {'retry-after-ms': '10'}), APIConnectionError(request=REQUEST),
+                status_error(APIStatusError, 503)]
+    lock = threading.Lock()
+
+    def flaky_embed(texts):
+        with lock:
+            if failures:
+                raise failures.pop(0)
+        return fake_embed(texts)
+
+    pipeline = EmbeddingPipeline(flaky_embed, concurrency=2, max_inputs=2, backoff=0.001)
+    vectors = pipeline.run([f"товар {i}" for i in range(6)], [1] * 6)
+
+    assert vectors[:, 0].tolist() == list(range(6))
+    assert pipeline.retried == 3
+    assert pipeline.requests == 3 + 3
+
+
+def test_gives_up_on_permanent_or_repeated_errors():
+    def bad_request(texts):
+        raise status_error(BadRequestError, 400)
+
+    pipeline = EmbeddingPipeline(bad_request, concurrency=1, backoff=0.001)
+    with pytest.raises(BadRequestError):
+        pipeline.run(['товар 1'], [1])
+    assert pipeline.requests == 1
+
+    def overloaded(texts):
+        raise status_error(APIStatusError, 500)
+
+    pipeline = EmbeddingPipeline(overloaded, concurrency=1, retries=2, backoff=0.001)
+    with pytest.raises(APIStatusError):
+        pipeline.run(['товар 1'], [1])
+    assert pipeline.requests == 3
+
+
+def test_retry_after_header():
+    assert retry_after(status_error(RateLimitError, 429, {'retry-after-ms': '250'})) == 0.25
+    assert retry_after(status_error(RateLimitError, 429, {'retry-after': '3'})) == 3.0
+    assert retry_after(status_error(RateLimitError, 429)) is None
+    # Пауза сервера важнее своей, но не длиннее max_backoff
+    pipeline = EmbeddingPipeline(fake_embed, backoff=0.1, max_backoff=5.0)
+    assert pipeline.retry_delay(0, status_error(RateLimitError, 429, {'retry-after': '3'})) == 3.0
+    assert pipeline.retry_delay(0, status_error(RateLimitError, 429, {'retry-after': '30'})) == 5.0
@@ -0,0 +1,28 @@
+import threading
+
+import engine
+from engine import MessageEngine
+
+
+def test_delayed_task_survives_full_queue(monkeypatch):
+    monkeypatch.setattr(engine, 'REQUEUE_DELAY', 0.05)
+    # Воркеров нет: очередь на одну задачу занимает submit, таймерной задаче места не остаётся
+    messages = MessageEngine(workers=0, queue_size=1).start()
+    done = threading.Event()
+
+    async def reply():
+        done.set()
+
+    async def noop():
+        pass
+
+    messages.submit(noop)
+    messages.call_later(0.01, reply)
+    assert not done.wait(0.2)
+    assert messages.scheduled == 1
+
+    # Освобождаем очередь и запускаем воркер: отложенный ответ встаёт в неё на следующей попытке
+    messages.loop.call_soon_threadsafe(messages._queue.get_nowait)
+    messages.loop.call_soon_threadsafe(lambda: messages.loop.create_task(messages._worker()))
+    assert done.wait(2)
+    assert messages.scheduled == 0
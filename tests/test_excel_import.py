@@ -0,0 +1,44 @@
+import math
+
+import pandas as pd
+import pytest
+
+from main.excel_products_to_csv import parse_price, toCSV
+
+
+@pytest.mark.parametrize('value, expected', [
+    (62000, 62000.0),
+    ('62 000 руб.', 62000.0),
+    ('62000-00', 62000.0),
+    ('1-500', 1500.0),
+    ('1-500-00', 1500.0),
+    ('1000-2000', 1000.0),
+    ('1 000 – 2 000 руб', 1000.0),
+    ('от 150000', 150000.0),
+])
+def test_parse_price(value, expected):
+    assert parse_price(value) == expected
+
+
+@pytest.mark.parametrize('value', ['по запросу', '', None])
+def test_price_without_number_is_nan(value):
+    assert math.isnan(parse_price(value))
+
+
+def test_text_prices_are_kept(tmp_path):
+    source = tmp_path / 'price.xlsx'
+    pd.DataFrame({
+        'Наименование': ['Аппараты', 'Аппарат RF', 'Лазер', 'Кушетка'],
+        'Описание': [None, 'RF-лифтинг', 'Диодный', 'Массажная'],
+        'Цена': [None, '62 000 руб.', 'по запросу', '1000-2000'],
+    }).to_excel(source, index=False)
+    output = tmp_path / 'products.csv'
+
+    toCSV(source, output)
+
+    products = pd.read_csv(output)
+    # Заголовок раздела без цены отброшен, товар с ценой текстом — нет
+    assert products['name'].tolist() == ['Аппарат RF', 'Лазер', 'Кушетка']
+    assert products['price'].tolist()[0] == 62000.0
+    assert math.isnan(products['price'].tolist()[1])
+    assert products['price'].tolist()[2] == 1000.0
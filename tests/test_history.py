@@ -0,0 +1,70 @@
+import sqlite3
+import threading
+
+import numpy as np
+import pytest
+
+from gpt_client import combine_embeddings
+from utils import HistoryManager
+
+
+def test_failed_connect_frees_pool_slot(tmp_path, monkeypatch):
+    manager = HistoryManager(str(tmp_path / 'database.sqlt'), pool_size=2)
+    connect = manager._connect
+
+    def broken_connect():
+        raise sqlite3.OperationalError('unable to open database file')
+
+    try:
+        with manager._connection():
+            # Единственное соединение занято: следующий вызов открывает второе, и оно не открывается
+            monkeypatch.setattr(manager, '_connect', broken_connect)
+            with pytest.raises(sqlite3.OperationalError):
+                with manager._connection():
+                    pass
+
+            # Место в пуле свободно: новое соединение открывается, а не ждёт возврата занятого
+            monkeypatch.setattr(manager, '_connect', connect)
+            opened = threading.Event()
+
+            def acquire():
+                with manager._connection() as conn:
+                    conn.execute("SELECT 1")
+                    opened.set()
+
+            threading.Thread(target=acquire, daemon=True).start()
+            assert opened.wait(5)
+    finally:
+        manager.close()
+
+
+def test_user_embeddings_follow_history(history):
+    model = 'text-embedding-3-small'
+    history.max_history = 4
+    first = history.add_message('chat1', {'role': 'user', 'content': 'HIFU'}, np.array([1, 0], np.float32), model)
+    history.add_message('chat1', {'role': 'assistant', 'content': 'Стоит 150 000 ₽'})
+    # Вектор, посчитанный в фоне после ответа
+    second = history.add_message('chat1', {'role': 'user', 'content': 'А доставка?'})
+    history.set_message_embedding(second, np.array([0, 1], np.float32), model)
+    history.add_message('chat2', {'role': 'user', 'content': 'Привет'}, np.array([5, 5], np.float32), model)
+
+    vectors = history.get_user_embeddings('chat1', model)
+    assert [v.tolist() for v in vectors] == [[1, 0], [0, 1]]
+    assert history.get_user_embeddings('chat1', 'local-hash-512-v1') == []
+
+    # Вытесненная из истории реплика уносит свой вектор
+    history.add_message('chat1', {'role': 'assistant', 'content': 'Бесплатно'})
+    history.add_message('chat1', {'role': 'user', 'content': 'Спасибо'})
+    assert [v.tolist() for v in history.get_user_embeddings('chat1', model)] == [[0, 1]]
+    history.set_message_embedding(first, np.array([1, 1], np.float32), model)
+    with history._connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM message_embeddings WHERE message_id = ?", (first,)).fetchone() == (0,)
+
+
+def test_combine_embeddings_weights_recent_turns():
+    old, new = np.array([1, 0], np.float32), np.array([0, 1], np.float32)
+
+    combined = combine_embeddings([old, new], decay=0.5)
+    assert np.isclose(np.linalg.norm(combined), 1)
+    assert combined[1] == pytest.approx(2 * combined[0])
+    assert combine_embeddings([new]) == pytest.approx(new)
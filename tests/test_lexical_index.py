@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import lexical_index
+from lexical_index import LexicalIndex, reciprocal_rank_fusion, tokenize
+
+PRODUCTS = pd.DataFrame({
+    'name': ['Аппарат HIFU FU 2.1 MINI', 'Микротоковый аппарат для лица', 'RF-лифтинг тела',
+             'Аппарат прессотерапии', 'Кресло косметологическое'],
+    'description': ['Ультразвуковая подтяжка кожи лица', 'Микротоки для массажа лица и шеи',
+                    'Радиочастотный лифтинг кожи тела', 'Лимфодренажный массаж ног',
+                    'Кресло для процедур, подтяжка не нужна'],
+}, index=pd.Index([10, 11, 12, 13, 14], name='id'))
+
+
+@pytest.fixture(scope='module')
+def index(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp('catalog'))
+    LexicalIndex.build(PRODUCTS).save(directory)
+    return LexicalIndex.load(directory)
+
+
+def test_index_built_by_other_stemmer_is_not_loaded(tmp_path, monkeypatch):
+    LexicalIndex.build(PRODUCTS).save(str(tmp_path))
+    monkeypatch.setattr(lexical_index, 'STEMMER', 'other')
+    assert LexicalIndex.load(str(tmp_path)) is None
+
+
+def test_tokenize_drops_stop_words_and_keeps_models():
+    assert tokenize('Сколько стоит аппарат HIFU FU 2.1?') == ['аппарат', 'hifu', 'fu', '2', '1']
+    # Формы слова сводятся к одной основе
+    assert tokenize('массажа')[0] == tokenize('массаж')[0]
+
+
+def test_search_ranks_by_bm25(index):
+    ids, scores = index.search('подтяжка кожи', k=3)
+    assert ids.tolist() == [10, 14, 12]
+    assert list(scores) == sorted(scores, reverse=True)
+
+    # Совпадение в названии весит больше, чем в описании: 11 — «для лица» в названии
+    assert index.search('аппарат лица', k=2)[0].tolist() == [11, 10]
+    assert index.search('неизвестное слово', k=3)[0].tolist() == []
+
+
+def test_search_respects_allowed_ids(index):
+    assert index.search('аппарат лица', k=5, allowed=np.array([11, 13]))[0].tolist() == [11, 13]
+    assert index.search('аппарат', k=5, allowed=np.array([], dtype=np.int64))[0].tolist() == []
+
+
+def test_exact_match_by_name_terms(index):
+    assert index.exact_match('hifu mini', k=5).tolist() == [10]
+    # Порядок найденных — по BM25
+    assert index.exact_match('аппарат', k=5).tolist() == index.search('аппарат', k=5)[0].tolist()
+    # Слишком много совпадений или нет ни одного — запрос не про конкретный товар
+    assert index.exact_match('аппарат', k=2) is None
+    assert index.exact_match('hifu кресло', k=5) is None
+
+
+def test_reciprocal_rank_fusion_prefers_agreement():
+    vector = np.array([1, 2, 3, 4])
+    lexical = np.array([3, 5, 1])
+
+    # 1 и 3 нашлись обоими поисками и обгоняют 2, который второй только в одном списке
+    assert reciprocal_rank_fusion([vector, lexical], k=4).tolist() == [1, 3, 2, 5]
+    assert reciprocal_rank_fusion([np.array([7, 8])], k=5).tolist() == [7, 8]
+    assert reciprocal_rank_fusion([], k=5).tolist() == []
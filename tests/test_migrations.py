@@ -0,0 +1,103 @@
+import sqlite3
+
+import pytest
+
+import utils
+from utils import HistoryManager, SCHEMA_MIGRATIONS, apply_migrations
+
+LATEST = SCHEMA_MIGRATIONS[-1][0]
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'database.sqlt', isolation_level=None)
+    yield conn
+    conn.close()
+
+
+def user_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def tables(conn) -> set[str]:
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def legacy_schema(conn):
+    # Схема, которую создавал HistoryManager до версионированных миграций
+    conn.executescript("""
+        CREATE TABLE dialog_history (id INTEGER primary key autoincrement, peer_id TEXT not null,
+                                     role TEXT not null, content TEXT not null,
+                                     timestamp DATETIME default CURRENT_TIMESTAMP);
+        CREATE TABLE blacklist (peer_id TEXT, reason TEXT, timestamp DATETIME default CURRENT_TIMESTAMP);
+        CREATE TABLE reminder_status (peer_id TEXT primary key, stage INTEGER default 0 not null);
+    """)
+
+
+def test_fresh_database_gets_latest_schema(conn):
+    assert apply_migrations(conn) == LATEST
+    assert user_version(conn) == LATEST
+    assert {'dialog_history', 'blacklist', 'reminder_status', 'message_embeddings'} <= tables(conn)
+
+
+def test_migrations_are_applied_once(conn):
+    apply_migrations(conn)
+    assert apply_migrations(conn) == LATEST
+    assert user_version(conn) == LATEST
+
+
+def test_target_stops_at_version(conn):
+    assert apply_migrations(conn, target=2) == 2
+    assert 'message_embeddings' not in tables(conn)
+    assert apply_migrations(conn) == LATEST
+    assert 'message_embeddings' in tables(conn)
+
+
+def test_legacy_database_is_upgraded(conn):
+    legacy_schema(conn)
+    conn.executescript("""
+        INSERT INTO blacklist (peer_id, reason) VALUES ('chat1', 'old'), ('chat1', 'ban_word'), ('chat2', 'no_access');
+        INSERT INTO dialog_history (peer_id, role, content, timestamp) VALUES
+            ('chat3', 'user', 'привет', '2025-01-01 10:00:00'),
+            ('chat3', 'assistant', 'здравствуйте', '2025-01-01 10:00:05'),
+            ('chat3', 'user', 'цена?', '2025-01-01 10:01:00'),
+            ('chat4', 'assistant', 'напоминание', '2025-01-02 09:00:00');
+        INSERT INTO reminder_status (peer_id, stage) VALUES ('chat3', 1);
+    """)
+
+    assert apply_migrations(conn) == LATEST
+
+    # Из повторов в чёрном списке остаётся самая свежая запись
+    assert conn.execute("SELECT peer_id, reason FROM blacklist ORDER BY peer_id").fetchall() == \
+        [('chat1', 'ban_word'), ('chat2', 'no_access')]
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO blacklist (peer_id, reason) VALUES ('chat1', 'again')")
+    # Срок напоминаний — по последней реплике пользователя, этап сохраняется
+    assert conn.execute("SELECT peer_id, stage, last_user_at FROM reminder_status ORDER BY peer_id").fetchall() == \
+        [('chat3', 1, '2025-01-01 10:01:00'), ('chat4', 0, None)]
+
+
+def test_failed_migration_is_rolled_back(conn, monkeypatch):
+    monkeypatch.setattr(utils, 'SCHEMA_MIGRATIONS', SCHEMA_MIGRATIONS + [
+        (LATEST + 1, ["CREATE TABLE extra (id INTEGER)", "INSERT INTO missing_table VALUES (1)"]),
+    ])
+    with pytest.raises(sqlite3.OperationalError):
+        utils.apply_migrations(conn)
+    assert user_version(conn) == LATEST
+    assert 'extra' not in tables(conn)
+
+
+def test_message_embeddings_follow_history(tmp_path):
+    history = HistoryManager(str(tmp_path / 'database.sqlt'))
+    try:
+        message_id = history.add_message('chat1', {'role': 'user', 'content': 'привет'})
+        history.set_message_embedding(message_id, [0.1, 0.2], 'model')
+        # Вектор для уже удалённой реплики не сохраняется
+        history.set_message_embedding(message_id + 100, [0.1, 0.2], 'model')
+        with history._connection() as c:
+            assert c.execute("SELECT message_id FROM message_embeddings").fetchall() == [(message_id,)]
+            with c:
+                c.execute("DELETE FROM dialog_history WHERE id = ?", (message_id,))
+            assert c.execute("SELECT COUNT(*) FROM message_embeddings").fetchone()[0] == 0
+    finally:
+        history.close()
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from price_filter import PriceIndex, PriceRange, split_price_constraint
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('до 3000 рублей', PriceRange(None, 3000)),
+    ('от 5 до 10 тыс', PriceRange(5000, 10000)),
+    ('5-10 тыс', PriceRange(5000, 10000)),
+    ('3000-5000 руб', PriceRange(3000, 5000)),
+    ('от 50000 до 100000', PriceRange(50000, 100000)),
+    ('дешевле 50к', PriceRange(None, 50000)),
+    ('около 30000', PriceRange(24000, 36000)),
+    ('бюджет 200000', PriceRange(None, 200000)),
+    ('до 100000р', PriceRange(None, 100000)),
+    ('до 5 тыс. р.', PriceRange(None, 5000)),
+    ('DIOLASHeer до 1 млн', PriceRange(None, 1_000_000)),
+    ('Liposonix до 500 тысяч рублей', PriceRange(None, 500_000)),
+    ('аппарат до 150000 в наличии', PriceRange(None, 150_000)),
+])
+def test_price_constraints(text, expected):
+    assert split_price_constraint(text)[1] == expected
+
+
+@pytest.mark.parametrize('text', [
+    'до 365 дней гарантия',
+    'до 500 штук',
+    'мощность до 1500 ватт',
+    'гарантия до 2026 года',
+    'до 1200 импульсов',
+    'от 200 до 300 граммов',
+    'от 100 до 500 мл',
+    'от 2 до 5 кг',
+    'до 220 в',
+    'с 9 до 18',
+    '30000-50000',
+])
+def test_quantities_are_not_prices(text):
+    assert split_price_constraint(text) == (text, None)
+
+
+@pytest.mark.parametrize('text, rest, expected', [
+    ('диодный лазер 808 до 500000', 'диодный лазер 808', PriceRange(None, 500_000)),
+    ('аппарат 3 в 1 до 100 тыс', 'аппарат 3 в 1', PriceRange(None, 100_000)),
+    ('RF 1000 до 200000', 'RF 1000', PriceRange(None, 200_000)),
+])
+def test_number_before_do_is_not_lower_bound(text, rest, expected):
+    assert split_price_constraint(text) == (rest, expected)
+
+
+def test_contradicting_constraints_are_ignored():
+    assert split_price_constraint('дороже 50000 дешевле 10000') == ('дороже 50000 дешевле 10000', None)
+
+
+def test_price_index_select(tmp_path):
+    products = pd.DataFrame({'price': [300.0, np.nan, 100.0, 0.0, 200.0]},
+                            index=pd.Index([10, 11, 12, 13, 14], name='id'))
+    index = PriceIndex.build(products)
+    assert len(index) == 3
+    index.save(str(tmp_path))
+    loaded = PriceIndex.load(str(tmp_path))
+    assert loaded.select(PriceRange(150, None)).tolist() == [10, 14]
+    assert loaded.select(PriceRange(None, 200)).tolist() == [12, 14]
+    assert loaded.select(PriceRange(400, 500)).tolist() == []
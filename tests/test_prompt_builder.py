@@ -0,0 +1,45 @@
+import pytest
+
+from prompt_builder import TokenCounter, build_prompt, MESSAGE_OVERHEAD, REPLY_PRIMING
+
+counter = TokenCounter('gpt-4o-mini')
+
+SYSTEM = 'Ты консультант магазина косметологического оборудования. Отвечай кратко и по делу.'
+PRODUCTS = [f"Аппарат {i}: " + 'подробное описание аппарата и его характеристик. ' * 20 for i in range(5)]
+HISTORY = [{'role': 'user' if i % 2 == 0 else 'assistant', 'content': f"реплика {i} " + 'текст ' * 30}
+           for i in range(10)]
+QUESTION = 'Подскажите аппарат для лица до 100 000 рублей'
+
+
+def prompt_tokens(messages) -> int:
+    return sum(counter.count(m['content']) + MESSAGE_OVERHEAD for m in messages) + REPLY_PRIMING
+
+
+@pytest.mark.parametrize('budget', [60, 200, 500, 1000, 2000, 10_000])
+def test_prompt_fits_budget(budget):
+    messages, stats = build_prompt(counter, budget, SYSTEM, PRODUCTS, HISTORY, QUESTION)
+
+    assert prompt_tokens(messages) <= budget
+    assert stats.total <= budget
+    assert messages[0]['role'] == 'system' and messages[-1]['role'] == 'user'
+
+
+def test_old_history_and_last_products_dropped_first():
+    messages, stats = build_prompt(counter, 1000, SYSTEM, PRODUCTS, HISTORY, QUESTION)
+
+    assert messages[-1]['content'] == QUESTION
+    assert messages[0]['content'].startswith(SYSTEM)
+    assert 0 < stats.products_used < len(PRODUCTS)
+    assert 'Товар 1:\nАппарат 0' in messages[0]['content']
+    # Остаются самые свежие реплики
+    assert 0 < stats.history_used < len(HISTORY)
+    assert messages[1:-1] == HISTORY[-stats.history_used:]
+    assert stats.truncated
+
+
+def test_small_prompt_is_not_truncated():
+    messages, stats = build_prompt(counter, 10_000, SYSTEM, PRODUCTS[:1], HISTORY[:2], QUESTION)
+
+    assert messages[1:-1] == HISTORY[:2]
+    assert (stats.products_used, stats.history_used, stats.truncated) == (1, 2, False)
+    assert stats.total == prompt_tokens(messages)
@@ -0,0 +1,138 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import httpx
+
+from reminders import dispatch_reminders
+from utils import TIMESTAMP_FORMAT
+
+LATER = datetime.utcnow() + timedelta(days=1)
+
+
+def test_blacklisted_dialog_gets_no_reminders(history):
+    history.mark_user_activity('chat1')
+    history.put_in_blacklist('chat1', 'ban_word')
+    # Сообщение, обработанное уже после попадания в чёрный список
+    history.mark_user_activity('chat1')
+
+    assert history.in_blacklist('chat1')
+    assert history.get_due_reminders(60, 60, now=LATER) == []
+    assert history.get_next_reminder_at(60, 60) is None
+
+
+def test_blacklist_hides_existing_reminder_row(history):
+    history.mark_user_activity('chat1')
+    history.mark_user_activity('chat2')
+    with history._connection() as conn, conn:
+        conn.execute("INSERT INTO blacklist (peer_id, reason) VALUES ('chat1', 'manager')")
+
+    assert [peer_id for peer_id, _, _ in history.get_due_reminders(60, 60, now=LATER)] == ['chat2']
+
+
+def test_due_reminders_follow_stage_intervals(history):
+    history.mark_user_activity('chat1')
+    last_user_at = history.get_due_reminders(0, 0)[0][2]
+    sent_at = datetime.strptime(last_user_at, TIMESTAMP_FORMAT)
+
+    assert history.get_due_reminders(3600, 7200, now=sent_at + timedelta(minutes=59)) == []
+    assert history.get_due_reminders(3600, 7200, now=sent_at + timedelta(hours=1)) == [('chat1', 0, last_user_at)]
+    assert history.get_next_reminder_at(3600, 7200) == sent_at + timedelta(hours=1)
+
+    history.advance_stages([('chat1', 0, 1, last_user_at)])
+    assert history.get_due_reminders(3600, 7200, now=sent_at + timedelta(minutes=119)) == []
+    assert history.get_next_reminder_at(3600, 7200) == sent_at + timedelta(hours=2)
+
+
+def test_new_message_resets_reminder_stage(history):
+    history.mark_user_activity('chat1')
+    history.mark_user_activity('chat2')
+    chat2_at = dict((peer_id, at) for peer_id, _, at in history.get_due_reminders(0, 0))['chat2']
+    history.advance_stages([('chat2', 0, 1, chat2_at)])
+    # Реплика пользователя возвращает диалог на первое напоминание
+    history.mark_user_activity('chat2')
+
+    assert sorted((peer_id, stage) for peer_id, stage, _ in history.get_due_reminders(60, 60, now=LATER)) == [
+        ('chat1', 0), ('chat2', 0)]
+
+
+def test_message_wakes_worker_only_for_earlier_deadline(bot):
+    bot.reminder_wake_at = datetime.utcnow() + timedelta(minutes=5)
+    asyncio.run(bot.process_message('chat1', 'Здравствуйте'))
+    assert not bot.reminder_wakeup.is_set()
+
+    # Планировщик спит дольше, чем до нового срока (через 24 ч)
+    bot.reminder_wake_at = datetime.utcnow() + timedelta(days=2)
+    asyncio.run(bot.process_message('chat2', 'Здравствуйте'))
+    assert bot.reminder_wakeup.is_set()
+
+
+class FakeBitrix:
+    """
+    batch отвечает ошибками из errors по диалогу; before_send вызывается перед ответом.
+    """
+
+    def __init__(self, errors=None, before_send=None, fail=None):
+        self.errors = errors or {}
+        self.before_send = before_send
+        self.fail = fail
+        self.sent = []
+
+    async def batch(self, commands):
+        if self.fail is not None:
+            raise self.fail
+        if self.before_send is not None:
+            self.before_send()
+        self.sent.extend(params['DIALOG_ID'] for _, params in commands.values())
+        return {}, {key: self.errors[params['DIALOG_ID']]
+                    for key, (_, params) in commands.items() if params['DIALOG_ID'] in self.errors}
+
+
+def send_command(dialog_id, text):
+    return 'imbot.message.add', {'DIALOG_ID': dialog_id, 'MESSAGE': text}
+
+
+def dialogs_written_long_ago(history, *dialog_ids):
+    for dialog_id in dialog_ids:
+        history.mark_user_activity(dialog_id)
+    with history._connection() as conn, conn:
+        conn.execute("UPDATE reminder_status SET last_user_at = '2020-01-01 00:00:00'")
+    return history.get_due_reminders(60, 60)
+
+
+def stages(history) -> dict[str, int]:
+    with history._connection() as conn:
+        return dict(conn.execute("SELECT peer_id, stage FROM reminder_status").fetchall())
+
+
+def test_dispatch_advances_delivered_reminders(history):
+    due = dialogs_written_long_ago(history, 'chat1', 'chat2', 'chat3')
+    bitrix = FakeBitrix(errors={'chat2': {'error': 'QUERY_LIMIT_EXCEEDED'}, 'chat3': {'error': 'ACCESS_DENIED'}})
+
+    result = asyncio.run(dispatch_reminders(bitrix, history, due, {0: 'Остались вопросы?'}, send_command))
+
+    assert (result.sent, result.deferred, result.failed) == (1, 1, 1)
+    assert stages(history)['chat1'] == 1
+    assert stages(history)['chat2'] == 0
+    assert history.in_blacklist('chat3')
+
+
+def test_dispatch_keeps_stage_when_user_wrote_meanwhile(history):
+    due = dialogs_written_long_ago(history, 'chat1', 'chat2')
+    # Пользователь ответил, пока пачка напоминаний была в пути
+    bitrix = FakeBitrix(before_send=lambda: history.mark_user_activity('chat2'))
+
+    result = asyncio.run(dispatch_reminders(bitrix, history, due, {0: 'Остались вопросы?'}, send_command))
+
+    assert result.sent == 2
+    assert stages(history) == {'chat1': 1, 'chat2': 0}
+    assert [peer_id for peer_id, _, _ in history.get_due_reminders(60, 60)] == ['chat1']
+
+
+def test_dispatch_defers_everything_when_batch_fails(history):
+    due = dialogs_written_long_ago(history, 'chat1', 'chat2')
+    bitrix = FakeBitrix(fail=httpx.ConnectError('connection refused'))
+
+    result = asyncio.run(dispatch_reminders(bitrix, history, due, {0: 'Остались вопросы?'}, send_command))
+
+    assert (result.sent, result.deferred, result.failed) == (0, 2, 0)
+    assert stages(history) == {'chat1': 0, 'chat2': 0}
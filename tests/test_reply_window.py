@@ -0,0 +1,54 @@
+import asyncio
+
+
+def answered_with(bot, monkeypatch) -> list:
+    answers = []
+
+    async def answer_dialog(dialog_id, texts):
+        answers.append((dialog_id, texts))
+
+    monkeypatch.setattr(bot, 'answer_dialog', answer_dialog)
+    return answers
+
+
+def close_windows(bot):
+    delayed, bot.engine.delayed = bot.engine.delayed, []
+    for _, coro_fn, args in delayed:
+        asyncio.run(coro_fn(*args))
+
+
+def test_messages_in_window_get_one_reply(bot, monkeypatch):
+    answers = answered_with(bot, monkeypatch)
+
+    async def dialog():
+        for text in ('Здравствуйте', 'Сколько стоит HIFU?', 'И доставка'):
+            await bot.process_message('chat1', text)
+        await bot.process_message('chat2', 'Добрый день')
+
+    asyncio.run(dialog())
+    # Таймер ставит только первое сообщение диалога
+    assert [(delay, args) for delay, _, args in bot.engine.delayed] == [
+        (bot.REPLY_DELAY, ('chat1',)), (bot.REPLY_DELAY, ('chat2',))]
+
+    close_windows(bot)
+    assert answers == [('chat1', ['Здравствуйте', 'Сколько стоит HIFU?', 'И доставка']), ('chat2', ['Добрый день'])]
+    assert bot.pending_messages == {}
+
+    # После ответа следующее сообщение открывает новое окно
+    asyncio.run(bot.process_message('chat1', 'Спасибо'))
+    close_windows(bot)
+    assert answers[-1] == ('chat1', ['Спасибо'])
+
+
+def test_ban_word_drops_window(bot, monkeypatch, history):
+    answers = answered_with(bot, monkeypatch)
+
+    async def dialog():
+        await bot.process_message('chat1', 'Здравствуйте')
+        await bot.process_message('chat1', 'Это спам')
+
+    asyncio.run(dialog())
+    close_windows(bot)
+
+    assert answers == []
+    assert history.in_blacklist('chat1')
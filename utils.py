@@ -1,9 +1,17 @@
 import logging
 import os
+import queue
 import sqlite3
 import sys
-from datetime import datetime
-from typing import List, Dict, Optional
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional, Iterator
+
+import numpy as np
+
+from metrics import stage_seconds
 
 # Настройка логирования для модуля HistoryManager
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -22,17 +30,194 @@ logger.addHandler(consol_handler)
 logger.setLevel(logging.INFO)
 
 
+# Путь к базе истории. В docker-compose база лежит в общем каталоге data/,
+# смонтированном в оба контейнера: WAL держит рядом файлы -wal и -shm,
+# и бот с админкой должны видеть одни и те же.
+HISTORY_DB_PATH = os.getenv('HISTORY_DB_PATH', 'database.sqlt')
+
+# Версионированные миграции схемы database.sqlt.
+# Номер последней применённой миграции хранится в PRAGMA user_version,
+# каждая миграция выполняется в отдельной транзакции.
+SCHEMA_MIGRATIONS: List[tuple[int, List[str]]] = [
+    (1, [
+        """
+        CREATE TABLE IF NOT EXISTS "dialog_history"
+        (
+            id        INTEGER
+                primary key autoincrement,
+            peer_id   TEXT not null,
+            role      TEXT not null,
+            content   TEXT not null,
+            timestamp DATETIME default CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS "blacklist"
+        (
+            peer_id   TEXT,
+            reason    TEXT,
+            timestamp DATETIME default CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS "reminder_status"
+        (
+            peer_id TEXT
+                primary key,
+            stage   INTEGER default 0 not null
+        )
+        """,
+    ]),
+    (2, [
+        # get_history / COUNT(*) в add_message / DISTINCT peer_id
+        "CREATE INDEX IF NOT EXISTS idx_dialog_history_peer_id ON dialog_history (peer_id, id)",
+        # get_last_user_timestamp
+        "CREATE INDEX IF NOT EXISTS idx_dialog_history_peer_role ON dialog_history (peer_id, role, id)",
+        # Перед уникальным ключом оставляем по одной (самой свежей) записи на peer_id
+        """
+        DELETE FROM blacklist
+        WHERE rowid NOT IN (SELECT MAX(rowid) FROM blacklist GROUP BY peer_id)
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_blacklist_peer_id ON blacklist (peer_id)",
+    ]),
+    (3, [
+        # Время последнего сообщения пользователя — индекс сроков напоминаний
+        "ALTER TABLE reminder_status ADD COLUMN last_user_at DATETIME",
+        """
+        INSERT OR IGNORE INTO reminder_status (peer_id, stage)
+        SELECT DISTINCT peer_id, 0 FROM dialog_history
+        """,
+        """
+        UPDATE reminder_status
+        SET last_user_at = (
+            SELECT MAX(timestamp) FROM dialog_history
+            WHERE dialog_history.peer_id = reminder_status.peer_id AND role = 'user'
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_reminder_status_due ON reminder_status (stage, last_user_at)",
+    ]),
+    (4, [
+        # Эмбеддинг реплики пользователя считается один раз, при сохранении реплики
+        """
+        CREATE TABLE IF NOT EXISTS message_embeddings
+        (
+            message_id INTEGER
+                primary key
+                references dialog_history (id) on delete cascade,
+            model      TEXT not null,
+            vector     BLOB not null
+        )
+        """,
+    ]),
+]
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def apply_migrations(conn: sqlite3.Connection, target: Optional[int] = None) -> int:
+    """
+    Применяет к базе все миграции новее PRAGMA user_version (или до target включительно).
+    Возвращает версию схемы после применения.
+    """
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    for version, statements in SCHEMA_MIGRATIONS:
+        if version <= current or (target is not None and version > target):
+            continue
+        # BEGIN IMMEDIATE не даёт двум процессам накатывать одну миграцию одновременно
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+                conn.rollback()
+                continue
+            for sql in statements:
+                conn.execute(sql)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info(f"Схема базы обновлена до версии {version}")
+        current = version
+    return current
+
+
 class HistoryManager:
     """
     Управление историей диалога через SQLite.
+
+    Соединения берутся из пула: каждый вызов получает своё соединение и
+    короткоживущий курсор, поэтому Flask-потоки, таймеры и reminder_worker
+    не делят общий курсор. База работает в режиме WAL — чтения идут
+    параллельно с записью, а конкурирующие записи ждут busy_timeout.
+    Больше 4 соединений не нужно: записи всё равно идут по одной, и
+    benchmarks/bench_history прироста от пула крупнее не показывает.
     """
 
-    def __init__(self, db_path: str = "database.sqlt", max_history_length: int = 10):
+    def __init__(self, db_path: str = HISTORY_DB_PATH, max_history_length: int = 10,
+                 pool_size: int = 4, busy_timeout_ms: int = 5000):
         self.db_path = db_path
         self.max_history = max_history_length
+        self.busy_timeout_ms = busy_timeout_ms
+
+        self._pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=pool_size)
+        self._pool_lock = threading.Lock()
+        self._pool_size = pool_size
+        self._connections: List[sqlite3.Connection] = []
+
+        # Первое соединение сразу переводит файл базы в WAL и накатывает миграции
+        self._pool_created = 1
+        conn = self._connect()
+        apply_migrations(conn)
+        self._pool.put(conn)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # Нужен для ON DELETE CASCADE в message_embeddings
+        conn.execute("PRAGMA foreign_keys=ON")
+        with self._pool_lock:
+            self._connections.append(conn)
+        return conn
 
-        self.conn: sqlite3.Connection = sqlite3.connect(self.db_path, check_same_thread=False)
-        self.cursor: sqlite3.Cursor = self.conn.cursor()
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Выдаёт соединение из пула на время одного вызова.
+        Если свободных нет и лимит пула не исчерпан — открывает новое,
+        иначе ждёт, пока какое-нибудь вернут.
+        """
+        started = time.perf_counter()
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            with self._pool_lock:
+                can_create = self._pool_created < self._pool_size
+                if can_create:
+                    self._pool_created += 1
+            if can_create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    # Место в пуле не занято: иначе после неудачных попыток все ждали бы в get()
+                    with self._pool_lock:
+                        self._pool_created -= 1
+                    raise
+            else:
+                conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._pool.put(conn)
+            # Вместе с ожиданием свободного соединения
+            stage_seconds.observe(time.perf_counter() - started, 'sqlite')
 
     def get_history(self, peer_id: str) -> List[Dict[str, str]]:
         """
@@ -44,32 +229,43 @@ class HistoryManager:
           ]
         Возвращает не более max_history последних записей (в порядке вставки).
         """
-        self.cursor.execute("""
-            SELECT role, content
-            FROM dialog_history
-            WHERE peer_id = ?
-            ORDER BY id ASC
-            LIMIT ?
-        """, (peer_id, self.max_history))
-        rows = self.cursor.fetchall()
+        with self._connection() as conn:
+            rows = conn.execute("""
+                SELECT role, content
+                FROM dialog_history
+                WHERE peer_id = ?
+                ORDER BY id ASC
+                LIMIT ?
+            """, (peer_id, self.max_history)).fetchall()
 
         history = [{"role": row[0], "content": row[1]} for row in rows]
         return history
 
-    def add_message(self, peer_id: str, message: Dict[str, str]):
+    def add_message(self, peer_id: str, message: Dict[str, str],
+                    embedding: Optional[np.ndarray] = None, model: Optional[str] = None):
+        """
+        Сохраняет реплику и возвращает её id. embedding (модели model) хранится
+        рядом с ней и удаляется вместе с репликой, когда та вытесняется из истории.
+        """
         role = message["role"]
         content = message["content"]
 
         # Обёртка in-transaction: автоматически BEGIN/COMMIT
-        with self.conn:
+        with self._connection() as conn, conn:
             # Вставляем новую запись
-            self.conn.execute(
+            message_id = conn.execute(
                 "INSERT INTO dialog_history(peer_id, role, content) VALUES (?, ?, ?)",
                 (peer_id, role, content)
-            )
+            ).lastrowid
+
+            if embedding is not None:
+                conn.execute(
+                    "INSERT INTO message_embeddings (message_id, model, vector) VALUES (?, ?, ?)",
+                    (message_id, model, np.ascontiguousarray(embedding, dtype=np.float32).tobytes())
+                )
 
             # Считаем, сколько записей стало
-            total_count = self.conn.execute(
+            total_count = conn.execute(
                 "SELECT COUNT(*) FROM dialog_history WHERE peer_id = ?",
                 (peer_id,)
             ).fetchone()[0]
@@ -77,7 +273,7 @@ class HistoryManager:
             if total_count > self.max_history:
                 overflow = total_count - self.max_history
                 # Удаляем старые записи в одной транзакции
-                self.conn.execute("""
+                conn.execute("""
                     DELETE FROM dialog_history
                     WHERE id IN (
                         SELECT id FROM dialog_history
@@ -87,81 +283,182 @@ class HistoryManager:
                     )
                 """, (peer_id, overflow))
 
+            if role == "user":
+                # Сдвигаем срок напоминаний: он отсчитывается от последней реплики пользователя
+                conn.execute("""
+                    INSERT INTO reminder_status (peer_id, stage, last_user_at)
+                    VALUES (?, 0, CURRENT_TIMESTAMP)
+                    ON CONFLICT(peer_id) DO UPDATE SET last_user_at = excluded.last_user_at
+                """, (peer_id,))
+        return message_id
+
+    def set_message_embedding(self, message_id: int, embedding: np.ndarray, model: str):
+        """
+        Сохраняет эмбеддинг уже записанной реплики. Если реплика успела
+        вытесниться из истории, ничего не делает.
+        """
+        with self._connection() as conn, conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO message_embeddings (message_id, model, vector)
+                SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM dialog_history WHERE id = ?)
+            """, (message_id, model, np.ascontiguousarray(embedding, dtype=np.float32).tobytes(), message_id))
+
+    def get_user_embeddings(self, peer_id: str, model: str) -> List[np.ndarray]:
+        """
+        Эмбеддинги реплик пользователя из текущей истории, от старых к новым.
+        Реплики без сохранённого вектора (или другой модели) пропускаются.
+        """
+        with self._connection() as conn:
+            rows = conn.execute("""
+                SELECT e.vector
+                FROM dialog_history h
+                JOIN message_embeddings e ON e.message_id = h.id
+                WHERE h.peer_id = ? AND h.role = 'user' AND e.model = ?
+                ORDER BY h.id ASC
+            """, (peer_id, model)).fetchall()
+        return [np.frombuffer(row[0], dtype=np.float32) for row in rows]
+
+    def get_peer_ids(self) -> List[str]:
+        with self._connection() as conn:
+            rows = conn.execute("""
+                SELECT DISTINCT peer_id FROM dialog_history
+            """).fetchall()
+        return [row[0] for row in rows]
+
     def get_last_user_timestamp(self, peer_id: str) -> Optional[datetime]:
-        self.cursor.execute("""
-            SELECT timestamp
-            FROM dialog_history
-            WHERE peer_id = ? AND role = 'user'
-            ORDER BY id DESC
-            LIMIT 1
-        """, (peer_id,))
-        row = self.cursor.fetchone()
+        with self._connection() as conn:
+            row = conn.execute("""
+                SELECT timestamp
+                FROM dialog_history
+                WHERE peer_id = ? AND role = 'user'
+                ORDER BY id DESC
+                LIMIT 1
+            """, (peer_id,)).fetchone()
         if row:
             return datetime.fromisoformat(row[0])
         return None
 
     def get_stage(self, peer_id: str) -> int:
-        self.cursor.execute("""
-            SELECT stage
-            FROM reminder_status
-            WHERE peer_id = ?
-        """, (peer_id,))
-        row = self.cursor.fetchone()
+        with self._connection() as conn:
+            row = conn.execute("""
+                SELECT stage
+                FROM reminder_status
+                WHERE peer_id = ?
+            """, (peer_id,)).fetchone()
         return row[0] if row else 0
 
     def set_stage(self, peer_id: str, stage: int):
         """
         Устанавливает этап напоминаний для peer_id. stage ∈ {0, 1, 2}.
         """
-        self.cursor.execute(
-            "SELECT 1 FROM reminder_status WHERE peer_id = ?",
-            (peer_id,)
-        )
-        exists = self.cursor.fetchone() is not None
+        with self._connection() as conn, conn:
+            conn.execute("""
+                INSERT INTO reminder_status (peer_id, stage) VALUES (?, ?)
+                ON CONFLICT(peer_id) DO UPDATE SET stage = excluded.stage
+            """, (peer_id, stage))
 
-        if not exists:
-            self.cursor.execute(
-                "INSERT INTO reminder_status (peer_id, stage) VALUES (?, ?)",
-                (peer_id, stage)
-            )
-        else:
-            self.cursor.execute(
-                "UPDATE reminder_status SET stage = ? WHERE peer_id = ?",
-                (stage, peer_id)
-            )
-
-        self.conn.commit()
+    def mark_user_activity(self, peer_id: str):
+        """
+        Пользователь написал: этап напоминаний с нуля, срок — от текущего момента.
+        """
+        with self._connection() as conn, conn:
+            # Диалог в чёрном списке напоминаний не получает: строку не создаём
+            conn.execute("""
+                INSERT INTO reminder_status (peer_id, stage, last_user_at)
+                SELECT ?, 0, CURRENT_TIMESTAMP
+                WHERE NOT EXISTS (SELECT 1 FROM blacklist WHERE blacklist.peer_id = ?)
+                ON CONFLICT(peer_id) DO UPDATE SET stage = 0, last_user_at = excluded.last_user_at
+            """, (peer_id, peer_id))
 
     def reset_stage(self, peer_id: str):
-        self.cursor.execute("""
-            DELETE FROM reminder_status
-            WHERE peer_id = ?
-        """, (peer_id,))
-        self.conn.commit()
+        with self._connection() as conn, conn:
+            conn.execute("""
+                UPDATE reminder_status SET stage = 0
+                WHERE peer_id = ?
+            """, (peer_id,))
+
+    def advance_stages(self, transitions: List[tuple[str, int, int, str]]):
+        """
+        Переводит диалоги [(peer_id, from_stage, to_stage, last_user_at), ...] на следующий
+        этап одной транзакцией. last_user_at — значение, прочитанное в get_due_reminders:
+        если пользователь успел написать (этап сброшен или срок сдвинут), диалог не трогается.
+        """
+        with self._connection() as conn, conn:
+            conn.executemany("""
+                UPDATE reminder_status SET stage = ?
+                WHERE peer_id = ? AND stage = ? AND last_user_at = ?
+            """, [(to_stage, peer_id, from_stage, last_user_at)
+                  for peer_id, from_stage, to_stage, last_user_at in transitions])
+
+    def get_due_reminders(self, first_delay: float, second_delay: float,
+                          now: Optional[datetime] = None) -> List[tuple[str, int, str]]:
+        """
+        Возвращает [(peer_id, stage, last_user_at), ...] диалогов, которым пора отправить напоминание:
+        stage 0 — прошло first_delay секунд с последней реплики пользователя,
+        stage 1 — прошло second_delay секунд. Оба условия — поиск по индексу (stage, last_user_at).
+        Диалоги из чёрного списка пропускаются.
+        """
+        now = now or datetime.utcnow()
+        first_cutoff = (now - timedelta(seconds=first_delay)).strftime(TIMESTAMP_FORMAT)
+        second_cutoff = (now - timedelta(seconds=second_delay)).strftime(TIMESTAMP_FORMAT)
+        with self._connection() as conn:
+            rows = conn.execute("""
+                SELECT peer_id, stage, last_user_at FROM reminder_status r
+                WHERE stage = 0 AND last_user_at <= ?
+                  AND NOT EXISTS (SELECT 1 FROM blacklist b WHERE b.peer_id = r.peer_id)
+                UNION ALL
+                SELECT peer_id, stage, last_user_at FROM reminder_status r
+                WHERE stage = 1 AND last_user_at <= ?
+                  AND NOT EXISTS (SELECT 1 FROM blacklist b WHERE b.peer_id = r.peer_id)
+            """, (first_cutoff, second_cutoff)).fetchall()
+        return [(row[0], row[1], row[2]) for row in rows]
+
+    def get_next_reminder_at(self, first_delay: float, second_delay: float) -> Optional[datetime]:
+        """
+        Возвращает момент (UTC), когда наступит срок ближайшего напоминания, или None.
+        """
+        with self._connection() as conn:
+            first, second = conn.execute("""
+                SELECT
+                    (SELECT MIN(last_user_at) FROM reminder_status r WHERE stage = 0
+                       AND NOT EXISTS (SELECT 1 FROM blacklist b WHERE b.peer_id = r.peer_id)),
+                    (SELECT MIN(last_user_at) FROM reminder_status r WHERE stage = 1
+                       AND NOT EXISTS (SELECT 1 FROM blacklist b WHERE b.peer_id = r.peer_id))
+            """).fetchone()
+        candidates = []
+        if first:
+            candidates.append(datetime.fromisoformat(first) + timedelta(seconds=first_delay))
+        if second:
+            candidates.append(datetime.fromisoformat(second) + timedelta(seconds=second_delay))
+        return min(candidates) if candidates else None
 
     def close(self):
-        self.conn.close()
+        with self._pool_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
 
     def in_blacklist(self, peer_id: str) -> bool:
-        self.cursor.execute("""
-        SELECT * FROM blacklist WHERE peer_id = ?""", (peer_id,))
-        exists = self.cursor.fetchone() is not None
+        with self._connection() as conn:
+            exists = conn.execute("""
+            SELECT 1 FROM blacklist WHERE peer_id = ?""", (peer_id,)).fetchone() is not None
         return exists
 
     def put_in_blacklist(self, peer_id: str, reason: str):
-        self.cursor.execute("""
-        INSERT INTO blacklist (peer_id, reason) VALUES (?, ?)""", (peer_id, reason))
+        with self._connection() as conn, conn:
+            conn.execute("""
+            INSERT INTO blacklist (peer_id, reason) VALUES (?, ?)
+            ON CONFLICT(peer_id) DO UPDATE SET reason = excluded.reason, timestamp = CURRENT_TIMESTAMP""",
+                         (peer_id, reason))
 
-        self.cursor.execute("""
-                DELETE FROM dialog_history WHERE peer_id = ?""", (peer_id,))
+            conn.execute("""
+                    DELETE FROM dialog_history WHERE peer_id = ?""", (peer_id,))
 
-        self.cursor.execute("""
-        DELETE FROM reminder_status WHERE peer_id = ?""", (peer_id,))
+            conn.execute("""
+            DELETE FROM reminder_status WHERE peer_id = ?""", (peer_id,))
 
         logger.info(f"Пользователь {peer_id} теперь будет в ЧС по причине: {reason}")
 
-        self.conn.commit()
-
     # url = f'https://{BITRIX_WEBHOOK_KEY}/crm.deal.add.json'
     #
     # params = {